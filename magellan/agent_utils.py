@@ -0,0 +1,216 @@
+"""
+Module containing EnvironmentAgent class.
+
+Client for env_agent.py, a persistent process inside a target environment
+answering interrogation, package_in_env and metadata queries over a
+JSON-lines protocol, so that repeat queries don't each start an interpreter
+and re-import pkg_resources.
+
+This is a library API for callers making many queries against one
+environment, e.g. an interactive session or a service; get one with
+Environment.agent() (see the README). The magellan command line
+interrogates each environment once per run, so doesn't use it.
+"""
+
+import itertools
+import json
+import logging
+import queue
+import shlex
+import subprocess
+import threading
+from pkg_resources import resource_filename as pkg_res_resource_filename
+
+from magellan.utils import MagellanConfig
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+
+class AgentError(Exception):
+    """The agent reported an error, or could not be kept running."""
+    pass
+
+
+class EnvironmentAgent(object):
+    """
+    Starts env_agent.py with python_cmd and sends it requests. If the agent
+    dies, or doesn't answer within timeout seconds (default
+    MagellanConfig.interrogate_timeout, None for no limit) and is killed,
+    it is restarted and the request retried, up to max_restarts times over
+    the agent's life. Requests are serialised, so an agent may be shared
+    between threads.
+
+    Usable as a context manager, which stops the agent on exit.
+    """
+
+    def __init__(self, python_cmd='python', max_restarts=3, timeout=None):
+        self.python_cmd = python_cmd
+        self.max_restarts = max_restarts
+        self.timeout = (MagellanConfig.interrogate_timeout if timeout is None
+                        else timeout)
+        self._lines = None
+        self.restarts = 0
+        self.process = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """Start the agent process if not already running."""
+        if self.alive:
+            return
+        agent_file = pkg_res_resource_filename('magellan', 'env_agent.py')
+        cmd_args = shlex.split(self.python_cmd) + [agent_file]
+        maglog.info("Starting environment agent: {}".format(cmd_args))
+        self.process = subprocess.Popen(
+            cmd_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True, bufsize=1)
+
+        stdout, stderr = self.process.stdout, self.process.stderr
+        # Responses are read on a thread, so _send can stop waiting.
+        self._lines = lines = queue.Queue()
+
+        def _read():
+            try:
+                for line in stdout:
+                    lines.put(line)
+            except (OSError, ValueError):  # closed by _close
+                pass
+            lines.put('')
+
+        def _drain():
+            for line in stderr:
+                maglog.debug("agent: {}".format(line.rstrip()))
+        for target in (_read, _drain):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """Ask the agent to shut down, killing it if it doesn't."""
+        if self.process is None:
+            return
+        if self.alive:
+            try:
+                self._send({'id': 0, 'op': 'shutdown'})
+                self.process.wait(timeout=5)
+            except (OSError, ValueError, AgentError,
+                    subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        self._close()
+
+    def _close(self):
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except (OSError, ValueError):
+                pass
+        self.process = None
+
+    def _send(self, request):
+        """Write request and read its response line.
+
+        :raises AgentError: if the agent has died, or didn't answer within
+        timeout and has been killed
+        """
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+        except (OSError, ValueError) as e:  # e.g. broken pipe
+            raise AgentError("Agent died: {}".format(e))
+        try:
+            line = self._lines.get(timeout=self.timeout or None)
+        except queue.Empty:
+            self.process.kill()
+            raise AgentError("Agent didn't answer {} within {}s, killed"
+                             .format(request.get('op'), self.timeout))
+        if not line:
+            self._lines.put('')  # still at EOF for the next caller
+            raise AgentError("Agent died (exit {})".format(
+                self.process.poll()))
+        return json.loads(line)
+
+    def request(self, op, **params):
+        """
+        Send a request, restarting the agent if it has died.
+
+        :param str op: ping, interrogate, package_in_env, metadata, refresh
+        :return: result of request
+        :raises AgentError: if the agent reports an error or can't be
+        restarted
+        """
+        with self._lock:
+            request = dict(params, op=op, id=next(self._ids))
+            while True:
+                if not self.alive:
+                    if self.process is not None:
+                        self._restart()
+                    else:
+                        self.start()
+                try:
+                    response = self._send(request)
+                    break
+                except AgentError as e:
+                    maglog.info(e)
+                    self._restart()
+
+        if response.get('id') != request['id']:
+            raise AgentError("Out of step response {} to {}".format(
+                response.get('id'), request['id']))
+        if not response.get('ok'):
+            raise AgentError(response.get('error'))
+        return response['result']
+
+    def _restart(self):
+        if self.restarts >= self.max_restarts:
+            raise AgentError("Agent died {} times, giving up".format(
+                self.restarts + 1))
+        self.restarts += 1
+        maglog.info("Restarting environment agent ({} of {})".format(
+            self.restarts, self.max_restarts))
+        if self.process is not None:
+            if self.alive:
+                self.process.kill()
+            self.process.wait()
+            self._close()
+        self.start()
+
+    def ping(self):
+        """:return: {'pid', 'executable'} of agent"""
+        return self.request('ping')
+
+    def interrogate(self):
+        """:return: {'nodes', 'edges', 'package_requirements'}"""
+        return self.request('interrogate')
+
+    def package_in_env(self, package):
+        """As Environment.package_in_env.
+
+        :rtype bool, (str, str)
+        """
+        found, (name, version) = self.request('package_in_env',
+                                              package=package)
+        return found, (name, version)
+
+    def metadata(self, package):
+        """Requirements of an installed package, as package_interrogation.py.
+
+        :rtype dict
+        """
+        return self.request('metadata', package=package)
+
+    def refresh(self):
+        """Re-read the environment's working set, e.g. after installs."""
+        return self.request('refresh')
@@ -0,0 +1,263 @@
+"""
+Module containing ResultCache and SnapshotCache classes.
+
+Caches the results and console output of analysis commands, and snapshots
+of scanned environments, so that repeat invocations against an unchanged
+environment return immediately.
+"""
+
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import threading
+import os
+import sys
+
+from magellan._version import __version__
+from magellan.metadata_utils import EnvironmentScanner
+from magellan.utils import MagellanConfig, mkdir_p
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+
+class _Tee(io.TextIOBase):
+    """Writes to a stream while keeping a copy of everything written."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = io.StringIO()
+
+    def write(self, s):
+        self.buffer.write(s)
+        return self.stream.write(s)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class ResultCache(object):
+    """
+    Cache of analysis command results keyed by environment fingerprint.
+
+    An entry's key combines the fingerprint of the environment snapshot
+    (nodes plus requirement specs), the command and its arguments and the
+    magellan version. Entries live under MagellanConfig.cache_dir in one slot
+    per (environment, command, arguments); when the fingerprint or version
+    changes the slot's entry no longer matches and is discarded.
+    """
+
+    enabled = True
+    subdir = 'results'
+
+    @staticmethod
+    def fingerprint(venv):
+        """Hash of environment nodes and package requirements.
+
+        :param Environment venv: interrogated environment
+        :rtype str
+        """
+        snapshot = {
+            'nodes': sorted([list(n) for n in venv.nodes]),
+            'package_requirements': venv.package_requirements,
+        }
+        return _sha(json.dumps(snapshot, sort_keys=True))
+
+    @staticmethod
+    def entry_path(venv, command, args):
+        """Location of the cache slot for env, command and arguments."""
+        env_id = venv.name or sys.prefix
+        slot = _sha(json.dumps([env_id, command, args], sort_keys=True))
+        return os.path.join(MagellanConfig.cache_dir, ResultCache.subdir,
+                            "{0}_{1}.json".format(command, slot))
+
+    @staticmethod
+    def entry_key(venv, command, args):
+        """Full key of a cache entry."""
+        return _sha(json.dumps(
+            [ResultCache.fingerprint(venv), command, args, __version__],
+            sort_keys=True))
+
+    @staticmethod
+    def run(venv, command, args, func, *func_args, **func_kwargs):
+        """
+        Return func(*func_args, **func_kwargs), replaying the cached console
+        output and result if this command has already run against the same
+        environment.
+
+        :param Environment venv: interrogated environment
+        :param str command: name of command, e.g. "detect_env_conflicts"
+        :param args: JSON serialisable arguments affecting the output
+        :param func: analysis function to run on a miss
+        :return: result of func (JSON round-tripped on a hit)
+        """
+        if not (ResultCache.enabled and MagellanConfig.caching):
+            return func(*func_args, **func_kwargs)
+
+        path = ResultCache.entry_path(venv, command, args)
+        key = ResultCache.entry_key(venv, command, args)
+
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    entry = json.load(f)
+            except (IOError, ValueError) as e:
+                maglog.debug("Unreadable result cache entry {}: {}"
+                             .format(path, e))
+                entry = {}
+
+            if entry.get('key') == key:
+                maglog.info("Result cache hit for {}".format(command))
+                sys.stdout.write(entry['output'])
+                return entry['result']
+
+            # Overwritten below; not removed, as another run sharing the
+            # cache may be replacing it too.
+            maglog.info("Result cache entry for {} is stale, replacing"
+                        .format(command))
+
+        maglog.info("Result cache miss for {}".format(command))
+        tee = _Tee(sys.stdout)
+        with contextlib.redirect_stdout(tee):
+            result = func(*func_args, **func_kwargs)
+
+        try:
+            mkdir_p(os.path.dirname(path))
+            tmp_path = "{0}.{1}.{2}.tmp".format(
+                path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'w') as f:
+                json.dump({'key': key, 'output': tee.buffer.getvalue(),
+                           'result': result}, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            maglog.debug("Unable to write result cache entry {}: {}"
+                         .format(path, e))
+
+        return result
+
+
+class SnapshotCache(object):
+    """
+    Persistent snapshots of scanned environments, keyed by environment path.
+
+    Each distribution's metadata carries an mtime/size fingerprint, so a new
+    scan only re-reads distributions that were added or changed (and drops
+    those removed); everything else, including the built graph when nothing
+    has changed, is reused from the snapshot.
+    """
+
+    subdir = 'env_snapshots'
+    fingerprint_files = ['METADATA', 'PKG-INFO', 'requires.txt']
+
+    @staticmethod
+    def snapshot_path(site_dirs):
+        """Location of snapshot for an environment's site-packages, in
+        path order (which decides the copy used of a package in two)."""
+        return os.path.join(
+            MagellanConfig.cache_dir, SnapshotCache.subdir,
+            "{0}.json".format(_sha(json.dumps(list(site_dirs)))))
+
+    @staticmethod
+    def distribution_fingerprint(path):
+        """mtime/size fingerprint of a distribution's metadata; for an
+        *.egg-link, of the link and the project's egg-info it points to.
+
+        :param str path: *.dist-info, *.egg-info or *.egg-link path
+        :rtype list
+        """
+        to_stat = [path]
+        metadata_dir = EnvironmentScanner.metadata_dir(path)
+        if metadata_dir and metadata_dir != path:
+            to_stat.append(metadata_dir)
+        if metadata_dir and os.path.isdir(metadata_dir):
+            to_stat += [os.path.join(metadata_dir, f)
+                        for f in SnapshotCache.fingerprint_files]
+        fingerprint = []
+        for p in to_stat:
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            fingerprint.append([os.path.basename(p), st.st_mtime_ns,
+                                st.st_size])
+        return fingerprint
+
+    @staticmethod
+    def scan(scanner, refresh=False):
+        """
+        Scan environment using snapshot where possible.
+
+        :param EnvironmentScanner scanner: scanner for the environment
+        :param bool refresh: ignore any existing snapshot
+        :rtype list, list, dict, dict
+        :return: nodes, edges, package_requirements, stats where stats is
+        {'reused', 'read', 'removed'} counts of distributions.
+        """
+        path = SnapshotCache.snapshot_path(scanner.site_dirs)
+        snapshot = {}
+        if not refresh and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    snapshot = json.load(f)
+            except (IOError, ValueError) as e:
+                maglog.debug("Unreadable snapshot {}: {}".format(path, e))
+        if snapshot.get('version') != __version__ or \
+                snapshot.get('python_version') != scanner.python_version:
+            snapshot = {}
+
+        cached = snapshot.get('distributions', {})
+        current = {p: SnapshotCache.distribution_fingerprint(p)
+                   for p in scanner.find_distributions()}
+
+        to_read = [p for p in sorted(current)
+                   if p not in cached or cached[p]['fingerprint'] != current[p]]
+        removed = [p for p in cached if p not in current]
+        stats = {'reused': len(current) - len(to_read),
+                 'read': len(to_read),
+                 'removed': len(removed)}
+
+        maglog.info("Environment snapshot: {reused} distributions reused, "
+                    "{read} read, {removed} removed".format(**stats))
+
+        if snapshot.get('graph') and not to_read and not removed:
+            graph = snapshot['graph']
+            return (graph['nodes'], graph['edges'],
+                    graph['package_requirements'], stats)
+
+        read = scanner.read_distributions(to_read)
+        distributions = {}
+        for p in current:  # in find_distributions order, for build_graph
+            record = read[p] if p in read else cached[p]['record']
+            distributions[p] = {'fingerprint': current[p], 'record': record}
+
+        nodes, edges, package_requirements = scanner.build_graph(
+            [distributions[p]['record'] for p in current
+             if distributions[p]['record']])
+
+        # Round trip so a fresh scan has the same shape as a reused one.
+        graph = json.loads(json.dumps(
+            {'nodes': nodes, 'edges': edges,
+             'package_requirements': package_requirements}))
+        snapshot = {'version': __version__,
+                    'site_dirs': scanner.site_dirs,
+                    'python_version': scanner.python_version,
+                    'distributions': distributions,
+                    'graph': graph}
+        try:
+            mkdir_p(os.path.dirname(path))
+            tmp_path = "{0}.{1}.{2}.tmp".format(
+                path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            maglog.debug("Unable to write snapshot {}: {}".format(path, e))
+
+        return (graph['nodes'], graph['edges'],
+                graph['package_requirements'], stats)
+
+
+def _sha(s):
+    return hashlib.sha256(s.encode('utf-8')).hexdigest()
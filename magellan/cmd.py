@@ -32,9 +32,22 @@ def cmds():
 
     # Optional Arguments
     parser.add_argument(
-        '-n', '--venv-name', default=None, metavar="<venv_name>",
+        '-n', '--venv-name', action='append', default=None,
+        metavar="<venv_name>",
         help=("Specify name of virtual environment, "
-              "if nothing Magellan will use current environment."))
+              "if nothing Magellan will use current environment. "
+              "NB Can be used multiple times to analyse several "
+              "environments."))
+    parser.add_argument(
+        '--venv-glob', action='append', default=None, metavar="<pattern>",
+        help=("Analyse every virtual environment in WORKON_HOME whose name "
+              "matches <pattern>, e.g. 'proj-*'. NB Can be used multiple "
+              "times."))
+    parser.add_argument(
+        '--aggregate', action='store_true', default=False,
+        help=("With several environments, show -s, -p, -O and -C results "
+              "as one report across the environments rather than one per "
+              "environment."))
 
     parser.add_argument(
         '-A', '--get-ancestors', action='append', nargs=1,
@@ -64,11 +77,66 @@ def cmds():
               "multiple times but must always specify desired version. "
               "Usage -P <package-name> <version>."))
 
+    parser.add_argument(
+        '--transitive', action='store_true', default=False,
+        help=("With -P, follow the changes an upgrade forces on its "
+              "dependencies, or the whole dependency tree of an addition, "
+              "through the environment graph rather than just the immediate "
+              "connections."))
+
+    parser.add_argument(
+        '--joint', action='store_true', default=False,
+        help=("With -P, apply all the pins together to a simulated "
+              "environment and check the combined requirements once, rather "
+              "than checking each pin separately."))
+
+    parser.add_argument(
+        '--crawl', action='append', type=str, metavar="<package[range]>",
+        help=("Acquire the dependencies of every release of a package, or "
+              "those in a range (e.g. 'celery>=3,<5'), and print how they "
+              "changed from release to release, then exit. NB Can be used "
+              "multiple times"))
+    parser.add_argument(
+        '--crawl-install', action='store_true', default=False,
+        help=("With --crawl, install releases whose dependencies can't be "
+              "read without installing them, instead of reporting them "
+              "unknown."))
+    parser.add_argument(
+        '--plan-upgrade', nargs=2, metavar=("<package-name>", "<version>"),
+        help=("Plan a sequence of small, consistent upgrade steps through "
+              "the intermediate releases of <package-name> (and the packages "
+              "depending on it) to reach <version>."))
+    parser.add_argument(
+        '--max-step-changes', type=int, default=3,
+        metavar="<max-step-changes>",
+        help="With --plan-upgrade, maximum number of upgrades per step.")
+
     parser.add_argument(
         '-O', '--outdated', action='store_true', default=False,
         help=("Checks whether the major/minor versions of a package "
               "are outdated."))
 
+    parser.add_argument(
+        '--import-profile', action='store_true', default=False,
+        help=("Measure the import time of each package in the environment "
+              "(or of the specified packages and their dependencies) with "
+              "python -X importtime, and of each top-level requirement "
+              "including everything it depends on."))
+
+    parser.add_argument(
+        '--footprint', action='store_true', default=False,
+        help=("Show the disk space taken by each top-level requirement (or "
+              "the specified packages) including its dependencies, and how "
+              "much of that only it uses. With -P, estimate how the changes "
+              "alter the footprint instead."))
+
+    parser.add_argument(
+        '--scan-imports', nargs=2, metavar=("<package-name>", "<source-dir>"),
+        help=("Parse the python files under <source-dir> for imports and "
+              "compare them with the requirements of <package-name> in the "
+              "environment: report requirements never imported and imports "
+              "of packages that aren't required."))
+
     parser.add_argument(
         '-R', '--compare-env-to-req-file', action='store_true', default=False,
         help="Compare a requirements file to an environment."
@@ -98,13 +166,81 @@ def cmds():
     parser.add_argument(
         '--path-to-env-bin', default=None, metavar="<path-to-env-bin>",
         help="Path to virtual env bin")
+    parser.add_argument(
+        '--env-backend', choices=['direct', 'vex'],
+        default=MagellanConfig.env_backend,
+        help="How to find, run and create virtual environments: 'direct' "
+             "uses their bin/python and the stdlib venv module, 'vex' runs "
+             "everything through vex. Default: %(default)s.")
+    parser.add_argument(
+        '--scan-metadata', action='store_true', default=False,
+        help="Build the environment graph by reading dist-info/egg-info "
+             "metadata from its site-packages instead of running python "
+             "inside it.")
+    parser.add_argument(
+        '--refresh', action='store_true', default=False,
+        help="With --scan-metadata, ignore the cached environment snapshot "
+             "and re-read every distribution.")
     parser.add_argument(
         '--cache-dir', type=str, default=MagellanConfig.cache_dir,
         metavar="<cache-dir>",
         help="Cache directory - used for pip installs.")
+    parser.add_argument(
+        '--max-workers', type=int, default=MagellanConfig.max_workers,
+        metavar="<max-workers>",
+        help="Maximum number of concurrent dependency acquisitions.")
+    parser.add_argument(
+        '--prefetch', action='store_true', default=False,
+        help="With -O, -P or -D, fetch PyPI data for packages in the "
+             "background as soon as their names are known, while the "
+             "environment is still being interrogated.")
+    parser.add_argument(
+        '--prefetch-workers', type=int,
+        default=MagellanConfig.prefetch_workers,
+        metavar="<prefetch-workers>",
+        help="With --prefetch, maximum number of concurrent PyPI fetches.")
+    parser.add_argument(
+        '--env-pool-size', type=int, default=MagellanConfig.env_pool_size,
+        metavar="<env-pool-size>",
+        help="Number of temporary environments kept for installing packages "
+             "into when their dependencies can't be read from a wheel; 0 "
+             "creates and deletes one for every install.")
+    parser.add_argument(
+        '--wheel-store-size', type=int, default=None, metavar="<MB>",
+        help="Megabytes of wheels built from sdists to keep for reuse "
+             "(least recently used are removed first); 0 to build every "
+             "time and keep nothing.")
+    parser.add_argument(
+        '--install-timeout', type=int, default=None, metavar="<seconds>",
+        help="Seconds a pip install or build in a temporary environment may "
+             "take before it is killed with its subprocesses; 0 for no "
+             "limit.")
+    parser.add_argument(
+        '--retry-quarantined', action='store_true', default=False,
+        help="Attempt installs that failed recently instead of skipping "
+             "them.")
+    parser.add_argument(
+        '--no-json-metadata', action='store_true', default=False,
+        help="Don't take a package version's dependencies from the "
+             "requires_dist in PyPI's JSON for the release.")
+    parser.add_argument(
+        '--no-wheel-metadata', action='store_true', default=False,
+        help="Always find a package version's dependencies by installing it "
+             "into a temporary environment, rather than reading them from "
+             "its wheel.")
+    parser.add_argument(
+        '--no-sdist-metadata', action='store_true', default=False,
+        help="For releases without a wheel, find a package version's "
+             "dependencies by installing it into a temporary environment, "
+             "rather than reading those declared in its sdist.")
+    parser.add_argument(
+        '--no-result-cache', action='store_true', default=False,
+        help="Don't reuse (or store) cached -A, -Z and -C results for an "
+             "unchanged environment.")
     parser.add_argument(
         '--keep-env-files', action='store_true', default=False,
-        help="Don't delete the nodes, edges, package_requirements env files.")
+        help="Write the nodes, edges, package_requirements env files to "
+             "the current directory.")
 
     parser.add_argument(
         '--no-pip-update', action='store_true', default=False,
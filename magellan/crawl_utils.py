@@ -0,0 +1,298 @@
+"""
+Module containing DependencyCrawler class.
+
+Acquires the requirements of every release of a package (or those in a
+version range) concurrently, without installing anything unless asked to,
+keeps them per package with identical requirement sets stored once, and
+prints how they changed from release to release.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pkg_resources import Requirement, parse_version
+from terminaltables import SingleTable as OutputTableType
+
+from magellan.deps_utils import (DependencyScheduler, DepTools, PyPIHelper,
+                                 _write_json_atomic)
+from magellan.utils import MagellanConfig, mkdir_p, print_col
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+
+def requirement_set(requirements):
+    """
+    Requirements of a release as {project name: specs}, e.g.
+    {'kombu': '<5.0,>=4.0'}; specs sorted so equal sets compare equal.
+
+    :param dict requirements: as DepTools.get_deps_for_package_version
+    :rtype dict
+    """
+    out = {}
+    for r in (requirements.get('requires') or {}).values():
+        out[r['project_name']] = ",".join(
+            sorted("{0}{1}".format(s[0], s[1]) for s in r.get('specs', [])))
+    return out
+
+
+def requirement_set_id(req_set):
+    """Content id of a requirement_set."""
+    return hashlib.sha256(json.dumps(
+        req_set, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def changelog(versions, sets):
+    """
+    Changes in requirements between consecutive releases.
+
+    :param list versions: release versions, oldest first
+    :param dict sets: {version: requirement_set}; versions missing from it
+    are unknown and skipped over
+    :rtype list
+    :return: [{version, added, removed, changed}] for the first known
+    release (everything added) and each release whose requirements differ
+    from the known release before it. added/removed map name to specs,
+    changed maps name to (old specs, new specs).
+    """
+    out = []
+    previous = None
+    for v in versions:
+        if v not in sets:
+            continue
+        current = sets[v]
+        if previous is None or current != previous:
+            before = previous or {}
+            out.append({
+                'version': v,
+                'added': {k: s for k, s in current.items()
+                          if k not in before},
+                'removed': {k: s for k, s in before.items()
+                            if k not in current},
+                'changed': {k: (before[k], s) for k, s in current.items()
+                            if k in before and before[k] != s},
+            })
+        previous = current
+    return out
+
+
+class DependencyCrawler(object):
+    """
+    Requirements of every release of package matching spec (e.g. '>=3,<5';
+    pre-releases and releases without files are left out), acquired on at
+    most max_workers threads (default MagellanConfig.max_workers) from the
+    cheapest source: the crawl store, then a cached
+    get_deps_for_package_version result, then DepTools.get_static_deps
+    (PyPI JSON, wheel metadata, sdist). With install, releases whose
+    requirements are only known by running setup.py are then installed
+    through the DependencyScheduler, otherwise they're reported unknown.
+
+    Results are kept in cache_dir/crawl/<package>.json as:
+
+        {"package": name,
+         "requirement_sets": {id: {name: specs}},
+         "versions": {version: {"set": id, "source": source}}}
+
+    so a set shared by many releases is stored once, and releases already
+    there aren't fetched again. Requirements are those that apply to the
+    running interpreter (environment markers evaluated here).
+    """
+
+    subdir = 'crawl'
+
+    def __init__(self, package, spec='', install=False, max_workers=None):
+        self.package = package
+        self.key = package.lower()
+        self.spec = spec or ''
+        self.install = install
+        if max_workers is None:
+            max_workers = MagellanConfig.max_workers
+        self.max_workers = max(1, max_workers)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_crawl_arg(arg):
+        """
+        Package name and version range from the command line, e.g.
+        'celery>=3,<5' -> ('celery', '<5,>=3').
+
+        :rtype tuple
+        :raises ValueError: if arg isn't a requirement
+        """
+        req = Requirement.parse(arg)
+        return req.project_name, str(req.specifier)
+
+    def store_path(self):
+        return os.path.join(MagellanConfig.cache_dir, self.subdir,
+                            "{}.json".format(self.key))
+
+    def load_store(self):
+        """
+        :rtype dict
+        :return: the crawl store for the package, see class docstring
+        """
+        empty = {'package': self.package, 'requirement_sets': {},
+                 'versions': {}}
+        try:
+            with open(self.store_path(), 'r') as f:
+                store = json.load(f)
+        except (IOError, OSError, ValueError):
+            return empty
+        if not isinstance(store, dict) or not all(
+                isinstance(store.get(k), dict)
+                for k in ('requirement_sets', 'versions')):
+            return empty
+        return store
+
+    def save_store(self, store):
+        """Write the store, dropping requirement sets no release uses."""
+        used = {v['set'] for v in store['versions'].values()}
+        store['requirement_sets'] = {
+            k: s for k, s in store['requirement_sets'].items() if k in used}
+        if not os.path.isdir(MagellanConfig.cache_dir):
+            return
+        mkdir_p(os.path.dirname(self.store_path()))
+        _write_json_atomic(store, self.store_path())
+
+    def versions(self):
+        """
+        Releases on PyPI in the range, oldest first.
+
+        :rtype list
+        """
+        releases = (PyPIHelper.acquire_package_json_info(self.package) or
+                    {}).get('releases', {})
+        req = Requirement.parse(self.package + self.spec)
+        out = []
+        for v, files in releases.items():
+            if not files:
+                continue
+            try:
+                if parse_version(v).is_prerelease or v not in req:
+                    continue
+            except Exception as e:
+                maglog.debug("Skipping version {} of {}: {}"
+                             .format(v, self.package, e))
+                continue
+            out.append(v)
+        return sorted(out, key=parse_version)
+
+    def _static(self, version):
+        """Requirements of a release without installing it, {} if they
+        can't be known that way."""
+        cached_file = DepTools.cached_deps_path(self.package, version)
+        if os.path.exists(cached_file):
+            try:
+                with open(cached_file, 'r') as f:
+                    result = json.load(f)
+                result.setdefault('source', 'cache')
+                return result
+            except (IOError, OSError, ValueError):
+                pass
+        return DepTools.get_static_deps(self.package, version)
+
+    def _add(self, store, version, result):
+        req_set = requirement_set(result)
+        set_id = requirement_set_id(req_set)
+        with self._lock:
+            store['requirement_sets'][set_id] = req_set
+            store['versions'][version] = {
+                'set': set_id, 'source': result.get('source', 'install')}
+
+    def crawl(self):
+        """
+        :rtype dict
+        :return: {package, versions (list, oldest first), sets
+        ({version: requirement_set} of those known), sources ({version:
+        source}), unknown (list of versions), distinct (number of distinct
+        requirement sets)}
+        """
+        versions = self.versions()
+        store = self.load_store()
+        todo = [v for v in versions if v not in store['versions']]
+        maglog.info("Crawling {} of {} releases of {}".format(
+            len(todo), len(versions), self.package))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(zip(todo, executor.map(self._static, todo)))
+        for v, result in results:
+            if result:
+                self._add(store, v, result)
+
+        missing = [v for v in todo if v not in store['versions']]
+        if missing and self.install:
+            acquired = DependencyScheduler(self.max_workers).run(
+                [(self.package, v) for v in missing])
+            for (_, v), result in acquired.items():
+                if result:
+                    self._add(store, v, result)
+
+        self.save_store(store)
+
+        sets = {v: store['requirement_sets'][store['versions'][v]['set']]
+                for v in versions if v in store['versions']}
+        return {
+            'package': self.package,
+            'versions': versions,
+            'sets': sets,
+            'sources': {v: store['versions'][v]['source'] for v in sets},
+            'unknown': [v for v in versions if v not in sets],
+            'distinct': len({requirement_set_id(s) for s in sets.values()}),
+        }
+
+    @staticmethod
+    def print_crawl(result, pretty=False):
+        """Print the dependency changelog of a crawl."""
+        versions = result['versions']
+        if not versions:
+            print_col("No releases of {} found on PyPI.".format(
+                result['package']), pretty=pretty, header=True)
+            return
+
+        print_col("Dependency history of {0}: {1} releases, {2} distinct "
+                  "requirement sets".format(result['package'], len(versions),
+                                            result['distinct']),
+                  pretty=pretty, header=True)
+
+        log = changelog(versions, result['sets'])
+        if log:
+            table_data = [['VERSION', 'SOURCE', 'CHANGES']]
+            for entry in log:
+                lines = (
+                    ["+ {} {}".format(k, s).rstrip()
+                     for k, s in sorted(entry['added'].items())] +
+                    ["- {} {}".format(k, s).rstrip()
+                     for k, s in sorted(entry['removed'].items())] +
+                    ["~ {} {} -> {}".format(k, s[0] or '(any)',
+                                            s[1] or '(any)')
+                     for k, s in sorted(entry['changed'].items())])
+                table_data.append([entry['version'],
+                                   result['sources'][entry['version']],
+                                   "\n".join(lines) or '(no dependencies)'])
+            print_col(OutputTableType(table_data).table, pretty=pretty)
+
+        unchanged = len(result['sets']) - len(log)
+        if unchanged:
+            print_col("{} other releases have the same requirements as the "
+                      "release before them.".format(unchanged), pretty=pretty)
+        if result['unknown']:
+            print_col("Requirements unknown without installing (see "
+                      "--crawl-install): {}".format(
+                          ", ".join(result['unknown'])), pretty=pretty)
+
+    @staticmethod
+    def crawl_and_display(crawl_arg, install=False, pretty=False):
+        """Convenience wrapper for the command line.
+
+        :param str crawl_arg: package, optionally with a version range, e.g.
+        'celery>=3,<5'
+        :rtype dict
+        """
+        package, spec = DependencyCrawler.parse_crawl_arg(crawl_arg)
+        result = DependencyCrawler(package, spec, install).crawl()
+        DependencyCrawler.print_crawl(result, pretty)
+        return result
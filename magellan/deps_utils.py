@@ -1,11 +1,17 @@
 import os
 import operator
-from pkg_resources import parse_version
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from pkg_resources import parse_version, safe_name
 from pkg_resources import resource_filename as pkg_res_resource_filename
 from pprint import pformat
 import requests
 import json
 import logging
+import shutil
+import tempfile
+import threading
+import time
 
 # from terminaltables import AsciiTable as OutputTableType
 from terminaltables import SingleTable as OutputTableType
@@ -13,11 +19,22 @@ from terminaltables import SingleTable as OutputTableType
 
 from magellan.package_utils import Package
 from magellan.env_utils import Environment
-from magellan.utils import MagellanConfig, run_in_subprocess, print_col
+from magellan.env_pool import EnvPoolError, TempEnvPool
+from magellan.metadata_utils import parse_requirement_lines
+from magellan.quarantine import Quarantine
+from magellan.utils import (MagellanConfig, run_in_subprocess, print_col,
+                            run_in_subp_ret_json, DocumentError, mkdir_p,
+                            CommandTimeout)
+from magellan.sdist_utils import SdistHelper
+from magellan.wheel_store import WheelStore
+from magellan.wheel_utils import WheelHelper, best_wheel
 
 # Logging:
 maglog = logging.getLogger("magellan_logger")
 
+# Where DepTools.get_static_deps looks for requirements, in order:
+METADATA_SOURCES = ('pypi-json', 'wheel', 'sdist')
+
 
 class DepTools(object):
     """Tools for conflict detection."""
@@ -152,70 +169,287 @@ class DepTools(object):
                                  requirement_ver, requirement_met)
 
     @staticmethod
-    def get_deps_for_package_version(package, version, vex_options=None):
+    def get_deps_for_package_version(package, version, vex_options=None,
+                                     tmp_env_name=None):
         """Gets dependencies for a specific version of a package.
 
         Specifically:
         0. Check if this has already been done and cached & return that.
+        0.5 Read requirements without installing anything, from the first
+        source in the chain (see get_static_deps) that has them: PyPI's
+        JSON for the release, its wheel, then its sdist. Cache & return that.
+        0.75 Return {} if the install failed recently and is quarantined
+        (see Quarantine), unless MagellanConfig.retry_quarantined.
+        Otherwise (requirements only known by running setup.py):
             1. Set up temporary virtualenv
             2. installs package/version into there using pip
             3. Write file to interrogate through virtual env using
-            vex/pip/setuptool combo
+            env backend (see Environment.backend)/pip/setuptool combo
             4. Run file, which pickles results to temp file
             5. reads that file from current program
             6. deletes file and returns info
 
         7. Delete tmp env?
+
+        The result records where it came from under 'source', one of
+        METADATA_SOURCES or 'install'.
+
+        :param str tmp_env_name: name of temporary env to install into.
+        By default an env is borrowed from the shared TempEnvPool (reset
+        afterwards, see MagellanConfig.env_pool_size), or if the pool is
+        disabled MagellanConfig.tmp_env_dir is recreated. Concurrent callers
+        giving a name must each use a different one. Non-default envs are
+        removed afterwards.
         """
 
         if vex_options is None:
             vex_options = ''
 
-        req_out_file = ("{0}_{1}_req.json"
-                        .format(package.lower(), version.replace(".", "_")))
-
         # 0. Check if this has already been done and cached & return that.
-        cached_file = os.path.join(MagellanConfig.cache_dir, req_out_file)
+        cached_file = DepTools.cached_deps_path(package, version)
 
         if os.path.exists(cached_file):
             maglog.info("Using previously cached result at {0}"
                         .format(cached_file))
             return json.load(open(cached_file, 'r'))
 
-        # 1. Set up temporary virtualenv
-        tmp_env = Environment(name=MagellanConfig.tmp_env_dir)
-        tmp_env.create_vex_new_virtual_env(vex_options)  # NB: delete if extant!!
-
-        # todo (aj); by default?
-        # 1.5 Upgrade pip
-        run_in_subprocess("vex {} {} pip install pip --upgrade"
-                          .format(vex_options, tmp_env.name))
-
-        # 2. installs package/version into there using pip
-        # tmp_pip_options = "--cache-dir {}".format(MagellanConfig.cache_dir)
-        tmp_pip_options = ("--cache-dir {} --no-deps"
-                           .format(MagellanConfig.cache_dir))
-        pip_package_str = '{0}=={1}'.format(package, version)
-        tmp_env.vex_install_requirement(
-            tmp_env.name, pip_package_str, tmp_pip_options, vex_options)
-
-        # 3. File to interrogate through virtual env for package
-        interrogation_file = pkg_res_resource_filename(
-            'magellan', 'package_interrogation.py')
-
-        # 4. Run file, which pickles results to temp file
-        run_in_subprocess("vex {} {} python {} {} {}".format(
-            vex_options, tmp_env.name, interrogation_file, package,
-            MagellanConfig.cache_dir))
-
-        # 5. reads that file from current program
+        # 0.5 Fast paths, nothing installed
+        result = DepTools.get_static_deps(package, version)
+        if result:
+            _write_json_atomic(result, cached_file)
+            return result
+
+        # 0.75 Skip a quarantined install before making an env for it
+        interpreter = Quarantine.interpreter(
+            Environment.backend(vex_options).base_python_cmd())
+        quarantined = Quarantine().check(package, version, interpreter)
+        if quarantined and not MagellanConfig.retry_quarantined:
+            maglog.warning(
+                "Skipping {0} {1}, its install failed {2} time(s) and is "
+                "quarantined until {3}: {4}".format(
+                    package, version, quarantined['failures'],
+                    time.strftime('%Y-%m-%d %H:%M',
+                                  time.localtime(quarantined['retry_after'])),
+                    quarantined['error']))
+            return {}
+
+        # 1. Set up temporary virtualenv, 2-4. install & interrogate
+        if MagellanConfig.env_pool_size and not tmp_env_name:
+            pool = TempEnvPool.shared(vex_options)
+            try:
+                with pool.acquire() as pool_env_name:
+                    result = DepTools._install_and_interrogate(
+                        package, version, pool_env_name, vex_options,
+                        interpreter)
+            except EnvPoolError as e:
+                maglog.warning(e)
+                result = {}
+        else:
+            if tmp_env_name is None:
+                tmp_env_name = MagellanConfig.tmp_env_dir
+            tmp_env = Environment(name=tmp_env_name)
+            # NB: deletes env if extant!!
+            tmp_env.create_vex_new_virtual_env(vex_options)
+
+            # 1.5 Upgrade pip
+            if MagellanConfig.pip_update:
+                try:
+                    run_in_subprocess("{} install pip --upgrade".format(
+                        Environment.backend(vex_options).pip_cmd(
+                            tmp_env.name)), MagellanConfig.install_timeout)
+                except CommandTimeout as e:
+                    maglog.warning(e)
+
+            result = DepTools._install_and_interrogate(
+                package, version, tmp_env.name, vex_options, interpreter)
+
+            if tmp_env_name != MagellanConfig.tmp_env_dir:
+                tmp_env.vex_remove_virtual_env(tmp_env.name, vex_options)
+
+        # 5. cache result
+        if result:
+            result['source'] = 'install'
+            _write_json_atomic(result, cached_file)
+
+        return result
+
+    @staticmethod
+    def get_static_deps(package, version):
+        """
+        Requirements of package==version read without installing it, from
+        the first of METADATA_SOURCES (those enabled in MagellanConfig) that
+        has them:
+
+        pypi-json: requires_dist in PyPI's JSON for the release, see
+        PyPIHelper.get_deps_from_version_json
+        wheel: METADATA in its wheel, see WheelHelper.get_deps_from_wheel
+        sdist: declared in its sdist, see SdistHelper.get_deps_from_sdist
+
+        :rtype dict
+        :return: as get_deps_for_package_version, with 'source'; {} if
+        none of them has the requirements
+        """
+        release_files = None
+        if MagellanConfig.wheel_metadata or MagellanConfig.sdist_metadata:
+            package_json = PyPIHelper.acquire_package_json_info(package)
+            release_files = (package_json or {}).get(
+                'releases', {}).get(version)
+
+        sources = {
+            'pypi-json': (MagellanConfig.json_metadata, lambda:
+                          PyPIHelper.get_deps_from_version_json(
+                              package, version)),
+            'wheel': (MagellanConfig.wheel_metadata, lambda:
+                      WheelHelper.get_deps_from_wheel(
+                          package, version, release_files)),
+            'sdist': (MagellanConfig.sdist_metadata, lambda:
+                      SdistHelper.get_deps_from_sdist(
+                          package, version, release_files)),
+        }
+        for source in METADATA_SOURCES:
+            enabled, get_deps = sources[source]
+            if not enabled:
+                continue
+            result = get_deps()
+            if result:
+                result['source'] = source
+                return result
+        return {}
+
+    @staticmethod
+    def cached_deps_path(package, version):
+        """Where get_deps_for_package_version caches its result."""
+        req_out_file = ("{0}_{1}_req.json"
+                        .format(package.lower(), version.replace(".", "_")))
+        return os.path.join(MagellanConfig.cache_dir, req_out_file)
+
+    @staticmethod
+    def _install_and_interrogate(package, version, env_name, vex_options,
+                                 interpreter=None):
+        """Install package==version (without dependencies) into the
+        temporary env env_name and read its requirements from there.
+
+        Each step runs under a deadline (MagellanConfig.install_timeout,
+        interrogate_timeout) and is killed with its children past it. A
+        failure is recorded in the Quarantine for interpreter (default the
+        backend's base_python_cmd, that temp envs are made from), a success
+        clears it; get_deps_for_package_version checks it first.
+
+        :rtype dict
+        :return: as get_deps_for_package_version, {} on failure
+        """
+        backend = Environment.backend(vex_options)
+        quarantine = Quarantine()
+        if interpreter is None:
+            interpreter = Quarantine.interpreter(backend.base_python_cmd())
+
         try:
-            result = json.load(open(cached_file, 'r'))
-        except IOError:
-            result = {}
+            # 2. installs package/version into there using pip, from the
+            # wheel built from its sdist if there is one (see _built_wheel)
+            tmp_pip_options = ("--cache-dir {} --no-deps"
+                               .format(MagellanConfig.cache_dir))
+            pip_package_str = (
+                DepTools._built_wheel(package, version, env_name,
+                                      vex_options) or
+                '{0}=={1}'.format(package, version))
+            returncode = Environment.vex_install_requirement(
+                env_name, pip_package_str, tmp_pip_options, vex_options,
+                timeout=MagellanConfig.install_timeout)
+            if returncode:
+                raise DocumentError("pip install {0} exited with {1}".format(
+                    pip_package_str, returncode))
+
+            # 3. File to interrogate through virtual env for package
+            interrogation_file = pkg_res_resource_filename(
+                'magellan', 'package_interrogation.py')
+
+            # 4. Run file, which streams results back over stdout
+            result = run_in_subp_ret_json("{} {} {}".format(
+                backend.python_cmd(env_name), interrogation_file, package),
+                timeout=MagellanConfig.interrogate_timeout)
+        except (DocumentError, CommandTimeout) as e:
+            maglog.info("Unable to interrogate {} {}: {}"
+                        .format(package, version, e))
+            quarantine.record(package, version, str(e), interpreter)
+            return {}
 
+        quarantine.clear(package, version, interpreter)
         return result
 
+    @staticmethod
+    def _built_wheel(package, version, env_name, vex_options):
+        """
+        Wheel built from package==version's sdist for env_name's
+        interpreter, if the release has no wheel pip would install there
+        (see best_wheel): from the WheelStore if it has been built before,
+        else built now with pip wheel and added to it.
+
+        Only the sdist is built (--no-binary), so a wheel on the index is
+        never stored as if built from it.
+
+        :rtype str
+        :return: wheel path, or None if the store is disabled, the sdist's
+        hash isn't known or pip install can use a wheel from the index
+        :raises DocumentError: if the build fails, rather than have pip
+        install run the same failing build again
+        """
+        if not MagellanConfig.wheel_store_size:
+            return None
+        package_json = PyPIHelper.acquire_package_json_info(package)
+        release_files = (package_json or {}).get('releases', {}).get(version)
+        sdist_sha256 = WheelStore.sdist_sha256(release_files)
+        if not sdist_sha256:
+            return None
+        backend = Environment.backend(vex_options)
+        python_cmd = backend.python_cmd(env_name)
+        target = WheelStore.interpreter_target(python_cmd)
+        if not target or best_wheel(release_files, *target, any_wheel=False):
+            return None
+        tag = WheelStore.interpreter_tag(python_cmd)
+        if not tag:
+            return None
+
+        store = WheelStore()
+        wheel_path = store.get(sdist_sha256, tag)
+        if wheel_path:
+            maglog.info("Using stored wheel {}".format(wheel_path))
+            return wheel_path
+
+        build_dir = tempfile.mkdtemp(prefix='magellan_wheel_')
+        try:
+            returncode = run_in_subprocess(
+                "{0} wheel --no-deps --no-binary {3} --cache-dir {1} -w {2} "
+                "{3}=={4}".format(
+                    backend.pip_cmd(env_name), MagellanConfig.cache_dir,
+                    build_dir, package, version),
+                MagellanConfig.install_timeout)
+            built = WheelStore._wheel_in(build_dir)
+            if returncode or built is None:
+                raise DocumentError(
+                    "pip wheel {0}=={1} exited with {2}".format(
+                        package, version, returncode))
+            return store.add(sdist_sha256, tag, built)
+        except (IOError, OSError) as e:
+            maglog.info("Unable to store wheel of {} {}: {}".format(
+                package, version, e))
+            return None
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    @staticmethod
+    def acquire_deps_for_package_versions(package_versions, max_workers=None):
+        """
+        Gets dependencies for many (package, version) pairs concurrently,
+        see DependencyScheduler.
+
+        :param list package_versions: list of (package, version) tuples
+        :param int max_workers: size of thread pool, defaults to
+        MagellanConfig.max_workers
+        :rtype dict
+        :return: {(package, version): requirements}, in the order given
+        """
+        return DependencyScheduler(max_workers).run(package_versions)
+
     @staticmethod
     def check_if_ancestors_still_satisfied(
             package, new_version, ancestors, package_requirements):
@@ -288,6 +522,13 @@ class DepTools(object):
         :param Environment venv: virtual environment
         """
 
+        # Acquire the new versions' requirements up front, concurrently:
+        acquired = DepTools.acquire_deps_for_package_versions(
+            [(u[0], u[1]) for u in packages
+             if parse_version(venv.all_packages[u[0].lower()].version)
+             != parse_version(u[1])
+             and PyPIHelper.check_package_version_on_pypi(u[0], u[1])])
+
         uc_deps = {}
         conflicts = {}
         for u in packages:
@@ -310,9 +551,7 @@ class DepTools(object):
             if not PyPIHelper.check_package_version_on_pypi(package, version):
                 continue
 
-            uc_deps[p_v]['requirements'] = \
-                DepTools.get_deps_for_package_version(
-                    package, version, vex_options=MagellanConfig.vex_options)
+            uc_deps[p_v]['requirements'] = acquired[(package, version)]
 
             ancestors, descendants = Package.get_direct_links_to_any_package(
                 package, venv.edges)
@@ -347,6 +586,165 @@ class DepTools(object):
 
         return conflicts, uc_deps
 
+    @staticmethod
+    def detect_transitive_upgrade_conflicts(packages, venv, pretty=False,
+                                            max_workers=None):
+        """
+        Detect conflicts when upgrading packages, following the knock-on
+        changes the upgrade forces on the rest of the environment.
+
+        Where detect_upgrade_conflicts stops at the immediate connections,
+        this routine propagates:
+
+        1. FORCED CHANGES
+            Any dependency of the new version whose current version no longer
+            satisfies the required specs is moved to the latest version on
+            PyPI that does. Its requirements are then checked in turn, wave
+            by wave, until nothing else needs to change. The requirements of
+            each wavefront are acquired concurrently.
+
+        2. ANCESTOR DEPENDENCIES
+            Once the set of changes is settled, every package that depends on
+            a changed package has its specs re-checked against the simulated
+            versions (using the new requirements where the ancestor itself
+            has changed).
+
+        3. AT RISK
+            Package.ancestor_trace of each changed package, i.e. everything
+            upstream that may be affected.
+
+        :param list packages: List of (package, desired_version)'s
+        :param Environment venv: virtual environment
+        :param int max_workers: concurrent requirement acquisitions
+        :rtype dict
+        :return: {package_version: {changes, conflicts, unresolved,
+        missing, at_risk}}
+        """
+
+        ver_info = {x[0].lower(): x[1] for x in venv.nodes}
+        name_info = {x[0].lower(): x[0] for x in venv.nodes}
+
+        results = {}
+        for u in packages:
+            package = u[0]
+            version = u[1]
+            p_key = package.lower()
+            p_v = "{0}_{1}".format(package, version.replace('.', '_'))
+
+            if p_key not in ver_info:
+                maglog.info("{} not in environment, skipping transitive "
+                            "upgrade analysis".format(package))
+                continue
+
+            if not PyPIHelper.check_package_version_on_pypi(package, version):
+                results[p_v] = {'status': "No package info on PyPI."}
+                continue
+
+            # key: (project_name, current_version, new_version, level)
+            changes = {p_key: (name_info[p_key], ver_info[p_key], version, 0)}
+            new_requirements = {}
+            unresolved = []
+            missing = []
+
+            level = 0
+            wavefront = [(package, version)]
+            while wavefront:
+                acquired = DepTools.acquire_deps_for_package_versions(
+                    wavefront, max_workers)
+                level += 1
+                next_wavefront = []
+                for w_pkg, w_ver in wavefront:
+                    requirements = acquired.get((w_pkg, w_ver)) or {}
+                    new_requirements[w_pkg.lower()] = requirements
+
+                    for r in list(requirements.get('requires', {}).values()):
+                        r_key = r['key']
+                        if r_key not in ver_info:
+                            if r['project_name'] not in missing:
+                                missing.append(r['project_name'])
+                            continue
+
+                        if r_key in changes:
+                            continue  # settled; checked in final pass.
+
+                        satisfied = all(
+                            DepTools.check_requirement_satisfied(
+                                ver_info[r_key], s)[0] for s in r['specs'])
+                        if satisfied:
+                            continue
+
+                        new_ver = PyPIHelper.latest_version_satisfying(
+                            r['project_name'], r['specs'])
+                        if new_ver is None:
+                            unresolved.append(
+                                (w_pkg, r['project_name'], r['specs']))
+                            continue
+
+                        changes[r_key] = (name_info[r_key], ver_info[r_key],
+                                          new_ver, level)
+                        next_wavefront.append((r['project_name'], new_ver))
+
+                wavefront = next_wavefront
+
+            # Final pass over simulated environment:
+            sim_ver = dict(ver_info)
+            sim_ver.update({k: v[2] for k, v in list(changes.items())})
+
+            conflicts = []
+            for c_key in changes:
+                # Changed package's own requirements:
+                reqs = new_requirements.get(c_key, {}).get('requires', {})
+                for r in list(reqs.values()):
+                    if r['key'] not in sim_ver:
+                        continue
+                    for s in r['specs']:
+                        ok, dets = DepTools.check_requirement_satisfied(
+                            sim_ver[r['key']], s)
+                        if not ok:
+                            conflicts.append(
+                                ((changes[c_key][0], changes[c_key][2]),
+                                 r['project_name'], dets))
+
+                # Unchanged ancestors depending on changed package:
+                ancestors, _ = Package.get_direct_links_to_any_package(
+                    c_key, venv.edges)
+                for anc in ancestors:
+                    a_key = anc[0][0].lower()
+                    if a_key == 'root' or a_key in changes:
+                        continue
+                    try:
+                        specs = venv.package_requirements[a_key][
+                            'requires'][c_key]['specs']
+                    except KeyError:
+                        continue
+                    for s in specs:
+                        ok, dets = DepTools.check_requirement_satisfied(
+                            sim_ver[c_key], s)
+                        if not ok:
+                            conflicts.append(((anc[0][0], anc[0][1]),
+                                              changes[c_key][0], dets))
+
+            at_risk = {}
+            for c_key in changes:
+                if c_key not in venv.all_packages:
+                    continue
+                trace = venv.all_packages[c_key].ancestor_trace(venv)
+                for n, dist in list(trace.items()):
+                    n_key = n[0].lower()
+                    if n_key == 'root' or n_key in changes:
+                        continue
+                    if n not in at_risk or dist < at_risk[n]:
+                        at_risk[n] = dist
+
+            results[p_v] = {'changes': changes,
+                            'conflicts': conflicts,
+                            'unresolved': unresolved,
+                            'missing': missing,
+                            'at_risk': at_risk, }
+
+        DepTools.table_print_transitive_upgrade_conflicts(results, pretty)
+        return results
+
     @staticmethod
     def highlight_conflicts_in_current_env(
             nodes, package_requirements, pretty=False):
@@ -362,6 +760,22 @@ class DepTools(object):
             print("venv missing required data: nodes or package_requirements.")
             return []
 
+        current_env_conflicts = DepTools.find_conflicts_in_env(
+            nodes, package_requirements)
+
+        DepTools.table_print_cur_env_conflicts(current_env_conflicts, pretty)
+        return current_env_conflicts
+
+    @staticmethod
+    def find_conflicts_in_env(nodes, package_requirements):
+        """
+        Checks every requirement of every node against the node versions.
+
+        :param list nodes: list of nodes (packages) as (name, ver) tuple
+        :param dict package_requirements: dependencies dictionary.
+        :rtype list
+        :return: conflicts as (node, dependency_name, requirement_details)
+        """
         current_env_conflicts = []
 
         ver_info = {n[0].lower(): n[1] for n in nodes}
@@ -388,16 +802,112 @@ class DepTools(object):
                     maglog.debug("KeyError for {}".format(r))
                     cur_ver = ''
                 for s in node_requirements[r]['specs']:
-                    req_met, req_details = \
-                        DepTools.check_requirement_satisfied(cur_ver, s)
+                    try:
+                        req_met, req_details = \
+                            DepTools.check_requirement_satisfied(cur_ver, s)
+                    except ValueError as e:
+                        # unparseable version (InvalidVersion is a
+                        # ValueError), e.g. '' for a requirement that isn't
+                        # installed: reported as a conflict
+                        maglog.debug("Unable to compare {} to {}: {}"
+                                     .format(cur_ver, s, e))
+                        req_met = False
+                        req_details = (cur_ver, s[0], s[1], False)
                     if not req_met:
                         current_env_conflicts.append(
                             (n, node_requirements[r]['project_name'],
                              req_details))
 
-        DepTools.table_print_cur_env_conflicts(current_env_conflicts, pretty)
         return current_env_conflicts
 
+    @staticmethod
+    def detect_joint_package_conflicts(conflict_list, venv, pretty=False,
+                                       max_workers=None):
+        """
+        Evaluate all the -P pins together as one change set.
+
+        Rather than checking each (package, version) separately against the
+        unchanged environment, all pins are applied to a simulated copy of the
+        environment and the combined requirement graph is checked once. The
+        requirements of every pin are acquired concurrently up front.
+
+        :param conflict_list: list of (package, version) tuples passed in
+        from CLI
+        :param venv: magellan.env_utils.Environment
+        :param int max_workers: concurrent requirement acquisitions
+        :rtype dict
+        :return: {pins, conflicts, introduced, resolved, missing}
+
+        "conflicts" are all conflicts in the simulated environment,
+        "introduced" those not present before the change set and "resolved"
+        the current environment conflicts the change set removes.
+        """
+        pins = []
+        for p in conflict_list:
+            package, version = p[0], p[1]
+            if not PyPIHelper.check_package_version_on_pypi(package, version):
+                print_col("{} {} not found on PyPI, ignoring."
+                          .format(package, version), pretty=pretty)
+                continue
+            pins.append((package, version))
+
+        acquired = DepTools.acquire_deps_for_package_versions(
+            pins, max_workers)
+
+        sim_nodes = {x[0].lower(): (x[0], x[1]) for x in venv.nodes}
+        sim_package_requirements = dict(venv.package_requirements)
+        failed = []
+        for package, version in pins:
+            p_key = package.lower()
+            requirements = acquired.get((package, version))
+            if not requirements:
+                failed.append("{} {}".format(package, version))
+                continue
+            sim_nodes[p_key] = (sim_nodes.get(p_key, (package,))[0], version)
+            sim_package_requirements[p_key] = {
+                'project_name': requirements['project_name'],
+                'version': version,
+                'requires': {
+                    k: {'project_name': r['project_name'],
+                        'specs': r['specs']}
+                    for k, r in list(requirements['requires'].items())}}
+
+        sim_nodes = list(sim_nodes.values())
+
+        missing = sorted(set(
+            r['project_name']
+            for package, version in pins
+            for r in list(sim_package_requirements.get(
+                package.lower(), {}).get('requires', {}).values())
+            if r['project_name'].lower() not in
+            [n[0].lower() for n in sim_nodes]))
+
+        def _conflict_id(c):
+            return c[0][0].lower(), c[1].lower()
+
+        current = DepTools.find_conflicts_in_env(
+            venv.nodes, venv.package_requirements)
+        joint = [c for c in DepTools.find_conflicts_in_env(
+            sim_nodes, sim_package_requirements)
+            if c[1] not in missing]
+
+        current_ids = set(_conflict_id(c) for c in current)
+        joint_ids = set(_conflict_id(c) for c in joint)
+
+        result = {
+            'pins': pins,
+            'failed': failed,
+            'conflicts': joint,
+            'introduced': [c for c in joint
+                           if _conflict_id(c) not in current_ids],
+            'resolved': [c for c in current
+                         if _conflict_id(c) not in joint_ids],
+            'missing': missing,
+        }
+
+        DepTools.table_print_joint_package_conflicts(result, pretty)
+        return result
+
     @staticmethod
     def detect_package_addition_conflicts(packages, venv):
         """
@@ -417,6 +927,13 @@ class DepTools(object):
         """
         ver_info = {x[0].lower(): x[1] for x in venv.nodes}
 
+        # Acquire the new packages' requirements up front, concurrently:
+        acquired = DepTools.acquire_deps_for_package_versions(
+            [(p[0], p[1]) for p in packages
+             if PyPIHelper.check_package_version_on_pypi(p[0], p[1])
+             and not DepTools.package_in_environment(
+                 p[0], p[1], venv.nodes)[0]])
+
         deps = {}
         for p in packages:
             package = p[0]
@@ -440,9 +957,8 @@ class DepTools(object):
                     "Package currently exists - use  upgrade -U.")
                 continue
 
-            # Get requirements if it's actually a new package & on PyPI.
-            requirements = DepTools.get_deps_for_package_version(
-                package, version, vex_options=MagellanConfig.vex_options)
+            # Requirements if it's actually a new package & on PyPI.
+            requirements = acquired[(package, version)]
 
             deps[p_v]['requirements'] = requirements
             deps[p_v]['new_packages'] = []
@@ -477,6 +993,129 @@ class DepTools(object):
 
         return deps
 
+    @staticmethod
+    def detect_transitive_package_addition_conflicts(packages, venv,
+                                                     max_workers=None):
+        """
+        Detect conflicts with the addition of a new package, walking its
+        whole dependency tree rather than just its direct requirements.
+
+        The tree is walked breadth first. Requirements not in the environment
+        are resolved to the latest version on PyPI satisfying every spec
+        placed on them by that level, and each level's requirements are
+        acquired concurrently (deduplicated across the level).
+
+        :param packages: list of (name, version) tuple
+        :param venv: virtual env where package will be installed, of type
+        magellan.env_utils.Environment
+        :param int max_workers: concurrent requirement acquisitions
+        :rtype dict
+        :return: conflicts, as detect_package_addition_conflicts with the
+        addition of "new_conflicts", "unresolved" and "levels"; "new_packages"
+        contain (name, version, level) tuples.
+        """
+        ver_info = {x[0].lower(): x[1] for x in venv.nodes}
+
+        deps = {}
+        for p in packages:
+            package = p[0]
+            version = p[1]
+            p_v = "{0}_{1}".format(package, version.replace('.', '_'))
+
+            deps[p_v] = {}
+
+            if not PyPIHelper.check_package_version_on_pypi(package, version):
+                print(("Cannot get package info for {} {} on PyPI"
+                      .format(package, version)))
+                deps[p_v]['status'] = "No package info on PyPI."
+                continue
+
+            p_extant, details = DepTools.package_in_environment(
+                package, version, venv.nodes)
+            if p_extant:
+                deps[p_v]['status'] = (
+                    "Package currently exists - use  upgrade -U.")
+                continue
+
+            new_versions = {package.lower(): version}
+            new_packages = []
+            may_try_upgrade = []
+            may_be_okay = []
+            new_conflicts = []
+            unresolved = []
+            levels = []
+
+            level = [(package, version)]
+            while level:
+                levels.append(level)
+                acquired = DepTools.acquire_deps_for_package_versions(
+                    level, max_workers)
+                pending = {}
+                for w_pkg, w_ver in level:
+                    requirements = acquired.get((w_pkg, w_ver)) or {}
+                    if (w_pkg, w_ver) == (package, version):
+                        deps[p_v]['requirements'] = requirements
+
+                    for r in list(requirements.get('requires', {}).values()):
+                        r_key = r['key']
+                        label = "{0} -> {1}".format(w_pkg, r['project_name'])
+
+                        if r_key in ver_info:
+                            if not r['specs']:
+                                may_be_okay.append(label)
+                            for s in r['specs']:
+                                res, deets = \
+                                    DepTools.check_requirement_satisfied(
+                                        ver_info[r_key], s)
+                                if not res:
+                                    may_try_upgrade.append((label, deets))
+                                else:
+                                    may_be_okay.append((label, deets))
+
+                        elif r_key in new_versions:
+                            for s in r['specs']:
+                                res, deets = \
+                                    DepTools.check_requirement_satisfied(
+                                        new_versions[r_key], s)
+                                if not res:
+                                    new_conflicts.append((label, deets))
+
+                        else:
+                            if r_key not in pending:
+                                pending[r_key] = {
+                                    'project_name': r['project_name'],
+                                    'specs': [], 'required_by': []}
+                            pending[r_key]['specs'] += r['specs']
+                            pending[r_key]['required_by'].append(w_pkg)
+
+                next_level = []
+                for r_key in sorted(pending):
+                    r = pending[r_key]
+                    new_ver = PyPIHelper.latest_version_satisfying(
+                        r['project_name'], r['specs'])
+                    if new_ver is None:
+                        unresolved.append(
+                            (r['project_name'], r['specs'], r['required_by']))
+                        continue
+                    new_versions[r_key] = new_ver
+                    new_packages.append(
+                        (r['project_name'], new_ver, len(levels)))
+                    next_level.append((r['project_name'], new_ver))
+                level = next_level
+
+            if not deps[p_v].get('requirements'):
+                deps[p_v] = {"status": "NO DATA returned from function."}
+                continue
+
+            deps[p_v]['new_packages'] = new_packages
+            deps[p_v]['may_try_upgrade'] = may_try_upgrade
+            deps[p_v]['may_be_okay'] = may_be_okay
+            deps[p_v]['new_conflicts'] = new_conflicts
+            deps[p_v]['unresolved'] = unresolved
+            deps[p_v]['levels'] = levels
+
+        return deps
+
     @staticmethod
     def package_in_environment(package, version, nodes):
         """
@@ -509,11 +1148,13 @@ class DepTools(object):
             return False, {}
 
     @staticmethod
-    def process_package_conflicts(conflict_list, venv, pretty=False):
+    def process_package_conflicts(conflict_list, venv, pretty=False,
+                                  transitive=False):
         """
         :param conflict_list: list of (package, version) tuples passed in
         from CLI
         :param venv: magellan.env_utils.Environment
+        :param bool transitive: follow knock-on changes through the graph
         :return: addition_conflicts, upgrade_conflicts
         """
         upgrade_conflicts = []
@@ -525,7 +1166,13 @@ class DepTools(object):
             else:  # NB: may also be non-existent package
                 addition_conflicts.append(p)
 
-        if upgrade_conflicts:
+        if upgrade_conflicts and transitive:
+            maglog.info(upgrade_conflicts)
+            upgrade_conflicts = DepTools.detect_transitive_upgrade_conflicts(
+                upgrade_conflicts, venv, pretty)
+            maglog.info(pformat(upgrade_conflicts))
+
+        elif upgrade_conflicts:
             maglog.info(upgrade_conflicts)
             upgrade_conflicts, uc_deps = DepTools.detect_upgrade_conflicts(
                 upgrade_conflicts, venv, pretty)
@@ -535,7 +1182,17 @@ class DepTools(object):
             maglog.info(pformat(upgrade_conflicts))
             maglog.debug(pformat(uc_deps))
 
-        if addition_conflicts:
+        if addition_conflicts and transitive:
+            maglog.info(addition_conflicts)
+            addition_conflicts = \
+                DepTools.detect_transitive_package_addition_conflicts(
+                    addition_conflicts, venv)
+
+            DepTools.table_print_additional_package_conflicts(
+                addition_conflicts, pretty)
+            maglog.info(pformat(addition_conflicts))
+
+        elif addition_conflicts:
             maglog.info(addition_conflicts)
             addition_conflicts = DepTools.detect_package_addition_conflicts(
                 addition_conflicts, venv)
@@ -609,6 +1266,81 @@ class DepTools(object):
 
             print("\n")
 
+    @staticmethod
+    def table_print_transitive_upgrade_conflicts(results, pretty=False):
+        """
+        Prints the output of detect_transitive_upgrade_conflicts.
+
+        :param dict results: transitive upgrade results
+        """
+        if not results:
+            return
+        print_col("Transitive Upgrade Conflicts:", pretty=pretty, header=True)
+
+        for p_k, p in sorted(results.items()):
+            if 'status' in p:
+                print_col("{}: {}".format(p_k, p['status']), pretty=pretty)
+                continue
+
+            changes = sorted(list(p['changes'].values()),
+                             key=lambda x: (x[3], x[0].lower()))
+            table_data = [['LEVEL', 'PACKAGE', 'FROM', 'TO']]
+            for name, cur_ver, new_ver, level in changes:
+                table_data.append([str(level), name, cur_ver, new_ver])
+            print_col(OutputTableType(table_data).table, pretty=pretty)
+
+            if not (p['conflicts'] or p['unresolved']):
+                print_col("No conflicts detected", pretty=pretty)
+            else:
+                DepTools.table_print_cur_env_conflicts(p['conflicts'], pretty)
+
+            unresolved = ["{0} requires {1} {2}; no version on PyPI satisfies"
+                          .format(x[0], x[1], x[2]) for x in p['unresolved']]
+            at_risk = ["{0} {1} (distance {2})".format(n[0], n[1], d)
+                       for n, d in sorted(p['at_risk'].items(),
+                                          key=lambda x: (x[1], x[0]))]
+
+            _print_if(unresolved, "Unresolvable requirements:", pretty=pretty)
+            _print_if(p['missing'],
+                      "Packages not in environment (to be installed):",
+                      pretty=pretty)
+            _print_if(at_risk, "Packages upstream that may be affected:",
+                      pretty=pretty)
+            print("\n")
+
+    @staticmethod
+    def table_print_joint_package_conflicts(result, pretty=False):
+        """
+        Prints the output of detect_joint_package_conflicts.
+
+        :param dict result: joint conflicts
+        """
+        pins = ", ".join("{} {}".format(*p) for p in result['pins'])
+        print_col("Joint Package Conflicts for: {}".format(pins),
+                  pretty=pretty, header=True)
+
+        _print_if(result['failed'], "Requirements not found for:",
+                  pretty=pretty)
+        _print_if(result['missing'],
+                  "Packages not in environment (to be installed):",
+                  pretty=pretty)
+
+        print_col("Conflicts introduced by the change set:", pretty=pretty)
+        DepTools.table_print_cur_env_conflicts(result['introduced'], pretty)
+
+        resolved = ["{0} {1}: {2}".format(c[0][0], c[0][1], c[1])
+                    for c in result['resolved']]
+        _print_if(resolved, "Current conflicts resolved by the change set:",
+                  pretty=pretty)
+
+        remaining = [c for c in result['conflicts']
+                     if c not in result['introduced']]
+        if remaining:
+            print_col("Conflicts remaining from current environment:",
+                      pretty=pretty)
+            DepTools.table_print_cur_env_conflicts(remaining, pretty)
+        print("\n")
+
     @staticmethod
     def table_print_additional_package_conflicts(conflicts, pretty=False):
         """
@@ -636,8 +1368,14 @@ class DepTools(object):
             okay = p['may_be_okay']
             up = p['may_try_upgrade']
             new_ps = p['new_packages']
-
-            if not (okay or up or new_ps):
+            # Transitive analysis only:
+            new_conflicts = p.get('new_conflicts', [])
+            unresolved = ["{0} {1} required by {2}".format(
+                x[0], x[1], ", ".join(x[2])) for x in p.get('unresolved', [])]
+            new_ps = ["{0} {1} (level {2})".format(*x)
+                      if type(x) == tuple else x for x in new_ps]
+
+            if not (okay or up or new_ps or new_conflicts or unresolved):
                 s = ("  No conflicts detected for the addition of {0} {1}."
                      .format(p_name, ver))
                 print_col(s, pretty=pretty)
@@ -645,6 +1383,10 @@ class DepTools(object):
             _print_if(okay, "Should be okay:", pretty=pretty)
             _print_if(up, "May try to upgrade:", pretty=pretty)
             _print_if(new_ps, "New packages to add:", pretty=pretty)
+            _print_if(new_conflicts, "Conflicts between new packages:",
+                      pretty=pretty)
+            _print_if(unresolved, "Unresolvable requirements:",
+                      pretty=pretty)
 
             print("\n")
 
@@ -689,17 +1431,20 @@ class DepTools(object):
         Gets the dependencies information by installing the package and
         version from PyPI
         """
+        on_pypi = [(p[0], p[1]) for p in package_version_list
+                   if PyPIHelper.check_package_version_on_pypi(p[0], p[1])]
+        acquired = DepTools.acquire_deps_for_package_versions(on_pypi)
+
         for p in package_version_list:
             package = p[0]
             version = p[1]
 
-            if not PyPIHelper.check_package_version_on_pypi(package, version):
+            if (package, version) not in acquired:
                 print_col("{} {} not found on PyPI.".format(package, version),
                           pretty=pretty, header=True)
                 continue
 
-            requirements = DepTools.get_deps_for_package_version(
-                package, version, vex_options=MagellanConfig.vex_options)
+            requirements = acquired[(package, version)]
 
             maglog.debug(pformat(requirements))
             _table_print_requirements(requirements, pretty)
@@ -817,6 +1562,9 @@ def _table_print_requirements(requirements, pretty=False):
         print_col(s, pretty=pretty, header=True)
     else:
         s = "Dependencies of {} {}:".format(package, version)
+        if requirements.get('source'):
+            s = "Dependencies of {} {} (from {}):".format(
+                package, version, requirements['source'])
         print_col(s, pretty=pretty, header=True)
 
         table_data = [['PACKAGE', 'SPECS']]
@@ -876,6 +1624,21 @@ def _string_requirement_details(dets):
     return s
 
 
+def _write_json_atomic(obj, filename):
+    """
+    Write obj as JSON to filename via a temporary file, so concurrent readers
+    never see a partial file.
+    """
+    tmp_filename = "{0}.{1}.{2}.tmp".format(
+        filename, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_filename, 'w') as f:
+            json.dump(obj, f)
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError) as e:
+        maglog.debug("Unable to write {}: {}".format(filename, e))
+
+
 def _return_interrogation_script_json(package, filename=None):
     """Return script to interrogate deps for package inside env.
     Uses json.dump instead of pickle due to cryptic pickle/requests bug."""
@@ -912,9 +1675,226 @@ for r in p.requires():
     return head + nl + mid + nl + conv + nl + out + nl + end + nl
 
 
+class PyPIPrefetcher(object):
+    """
+    Speculatively warms PyPIHelper's package JSON cache in the background,
+    e.g. for package names found while an environment is still being
+    interrogated.
+
+    Fetches run on a thread pool of at most max_workers (the concurrency
+    budget, default MagellanConfig.prefetch_workers). Speculative names that
+    turn out not to be needed are cancelled if not yet started, and close
+    cancels anything else not yet started.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or MagellanConfig.prefetch_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, self.max_workers))
+        self._futures = {}
+        self._needed = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, names, speculative=False):
+        """Queue names for fetching; names already queued are skipped.
+
+        :param list names: package names
+        :param bool speculative: names may not be needed; see
+        drop_speculative
+        """
+        with self._lock:
+            if self._closed:
+                return
+            for name in names:
+                key = name.lower()
+                if not speculative:
+                    self._needed.add(key)
+                future = self._futures.get(key)
+                if future is None or future.cancelled():
+                    self._futures[key] = self._executor.submit(
+                        PyPIHelper.acquire_package_json_info, name)
+
+    def drop_speculative(self):
+        """Cancel queued fetches of speculative names not since submitted
+        as needed.
+
+        :rtype int
+        :return: number of fetches cancelled
+        """
+        cancelled = 0
+        with self._lock:
+            for key, future in list(self._futures.items()):
+                if key not in self._needed and future.cancel():
+                    cancelled += 1
+        if cancelled:
+            maglog.info("Cancelled {} speculative PyPI fetches"
+                        .format(cancelled))
+        return cancelled
+
+    def environment_package_names(self, names, speculative):
+        """Callback for Environment.magellan_setup_env: fetch the
+        environment's packages, speculatively until it has been
+        interrogated."""
+        self.submit(names, speculative)
+        if not speculative:
+            self.drop_speculative()
+
+    def wait(self, timeout=None):
+        """Wait for every fetch not cancelled to finish."""
+        with self._lock:
+            futures = list(self._futures.values())
+        concurrent.futures.wait(futures, timeout)
+
+    def close(self, wait=True):
+        """Cancel queued fetches; with wait, let running ones finish."""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        done = sum(1 for f in list(self._futures.values())
+                   if f.done() and not f.cancelled())
+        maglog.info("PyPI prefetch: {} of {} fetched".format(
+            done, len(self._futures)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DependencyScheduler(object):
+    """
+    Runs DepTools.get_deps_for_package_version for many (package, version)
+    pairs on a thread pool of at most max_workers (default
+    MagellanConfig.max_workers).
+
+    Repeated pairs are acquired once. Pairs are started slowest first, by
+    how long acquiring the package took in earlier runs (kept in
+    timings_file), so one long install isn't left to run on its own at the
+    end; cached pairs cost nothing and unknown packages are assumed to take
+    the mean known time. Each install gets its own workspace: an env
+    borrowed from the shared TempEnvPool, or if the pool is disabled one
+    named uniquely for this process and pair.
+    """
+
+    timings_file = 'acquisition_timings.json'
+
+    def __init__(self, max_workers=None, vex_options=None):
+        if max_workers is None:
+            max_workers = MagellanConfig.max_workers
+        self.max_workers = max(1, max_workers)
+        if vex_options is None:
+            vex_options = MagellanConfig.vex_options
+        self.vex_options = vex_options
+        self.timings = self.load_timings()
+        self._new_timings = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def timings_path():
+        return os.path.join(MagellanConfig.cache_dir,
+                            DependencyScheduler.timings_file)
+
+    @staticmethod
+    def load_timings():
+        """
+        :rtype dict
+        :return: {package key: seconds} from earlier runs
+        """
+        try:
+            with open(DependencyScheduler.timings_path(), 'r') as f:
+                timings = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(timings, dict):
+            return {}
+        return {k: v for k, v in list(timings.items())
+                if isinstance(v, (int, float))}
+
+    def save_timings(self):
+        """Merge this run's timings into the timings file."""
+        if not self._new_timings:
+            return
+        timings = self.load_timings()
+        timings.update(self._new_timings)
+        if os.path.isdir(MagellanConfig.cache_dir):
+            _write_json_atomic(timings, self.timings_path())
+
+    def estimate(self, package, version):
+        """Expected seconds to acquire package==version."""
+        if os.path.exists(DepTools.cached_deps_path(package, version)):
+            return 0.0
+        known = self.timings.get(package.lower())
+        if known is not None:
+            return known
+        if self.timings:
+            return sum(self.timings.values()) / len(self.timings)
+        return 0.0
+
+    def order(self, package_versions):
+        """
+        Unique pairs, slowest expected first; ties keep the order given.
+
+        :rtype list
+        """
+        unique = []
+        for p_v in package_versions:
+            p_v = (p_v[0], p_v[1])
+            if p_v not in unique:
+                unique.append(p_v)
+        estimates = {p_v: self.estimate(*p_v) for p_v in unique}
+        return sorted(unique, key=lambda p_v: -estimates[p_v])
+
+    def workspace(self, index):
+        """Temporary env name for the index'th pair, None to use the
+        shared pool."""
+        if MagellanConfig.env_pool_size:
+            return None
+        return "{0}{1}_{2}".format(MagellanConfig.tmp_env_dir, os.getpid(),
+                                   index)
+
+    def _acquire(self, index, package, version):
+        cached = os.path.exists(DepTools.cached_deps_path(package, version))
+        start = time.time()
+        result = DepTools.get_deps_for_package_version(
+            package, version, vex_options=self.vex_options,
+            tmp_env_name=self.workspace(index))
+        if not cached and result:
+            with self._lock:
+                self._new_timings[package.lower()] = time.time() - start
+        return result
+
+    def run(self, package_versions):
+        """
+        :param list package_versions: list of (package, version) tuples
+        :rtype dict
+        :return: {(package, version): requirements}, in the order given
+        regardless of the order acquired
+        """
+        ordered = self.order(package_versions)
+        if not ordered:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {p_v: executor.submit(self._acquire, i, *p_v)
+                       for i, p_v in enumerate(ordered)}
+            results = {p_v: f.result() for p_v, f in list(futures.items())}
+        self.save_timings()
+
+        return {(p_v[0], p_v[1]): results[(p_v[0], p_v[1])]
+                for p_v in package_versions}
+
+
 class PyPIHelper(object):
     """Collection of static methods to assist in interrogating PyPI"""
 
+    # Package JSON already acquired in this process, shared by every
+    # environment being analysed: {(package, localcache): json}
+    _json_memo = {}
+    _json_locks = {}
+    _json_locks_guard = threading.Lock()
+
     @staticmethod
     def check_package_version_on_pypi(package, version):
         """
@@ -942,8 +1922,29 @@ class PyPIHelper(object):
 
         p is package name
         localCacheDir is a location of local cache
+
+        Results are memoised for the life of the process; concurrent callers
+        asking for the same package wait for a single lookup.
         """
         package = str(package)
+        memo_key = (package, localcache)
+        with PyPIHelper._json_locks_guard:
+            lock = PyPIHelper._json_locks.setdefault(
+                memo_key, threading.Lock())
+
+        with lock:
+            if memo_key not in PyPIHelper._json_memo:
+                package_json = PyPIHelper._fetch_package_json_info(
+                    package, localcache)
+                if not package_json:  # allow a retry later
+                    return package_json
+                PyPIHelper._json_memo[memo_key] = package_json
+            return PyPIHelper._json_memo[memo_key]
+
+    @staticmethod
+    def _fetch_package_json_info(package, localcache=None):
+        """Package JSON from local cache, else PyPI (see
+        acquire_package_json_info)."""
         p_json = package + '.json'
 
         if not localcache:
@@ -951,31 +1952,112 @@ class PyPIHelper(object):
         else:
             f = os.path.join(localcache, p_json)
 
-        if os.path.exists(f):
+        pypi_template = 'https://pypi.python.org/pypi/{0}/json'
+        return PyPIHelper._fetch_json(pypi_template.format(package), f,
+                                      package, MagellanConfig.pypi_json_ttl)
+
+    @staticmethod
+    def acquire_package_version_json_info(package, version):
+        """
+        PyPI's JSON for one release of a package: its 'info' is that of the
+        release (unlike acquire_package_json_info's, which describes the
+        latest). Kept in the cache dir's versions folder.
+
+        :rtype dict
+        :return: JSON, or {} if not found
+        """
+        f = os.path.join(MagellanConfig.cache_dir, 'versions',
+                         "{0}_{1}.json".format(package.lower(), version))
+        if not os.path.isdir(os.path.dirname(f)) and \
+                os.path.isdir(MagellanConfig.cache_dir):
+            mkdir_p(os.path.dirname(f))
+
+        pypi_template = 'https://pypi.python.org/pypi/{0}/{1}/json'
+        return PyPIHelper._fetch_json(
+            pypi_template.format(package, version), f,
+            "{0} {1}".format(package, version))
+
+    @staticmethod
+    def get_deps_from_version_json(package, version):
+        """
+        Requirements of package==version from the requires_dist PyPI gives
+        for the release. Where that's null (e.g. releases uploaded before
+        PyPI recorded it, or with no requirements) they aren't known.
+
+        :rtype dict
+        :return: {'project_name', 'version', 'requires'} as
+        DepTools.get_deps_for_package_version, or {} if not known
+        """
+        info = PyPIHelper.acquire_package_version_json_info(
+            package, version).get('info') or {}
+        if info.get('requires_dist') is None or not info.get('name') or \
+                parse_version(info.get('version') or '') != \
+                parse_version(version):
+            return {}
+        maglog.info("Read requirements of {} {} from PyPI JSON".format(
+            package, version))
+        return {'project_name': safe_name(info['name']),
+                'version': info['version'],
+                'requires': parse_requirement_lines(info['requires_dist'])}
+
+    @staticmethod
+    def _fetch_json(url, f, what, max_age=None):
+        """JSON from local cache file f if younger than max_age seconds
+        (None: any age), else url (saved to f). A stale f is still used if
+        url can't be retrieved."""
+        def _cached():
             maglog.info("retrieving file {0} from local cache".format(f))
             with open(f, 'r') as ff:
                 return json.load(ff)
 
-        pypi_template = 'https://pypi.python.org/pypi/{0}/json'
+        stale = False
+        if os.path.exists(f):
+            if max_age is None or \
+                    time.time() - os.path.getmtime(f) < max_age:
+                return _cached()
+            stale = True
 
         try:
-            r = requests.get(pypi_template.format(package))
+            r = requests.get(url)
             if r.status_code == 200:  # if successfully retrieved:
                 maglog.info("{0} JSON successfully retrieved from PyPI"
-                            .format(package))
+                            .format(what))
 
                 # Save to local cache...
-                with open(f, 'w') as outf:
-                    json.dump(r.json(), outf)
+                _write_json_atomic(r.json(), f)
                 # ... and return to caller:
                 return r.json()
 
             else:  # retrieval failed
-                maglog.info("failed to download {0}".format(package))
-                return {}
+                maglog.info("failed to download {0}".format(what))
         except requests.ConnectionError as e:
             maglog.warn("Connection to PyPI failed: {}".format(e))
-            return {}
+        return _cached() if stale else {}
+
+    @staticmethod
+    def latest_version_satisfying(package, specs):
+        """Latest (non pre-release) version on PyPI satisfying all specs.
+
+        :param str package: input package name
+        :param list specs: list of (spec, version) tuples, e.g. [('>=', '1.0')]
+        :rtype: str
+        :return: version string, or None if nothing satisfies specs
+        """
+        candidates = []
+        for v in PyPIHelper.all_package_versions_on_pypi(package):
+            try:
+                if parse_version(v).is_prerelease:
+                    continue
+                if all(DepTools.check_requirement_satisfied(v, s)[0]
+                       for s in specs):
+                    candidates.append(v)
+            except Exception as e:
+                maglog.debug("Skipping version {} of {}: {}"
+                             .format(v, package, e))
+
+        if not candidates:
+            return None
+        return max(candidates, key=parse_version)
 
     @staticmethod
     def all_package_versions_on_pypi(package):
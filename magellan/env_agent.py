@@ -0,0 +1,125 @@
+"""
+Long-lived agent run inside another virtual environment.
+
+Reads one JSON request per line on stdin and writes one JSON response per
+line on stdout, keeping pkg_resources and the interrogation results warm
+between requests:
+
+    {"id": 1, "op": "interrogate"}
+    {"id": 1, "ok": true, "result": {"nodes": ..., "edges": ...,
+                                     "package_requirements": ...}}
+
+ops: ping, interrogate, package_in_env (package), metadata (package),
+refresh (re-read the working set, e.g. after installs) and shutdown. Errors
+are returned as {"id": ..., "ok": false, "error": "..."}.
+
+NB: this file is run as a script inside other environments, so must not
+import anything from magellan; env_interrogation is imported from the same
+directory.
+"""
+import json
+import os
+import sys
+
+import pkg_resources
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import env_interrogation  # noqa: E402
+
+
+class Agent(object):
+    """Answers requests against a working set built once."""
+
+    def __init__(self):
+        self.working_set = pkg_resources.working_set
+        self._interrogation = None
+
+    def refresh(self):
+        self.working_set = pkg_resources.WorkingSet()
+        self._interrogation = None
+        return True
+
+    def interrogate(self):
+        if self._interrogation is None:
+            nodes, edges, pkgs_out = env_interrogation.interrogate(
+                self.working_set)
+            self._interrogation = {'nodes': nodes, 'edges': edges,
+                                   'package_requirements': pkgs_out}
+        return self._interrogation
+
+    def _find(self, package):
+        key = str(package).lower()
+        for d in self.working_set:
+            if d.key == key:
+                return d
+        return None
+
+    def package_in_env(self, package):
+        """As Environment.package_in_env: [found, [project_name, version]]"""
+        d = self._find(package)
+        if d is None:
+            return [False, [None, None]]
+        return [True, [d.project_name, d.version]]
+
+    def metadata(self, package):
+        """As package_interrogation.py: {project_name, version, requires}"""
+        d = self._find(package)
+        if d is None:
+            raise LookupError("Package {} not found in env".format(package))
+        req_dic = {'project_name': d.project_name,
+                   'version': d.version, 'requires': {}}
+        for r in d.requires():
+            req_dic['requires'][r.key] = {'project_name': r.project_name,
+                                          'key': r.key,
+                                          'specs': r.specs}
+        return req_dic
+
+    def ping(self):
+        return {'pid': os.getpid(), 'executable': sys.executable}
+
+    def handle(self, request):
+        op = request.get('op')
+        if op == 'ping':
+            return self.ping()
+        if op == 'interrogate':
+            return self.interrogate()
+        if op == 'package_in_env':
+            return self.package_in_env(request['package'])
+        if op == 'metadata':
+            return self.metadata(request['package'])
+        if op == 'refresh':
+            return self.refresh()
+        raise ValueError("Unknown op {!r}".format(op))
+
+
+def serve(stdin, stdout):
+    agent = Agent()
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            if request.get('op') == 'shutdown':
+                _respond(stdout, {'id': request_id, 'ok': True,
+                                  'result': True})
+                break
+            response = {'id': request_id, 'ok': True,
+                        'result': agent.handle(request)}
+        except Exception as e:
+            response = {'id': request_id, 'ok': False,
+                        'error': "{0}: {1}".format(type(e).__name__, e)}
+        _respond(stdout, response)
+
+
+def _respond(stdout, response):
+    stdout.write(json.dumps(response, separators=(',', ':')) + "\n")
+    stdout.flush()
+
+
+if __name__ == '__main__':
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr  # stray prints mustn't corrupt the protocol
+    serve(sys.stdin, protocol_out)
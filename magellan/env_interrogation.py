@@ -1,50 +1,85 @@
 import json
+import sys
 import pkg_resources
 
 default_skip = ['pip', 'python', 'distribute']
 skip = ['pipdeptree', 'magellan', 'vex'] \
        + default_skip
 
-# local_only = True
-# pkgs = pip.get_installed_distributions(local_only=local_only,
-#                                        skip=skip+default_skip)
-pkgs = [d for d in pkg_resources.working_set if d.key not in skip]
-
-
-# FORM NODES
-nodes = [(x.project_name, x.version) for x in pkgs]
-
-# FORM EDGES
-installed_versions = {x.key: x.version for x in pkgs}
-edges = []
-for p in pkgs:
-    p_tup = (p.project_name, p.version)
-    edges.append([('root', '0.0.0'), p_tup])
-    reqs = p.requires()
-    if reqs:
-        for r in reqs:
-            if r.key in installed_versions:
-                r_tup = (r.key, installed_versions[r.key])
-            else:
-                r_tup = (r.key, '')
-            edges.append([p_tup, r_tup, r.specs])
-
-# Record nodes and edges to disk to be read in  by main program if needed.
-json.dump(nodes, open('nodes.json', 'w'))
-json.dump(edges, open('edges.json', 'w'))
-
-# Was having issues with pickle so writing custom dict.
-pkgs_out = {}
-for p in pkgs:
-    pkgs_out[p.key] = {}
-    pkgs_out[p.key]['project_name'] = p.project_name
-    pkgs_out[p.key]['version'] = p.version
-    pkgs_out[p.key]['requires'] = {}
-    for r in p.requires():
-        pkgs_out[p.key]['requires'][r.key] = {}
-        pkgs_out[p.key]['requires'][r.key]['project_name'] = r.project_name
-        pkgs_out[p.key]['requires'][r.key]['specs'] = r.specs
-
-
-json.dump(pkgs_out, open('package_requirements.json', 'w'))
 
+def interrogate(working_set=None):
+    """
+    Forms nodes, edges and package requirements from a working set.
+
+    NB: this file is also run as a script inside other environments, so must
+    not import anything from magellan.
+
+    :param working_set: pkg_resources.WorkingSet, defaults to the working set
+    of the running interpreter.
+    :return: nodes, edges, package_requirements
+    """
+    if working_set is None:
+        working_set = pkg_resources.working_set
+
+    # local_only = True
+    # pkgs = pip.get_installed_distributions(local_only=local_only,
+    #                                        skip=skip+default_skip)
+    pkgs = [d for d in working_set if d.key not in skip]
+
+    # FORM NODES
+    nodes = [(x.project_name, x.version) for x in pkgs]
+
+    # FORM EDGES
+    installed_versions = {x.key: x.version for x in pkgs}
+    edges = []
+    for p in pkgs:
+        p_tup = (p.project_name, p.version)
+        edges.append([('root', '0.0.0'), p_tup])
+        reqs = p.requires()
+        if reqs:
+            for r in reqs:
+                if r.key in installed_versions:
+                    r_tup = (r.key, installed_versions[r.key])
+                else:
+                    r_tup = (r.key, '')
+                edges.append([p_tup, r_tup, r.specs])
+
+    # Was having issues with pickle so writing custom dict.
+    pkgs_out = {}
+    for p in pkgs:
+        pkgs_out[p.key] = {}
+        pkgs_out[p.key]['project_name'] = p.project_name
+        pkgs_out[p.key]['version'] = p.version
+        pkgs_out[p.key]['requires'] = {}
+        for r in p.requires():
+            pkgs_out[p.key]['requires'][r.key] = {}
+            pkgs_out[p.key]['requires'][r.key]['project_name'] = \
+                r.project_name
+            pkgs_out[p.key]['requires'][r.key]['specs'] = r.specs
+
+    return nodes, edges, pkgs_out
+
+
+def write_document(obj, stream=None):
+    """
+    Write obj to stream (default stdout) as a length-prefixed JSON document:
+    a line holding the byte length of the payload, then the payload.
+    """
+    if stream is None:
+        stream = sys.stdout
+    payload = json.dumps(obj, separators=(',', ':'))  # ASCII; len == bytes
+    stream.write("{0}\n".format(len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+if __name__ == '__main__':
+    try:
+        nodes, edges, pkgs_out = interrogate()
+    except Exception as e:
+        sys.stderr.write("env_interrogation.py failed: {0!r}\n".format(e))
+        sys.exit(1)
+
+    # Stream to parent process rather than writing files to disk.
+    write_document({'nodes': nodes, 'edges': edges,
+                    'package_requirements': pkgs_out})
@@ -0,0 +1,260 @@
+"""
+Module containing TempEnvPool class.
+
+A pool of temporary virtual environments for installing packages into, kept
+between uses (and between runs) instead of being deleted and recreated each
+time. Each environment is created and has pip upgraded once; after use it is
+reset to that baseline by uninstalling whatever was added.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import queue
+import shlex
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from magellan.env_utils import Environment
+from magellan.utils import MagellanConfig, CommandTimeout, mkdir_p, run_args
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+
+class EnvPoolError(Exception):
+    """An environment couldn't be built or brought back to its baseline."""
+    pass
+
+
+class TempEnvPool(object):
+    """
+    Up to size environments named <prefix>0, <prefix>1, ..., created on
+    demand (or all at once with warm) and handed out one user at a time by
+    acquire.
+
+    Each environment's baseline, the packages installed once it has been
+    built, is kept under the cache dir. Environments left from a previous
+    run are reused if they still match their baseline. On release an
+    environment is reset by uninstalling packages not in its baseline; if it
+    then doesn't match (e.g. an install changed a baseline package) or has
+    disappeared, it is rebuilt.
+    """
+
+    prefix = 'MagellanPool'
+    subdir = 'env_pool'
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, size=None, vex_options=None, pip_update=None,
+                 prefix=None):
+        self.size = max(1, size or MagellanConfig.env_pool_size)
+        self.vex_options = vex_options
+        self.backend = Environment.backend(vex_options)
+        self.pip_update = (MagellanConfig.pip_update if pip_update is None
+                           else pip_update)
+        self.prefix = prefix or self.prefix
+        self.baselines = {}
+        self.replaced = 0
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def shared(vex_options=None):
+        """Pool used by DepTools, one per backend and vex options, sized by
+        MagellanConfig.env_pool_size.
+
+        :rtype TempEnvPool
+        """
+        key = (MagellanConfig.env_backend, vex_options,
+               MagellanConfig.env_pool_size)
+        with TempEnvPool._shared_lock:
+            if key not in TempEnvPool._shared:
+                TempEnvPool._shared[key] = TempEnvPool(
+                    MagellanConfig.env_pool_size, vex_options)
+            return TempEnvPool._shared[key]
+
+    def env_name(self, index):
+        return "{0}{1}".format(self.prefix, index)
+
+    def state_file(self, name):
+        return os.path.join(MagellanConfig.cache_dir, self.subdir,
+                            "{}.json".format(name))
+
+    def _pip(self, name, args):
+        """Run the environment's pip, killing it after
+        MagellanConfig.install_timeout.
+
+        :rtype subprocess.CompletedProcess
+        :raises CommandTimeout: if killed
+        """
+        cmd_args = shlex.split(self.backend.pip_cmd(name)) + args + [
+            '--disable-pip-version-check']
+        return run_args(cmd_args, MagellanConfig.install_timeout)
+
+    def installed(self, name):
+        """
+        Packages installed in an environment.
+
+        :rtype dict
+        :return: {key: version}, or None if pip can't be run
+        """
+        try:
+            p = self._pip(name, ['list', '--format=json'])
+        except (OSError, CommandTimeout) as e:
+            maglog.info("Unable to run pip in {}: {}".format(name, e))
+            return None
+        if p.returncode != 0:
+            maglog.info("pip list failed in {}: {}".format(
+                name, p.stderr.decode('utf-8', 'replace').strip()))
+            return None
+        try:
+            return {d['name'].lower(): d['version']
+                    for d in json.loads(p.stdout.decode('utf-8'))}
+        except (ValueError, KeyError, TypeError) as e:
+            maglog.info("Bad pip list output from {}: {}".format(name, e))
+            return None
+
+    def healthy(self, name):
+        """Whether the environment exists and matches its baseline."""
+        baseline = self.baselines.get(name)
+        return (baseline is not None and self.backend.env_exists(name) and
+                self.installed(name) == baseline)
+
+    def build(self, name):
+        """(Re)create an environment and record its baseline.
+
+        :raises EnvPoolError: if the environment can't be created, pip
+        can't be upgraded in time or the new environment can't be listed
+        """
+        self.baselines.pop(name, None)
+        print("Creating virtual env: {}".format(name))
+        try:
+            self.backend.create_env(name)
+            if self.pip_update:
+                self._pip(name, ['install', 'pip', '--upgrade'])
+        except (OSError, subprocess.SubprocessError, CommandTimeout) as e:
+            raise EnvPoolError("Unable to build pool env {}: {}".format(
+                name, e))
+        baseline = self.installed(name)
+        if baseline is None:
+            raise EnvPoolError("Unable to build pool env {}".format(name))
+        self.baselines[name] = baseline
+
+        try:
+            mkdir_p(os.path.dirname(self.state_file(name)))
+            with open(self.state_file(name), 'w') as f:
+                json.dump({'baseline': baseline}, f)
+        except (IOError, OSError) as e:
+            maglog.debug("Unable to save pool state for {}: {}"
+                         .format(name, e))
+
+    def prepare(self, name):
+        """Reuse an environment left by an earlier run if it's healthy,
+        otherwise build it."""
+        try:
+            with open(self.state_file(name), 'r') as f:
+                self.baselines[name] = json.load(f)['baseline']
+        except (IOError, OSError, ValueError, KeyError):
+            self.baselines.pop(name, None)
+
+        if self.healthy(name):
+            maglog.info("Reusing pool env {}".format(name))
+            return
+        self.build(name)
+
+    def reset(self, name):
+        """Uninstall whatever was added since the baseline; rebuild the
+        environment if that doesn't restore it."""
+        installed = self.installed(name)
+        if installed is not None:
+            added = sorted(set(installed) - set(self.baselines[name]))
+            if added:
+                self._pip(name, ['uninstall', '-y'] + added)
+        if not self.healthy(name):
+            maglog.info("Pool env {} doesn't match its baseline, replacing"
+                        .format(name))
+            with self._lock:
+                self.replaced += 1
+            self.build(name)
+
+    def warm(self):
+        """Prepare every environment in the pool, concurrently."""
+        with self._lock:
+            names = [self.env_name(i) for i in range(self._created, self.size)]
+            self._created = self.size
+        try:
+            with ThreadPoolExecutor(
+                    max_workers=max(1, len(names))) as executor:
+                list(executor.map(self.prepare, names))
+        finally:  # any that failed are rebuilt when next used
+            for name in names:
+                self._idle.put(name)
+
+    def _get(self):
+        try:
+            name = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                index = self._created
+                if index < self.size:
+                    self._created += 1
+            if index < self.size:
+                name = self.env_name(index)
+                try:
+                    self.prepare(name)
+                except Exception:
+                    self._idle.put(name)  # rebuilt by the next _get
+                    raise
+                return name
+            name = self._idle.get()  # wait for one to be released
+
+        if name not in self.baselines or not self.backend.env_exists(name):
+            # failed to reset, or removed behind our back
+            with self._lock:
+                self.replaced += 1
+            try:
+                self.build(name)
+            except Exception:
+                self._idle.put(name)
+                raise
+        return name
+
+    @contextlib.contextmanager
+    def acquire(self):
+        """
+        Borrow an environment, waiting if all are in use:
+
+            with pool.acquire() as env_name:
+                ...install into env_name...
+
+        The environment is reset to its baseline on return.
+
+        :raises EnvPoolError: if an environment can't be built
+        """
+        name = self._get()
+        try:
+            yield name
+        finally:
+            try:
+                self.reset(name)
+            except Exception as e:
+                maglog.warning("Unable to reset pool env {}: {}"
+                               .format(name, e))
+                self.baselines.pop(name, None)  # rebuilt when next used
+            self._idle.put(name)
+
+    def destroy(self):
+        """Remove the pool's environments and their state."""
+        for i in range(self.size):
+            name = self.env_name(i)
+            self.backend.remove_env(name)
+            if os.path.exists(self.state_file(name)):
+                os.remove(self.state_file(name))
+        self.baselines = {}
+        self._idle = queue.Queue()
+        self._created = 0
@@ -6,11 +6,15 @@ Collection of methods concerning analysis of virtual environment.
 import logging
 import json
 import os
+import shlex
+import shutil
 import sys
+import venv as stdlib_venv
 from pkg_resources import resource_filename as pkg_res_resource_filename
 
 from magellan.utils import (run_in_subprocess,
                             run_in_subp_ret_stdout,
+                            run_in_subp_ret_json,
                             MagellanConfig,)
 from magellan.package_utils import Package
 
@@ -19,6 +23,95 @@ maglog = logging.getLogger("magellan_logger")
 maglog.info("Env imported")
 
 
+class VexBackend(object):
+    """
+    Runs environment operations through vex. vex_options (e.g. a --config
+    pointing at magellan's temporary env home) are passed to every call.
+    """
+
+    def __init__(self, vex_options=None):
+        self.vex_options = vex_options or ''
+
+    def env_exists(self, venv_name):
+        """Whether venv_name is in vex --list."""
+        vex_list = run_in_subp_ret_stdout(
+            'vex {} --list'.format(self.vex_options))
+        return venv_name in vex_list[0].decode('utf-8').split("\n")
+
+    def python_cmd(self, venv_name, bin_dir=None):
+        """Command prefix to run the environment's python."""
+        return "vex {} {} python".format(self.vex_options, venv_name)
+
+    def pip_cmd(self, venv_name):
+        """Command prefix to run the environment's pip."""
+        return "vex {} {} pip".format(self.vex_options, venv_name)
+
+    def base_python_cmd(self):
+        """Command to run the python new environments are made from: the
+        --python in vex_options, else python on the path."""
+        args = shlex.split(self.vex_options)
+        for i, arg in enumerate(args):
+            if arg == '--python' and i + 1 < len(args):
+                return shlex.quote(args[i + 1])
+            if arg.startswith('--python='):
+                return shlex.quote(arg.split('=', 1)[1])
+        return shlex.quote(shutil.which('python') or sys.executable)
+
+    def create_env(self, venv_name):
+        """vex -m ; makes env"""
+        run_in_subprocess("vex {} -m {} true".format(
+            self.vex_options, venv_name))
+
+    def remove_env(self, venv_name):
+        """vex -r removes virtual env"""
+        run_in_subprocess("vex {} -r {} true".format(
+            self.vex_options, venv_name))
+
+
+class DirectBackend(object):
+    """
+    Finds environments as directories under venv_home, runs their own
+    bin/python directly and creates them with the stdlib venv module; no
+    shell or vex process is involved.
+    """
+
+    def __init__(self, venv_home):
+        self.venv_home = venv_home
+
+    def env_dir(self, venv_name):
+        return os.path.join(self.venv_home, venv_name)
+
+    def bin_dir(self, venv_name):
+        return os.path.join(self.env_dir(venv_name), 'bin')
+
+    def env_exists(self, venv_name):
+        """Whether venv_home/venv_name has a bin/python."""
+        return os.path.isfile(os.path.join(self.bin_dir(venv_name), 'python'))
+
+    def python_cmd(self, venv_name, bin_dir=None):
+        """Command prefix to run the environment's python; bin_dir overrides
+        the location under venv_home."""
+        return shlex.quote(os.path.join(bin_dir or self.bin_dir(venv_name),
+                                        'python'))
+
+    def pip_cmd(self, venv_name):
+        """Command prefix to run the environment's pip."""
+        return "{} -m pip".format(self.python_cmd(venv_name))
+
+    def base_python_cmd(self):
+        """Command to run the python new environments are made from, this
+        one (see create_env)."""
+        return shlex.quote(sys.executable)
+
+    def create_env(self, venv_name):
+        """Create environment (with pip) using the stdlib venv module."""
+        stdlib_venv.EnvBuilder(clear=True, with_pip=True).create(
+            self.env_dir(venv_name))
+
+    def remove_env(self, venv_name):
+        shutil.rmtree(self.env_dir(venv_name), ignore_errors=True)
+
+
 class Environment(object):
     """ Environment class."""
 
@@ -31,27 +124,68 @@ class Environment(object):
         self.package_requirements = {}
         self.all_packages = {}
         self.extant_env_files = []
+        self._agent = None
 
         maglog.info("logging setup in Environment")
 
-    def magellan_setup_go_env(self, kwargs):
+    def magellan_setup_go_env(self, kwargs, package_names_callback=None):
         """ Set up environment for main script."""
 
-        self.name, self.name_bit = self.vex_resolve_venv_name(self.name)
+        self.magellan_setup_env(kwargs, package_names_callback)
+
+        if (kwargs['show_all_packages'] or
+                kwargs['show_all_packages_and_versions']):
+            self.show_all_packages_and_exit(
+                kwargs['show_all_packages_and_versions'])
+
+    def magellan_setup_env(self, kwargs, package_names_callback=None):
+        """ Resolve and interrogate environment, populating nodes, edges,
+        package_requirements and all_packages.
+
+        :param package_names_callback: called as (names, speculative) when
+        package names become known: first speculatively from metadata
+        filenames, before interrogation, then with the interrogated nodes.
+        """
+
+        self.name, self.name_bit = self.vex_resolve_venv_name(
+            self.name, bin_path=kwargs['path_to_env_bin'])
 
         self.resolve_venv_bin(kwargs['path_to_env_bin'])
 
-        self.query_nodes_edges_in_venv()
-        if not kwargs['keep_env_files']:
-            self.remove_extant_env_files_from_disk()
+        if package_names_callback is not None:
+            package_names_callback(self.speculative_package_names(), True)
+
+        if kwargs.get('scan_metadata'):
+            self.scan_nodes_edges_from_disk(refresh=kwargs.get('refresh'))
+        elif self.is_running_interpreter():
+            self.query_nodes_edges_in_process()
+        else:
+            self.query_nodes_edges_in_venv()
+
+        if kwargs['keep_env_files']:
+            self.write_env_files_to_disk()
 
         self.all_packages = {p[0].lower(): Package(p[0], p[1]) 
                              for p in self.nodes}
 
-        if (kwargs['show_all_packages'] or
-                kwargs['show_all_packages_and_versions']):
-            self.show_all_packages_and_exit(
-                kwargs['show_all_packages_and_versions'])
+        if package_names_callback is not None:
+            package_names_callback([p[0] for p in self.nodes], False)
+
+    @staticmethod
+    def backend(vex_options=None):
+        """
+        Backend for environment operations, as MagellanConfig.env_backend.
+
+        :param str vex_options: vex options; when given (i.e.
+        MagellanConfig.vex_options) the direct backend uses magellan's
+        temporary env home, as the vex config does.
+        :rtype VexBackend or DirectBackend
+        """
+        if MagellanConfig.env_backend == 'vex':
+            return VexBackend(vex_options)
+        if vex_options:
+            return DirectBackend(MagellanConfig.tmp_dir)
+        return DirectBackend(Environment.venv_home())
 
     def create_vex_new_virtual_env(self, vex_options=None):
         """Create a virtual env in which to install packages
@@ -59,57 +193,55 @@ class Environment(object):
         :rtype : str
         """
 
-        if vex_options is None:
-            vex_options = ''
+        backend = self.backend(vex_options)
         if self.name is None:
             venv_template = "MagEnv{}"
             # check if name exists and bump repeatedly until new
             i = 0
             while True:
                 self.name = venv_template.format(i)
-                if not self.vex_check_venv_exists(self.name, vex_options):  # make env
+                if not backend.env_exists(self.name):  # make env
                     break
                 i += 1
         else:
-            if self.vex_check_venv_exists(self.name, vex_options):
-                # vex -r removes virtual env
-                run_in_subprocess("vex {} -r {} true".format(
-                    vex_options, self.name))
+            if backend.env_exists(self.name):
+                backend.remove_env(self.name)
 
-        # vex -m ; makes env
         print(("Creating virtual env: {}".format(self.name)))
-        run_in_subprocess("vex {} -m {} true".format(vex_options, self.name))
+        backend.create_env(self.name)
 
     @staticmethod
     def vex_check_venv_exists(venv_name, vex_options=None):
-        """ Checks whether a virtual env exists using vex.
+        """ Checks whether a virtual env exists using the env backend.
         :return : Bool if env exists or not."""
 
-        if vex_options is None:
-            vex_options = ''
-        vex_list = run_in_subp_ret_stdout('vex {} --list'.format(vex_options))
-        return venv_name in vex_list[0].decode('utf-8').split("\n")
+        return Environment.backend(vex_options).env_exists(venv_name)
 
     @staticmethod
     def vex_install_requirement(install_location, requirement, pip_options,
-                                vex_options=None):
-        """Install SINGLE requirement into env_name using vex.
+                                vex_options=None, timeout=None):
+        """Install SINGLE requirement into env_name using the env backend.
 
-        install_location is either the NAME of a virtual env or will be
-        the path, specified as "--path /path/to/env"
+        install_location is the NAME of a virtual env.
 
+        :param int timeout: seconds before pip is killed
+        :return: pip's exit code
+        :raises CommandTimeout: if pip was killed for running past timeout
         """
-        if vex_options is None:
-            vex_options = ''
-
-        cmd_to_run = ('vex {} {} pip install {} {}'.format(
-            vex_options, install_location, requirement, pip_options))
-        run_in_subprocess(cmd_to_run)
+        cmd_to_run = ('{} install {} {}'.format(
+            Environment.backend(vex_options).pip_cmd(install_location),
+            requirement, pip_options))
+        return run_in_subprocess(cmd_to_run, timeout)
 
     @staticmethod
-    def vex_resolve_venv_name(venv_name=None, vex_options=None):
+    def vex_resolve_venv_name(venv_name=None, vex_options=None,
+                              bin_path=None):
         """Check whether virtual env exists,
-        if not then indicate to perform analysis on current environment"""
+        if not then indicate to perform analysis on current environment
+
+        With the direct backend an explicit bin_path is checked by
+        resolve_venv_bin instead, as the env needn't be under WORKON_HOME.
+        """
 
         if venv_name is None:
             maglog.info("No virtual env specified, analysing local env")
@@ -119,7 +251,9 @@ class Environment(object):
             venv_name = venv_name.rstrip('/')
             maglog.info("Locating {} environment".format(venv_name))
             # First check specified environment exists:
-            if not Environment.vex_check_venv_exists(venv_name, vex_options):
+            if not (bin_path and MagellanConfig.env_backend != 'vex') and \
+                    not Environment.vex_check_venv_exists(venv_name,
+                                                          vex_options):
                 maglog.critical('Virtual Env "{}" does not exist, '
                                 'please check name and try again'
                                 .format(venv_name))
@@ -132,17 +266,23 @@ class Environment(object):
     @staticmethod
     def vex_remove_virtual_env(venv_name=None, vex_options=None):
         """Removes virtual environment"""
-        if vex_options is None:
-            vex_options = ''
         if venv_name is not None:
-            run_in_subprocess("vex {} -r {} true".format(
-                vex_options, venv_name))
+            Environment.backend(vex_options).remove_env(venv_name)
 
     def vex_delete_env_self(self):
         """Deletes itself as a virtual environment; be careful!"""
         self.vex_remove_virtual_env(self.name,
                                     vex_options=MagellanConfig.vex_options)
 
+    @staticmethod
+    def venv_home():
+        """Directory holding named virtual envs: $WORKON_HOME, else
+        /home/$USER/.virtualenvs"""
+        venv_home = os.environ.get('WORKON_HOME')
+        if not venv_home:
+            venv_home = "/home/{}/.virtualenvs".format(os.environ.get('USER'))
+        return venv_home
+
     def resolve_venv_bin(self, bin_path):
         """ Resolves the bin directory.
         """
@@ -153,12 +293,8 @@ class Environment(object):
 
         # If not supplied path, derive from v_name.
         if not bin_path and self.name:
-            user = os.environ.get('USER')
-            venv_home = os.environ.get('WORKON_HOME')
-            if not venv_home:
-                venv_home = "/home/{}/.virtualenvs".format(user)
             specific_venv_dir = "{}/bin/".format(self.name)
-            self.bin = os.path.join(venv_home, specific_venv_dir)
+            self.bin = os.path.join(self.venv_home(), specific_venv_dir)
 
         # Check path and/or derived path.
         if bin_path:
@@ -169,8 +305,138 @@ class Environment(object):
             else:
                 self.bin = bin_path
 
+    def is_running_interpreter(self):
+        """
+        Whether the environment to analyse is the one magellan is running in,
+        i.e. no env name or bin path was given and the "python" that would be
+        used to interrogate it lives alongside the running interpreter.
+
+        :rtype bool
+        """
+        if self.name or self.bin:
+            return False
+        python_on_path = shutil.which('python')
+        if not python_on_path:
+            return False
+        return (os.path.normpath(os.path.dirname(os.path.abspath(
+                python_on_path))) ==
+                os.path.normpath(os.path.dirname(os.path.abspath(
+                    sys.executable))))
+
+    def query_nodes_edges_in_process(self):
+        """Generate Nodes and Edges of packages from the running
+        interpreter's distribution metadata, without a subprocess."""
+        from magellan import env_interrogation
+
+        maglog.info("Interrogating running interpreter in process")
+        self.nodes, self.edges, self.package_requirements = \
+            env_interrogation.interrogate()
+
+    def site_dirs(self):
+        """site-packages directories of the environment: from its bin if
+        known, else those of the running interpreter.
+
+        :rtype list
+        """
+        from magellan.metadata_utils import EnvironmentScanner
+
+        if self.bin:
+            return EnvironmentScanner.site_dirs_for_bin(self.bin)
+        return EnvironmentScanner.site_dirs_for_running_interpreter()
+
+    def speculative_package_names(self):
+        """Package names from the environment's metadata filenames, which
+        are available before it has been interrogated. Empty if its
+        site-packages can't be located without running it.
+
+        :rtype list
+        """
+        from magellan.metadata_utils import EnvironmentScanner
+
+        if not self.bin and not self.is_running_interpreter():
+            return []
+        return EnvironmentScanner(self.site_dirs()).package_names()
+
+    def scan_nodes_edges_from_disk(self, refresh=False):
+        """Generate Nodes and Edges of packages by reading distribution
+        metadata from the environment's site-packages; nothing is executed
+        in the environment.
+
+        When caching, distributions unchanged since the last scan are taken
+        from the environment snapshot (see SnapshotCache), and how many were
+        reused, re-read and removed is printed; refresh ignores the
+        snapshot.
+        """
+        from magellan.cache_utils import SnapshotCache
+        from magellan.metadata_utils import EnvironmentScanner
+
+        site_dirs = self.site_dirs()
+        if not site_dirs:
+            sys.exit('LAPU LAPU! Unable to locate site-packages for {}; '
+                     'please specify path to its bin using magellan -n '
+                     'ENV_NAME --path-to-env-bin ENV_BIN_PATH'
+                     .format(self.name or 'current environment'))
+
+        maglog.info("Scanning distribution metadata in {}".format(site_dirs))
+        scanner = EnvironmentScanner(site_dirs)
+        if MagellanConfig.caching:
+            self.nodes, self.edges, self.package_requirements, stats = \
+                SnapshotCache.scan(scanner, refresh)
+            print("Environment snapshot for {0}: {1} distributions reused, "
+                  "{2} re-read, {3} removed{4}".format(
+                      self.name or 'current environment', stats['reused'],
+                      stats['read'], stats['removed'],
+                      " (--refresh)" if refresh else ""))
+        else:
+            self.nodes, self.edges, self.package_requirements = \
+                scanner.scan()
+
+    def python_cmd(self):
+        """Command to run python inside the environment.
+
+        :rtype str
+        """
+        if self.name:
+            return self.backend().python_cmd(self.name, self.bin)
+        elif self.bin:  # --path-to-env-bin without a name
+            return shlex.quote(os.path.join(self.bin, 'python'))
+        return "python"
+
+    def agent(self):
+        """Persistent interrogation agent running inside the environment,
+        started on first use; see magellan.agent_utils.EnvironmentAgent.
+        Call stop_agent when finished with it. For library use, the command
+        line doesn't start one.
+
+        :rtype EnvironmentAgent
+        """
+        from magellan.agent_utils import EnvironmentAgent
+
+        if self._agent is None:
+            self._agent = EnvironmentAgent(self.python_cmd())
+            self._agent.start()
+        return self._agent
+
+    def stop_agent(self):
+        """Shut down the persistent agent, if running."""
+        if self._agent is not None:
+            self._agent.stop()
+            self._agent = None
+
+    def query_nodes_edges_via_agent(self):
+        """Generate Nodes and Edges of packages in virtual env using the
+        persistent agent, so repeat queries (e.g. after agent().refresh()
+        following installs) don't start a new interpreter."""
+        doc = self.agent().interrogate()
+        self.nodes = doc['nodes']
+        self.edges = doc['edges']
+        self.package_requirements = doc['package_requirements']
+
     def query_nodes_edges_in_venv(self):
         """Generate Nodes and Edges of packages in virtual env.
+
+        env_interrogation.py is run inside the environment and streams its
+        results back over stdout, so concurrent runs don't share any files.
         :rtype list, list
         :return: nodes, edges
         """
@@ -179,28 +445,31 @@ class Environment(object):
             'magellan', 'env_interrogation.py')
 
         # execute
-        self.add_file_to_extant_env_files('nodes.json')
-        self.add_file_to_extant_env_files('edges.json')
         try:
-            if self.name == "":
-                run_in_subprocess("python {}".format(interrogation_file))
-            else:
-                run_in_subprocess("vex {0} python {1}"
-                                  .format(self.name, interrogation_file))
+            doc = run_in_subp_ret_json("{0} {1}".format(
+                self.python_cmd(), shlex.quote(interrogation_file)),
+                timeout=MagellanConfig.interrogate_timeout)
         except Exception as e:
             maglog.exception(e)
-            # Cleanup:
-            self.remove_extant_env_files_from_disk()
             sys.exit("Error {} when trying to interrogate environment."
                      .format(e))
 
-        # Load in nodes and edges pickles
-        self.nodes = json.load(open('nodes.json', 'r'))
-        self.edges = json.load(open('edges.json', 'r'))
+        self.nodes = doc['nodes']
+        self.edges = doc['edges']
+        self.package_requirements = doc['package_requirements']
 
-        self.package_requirements = json.load(
-            open('package_requirements.json', 'r'))
-        self.add_file_to_extant_env_files('package_requirements.json')
+    def write_env_files_to_disk(self):
+        """
+        Write nodes, edges and package_requirements to json files in the
+        current directory, e.g. for debugging (--keep-env-files).
+        """
+        for fn, data in [('nodes.json', self.nodes),
+                         ('edges.json', self.edges),
+                         ('package_requirements.json',
+                          self.package_requirements)]:
+            with open(fn, 'w') as f:
+                json.dump(data, f)
+            self.add_file_to_extant_env_files(fn)
 
     def add_file_to_extant_env_files(self, file_to_add):
         """
@@ -217,7 +486,7 @@ class Environment(object):
         :param file_to_remove: str, file to delete.
         """
         if os.path.exists(file_to_remove):
-            run_in_subprocess('rm {}'.format(file_to_remove))
+            os.remove(file_to_remove)
 
     def remove_extant_env_files_from_disk(self, to_remove=None):
         """
@@ -237,13 +506,69 @@ class Environment(object):
 
     def show_all_packages_and_exit(self, with_versions=False):
         """ Prints nodes and exits"""
+        self.show_all_packages(with_versions)
+        sys.exit(0)
+
+    def show_all_packages(self, with_versions=False):
+        """ Prints nodes"""
         maglog.info('"Show all packages" selected. Nodes found:')
         for _, p in list(self.all_packages.items()):
             if with_versions:
                 print(("{0} : {1} ".format(p.name, p.version)))
             else:
                 print((p.name))  # just show nodes
-        sys.exit(0)
+
+    def dependency_children(self):
+        """Packages each package requires, from the edges.
+
+        :rtype dict
+        :return: {key: set of keys}
+        """
+        children = {}
+        for e in self.edges:
+            if e[0][0] == 'root':
+                continue
+            children.setdefault(e[0][0].lower(), set()).add(e[1][0].lower())
+        return children
+
+    def reachable(self, keys, exclude=None, children=None):
+        """keys and every package reachable from them along the edges,
+        without passing through exclude.
+
+        :param iterable keys: package keys to start from
+        :param str exclude: package key to treat as absent
+        :param dict children: dependency_children, if already computed
+        :rtype set
+        """
+        if children is None:
+            children = self.dependency_children()
+        seen = set()
+        stack = [k for k in keys if k != exclude]
+        while stack:
+            k = stack.pop()
+            if k in seen:
+                continue
+            seen.add(k)
+            stack.extend(c for c in children.get(k, ()) if c != exclude)
+        return seen
+
+    def top_level_packages(self):
+        """Keys of installed packages that no other installed package
+        requires. Packages only required from within a dependency cycle are
+        included so that everything installed is reachable from the result.
+
+        :rtype list
+        """
+        children = self.dependency_children()
+        installed = sorted(set(n[0].lower() for n in self.nodes))
+        required = set(c for k in installed for c in children.get(k, ()))
+        top = [k for k in installed if k not in required]
+        seen = self.reachable(top, children=children)
+        for k in installed:  # cycles
+            if k not in seen:
+                top.append(k)
+                seen |= self.reachable([k], children=children)
+        return top
 
     def package_in_env(self, package):
         """Interrogates current environment for existence of package.
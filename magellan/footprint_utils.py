@@ -0,0 +1,278 @@
+"""
+Module containing FootprintAnalyser class.
+
+Attributes on-disk size to each distribution in an environment, from its
+RECORD (or by walking its files), and totals it over the dependency graph to
+show which top-level requirements bring in the most bytes.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from terminaltables import SingleTable as OutputTableType
+
+from magellan.deps_utils import PyPIHelper
+from magellan.metadata_utils import EnvironmentScanner
+from magellan.utils import MagellanConfig, print_col
+from magellan.wheel_utils import best_wheel
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+
+def human_size(n_bytes):
+    """1536 -> '1.5 KiB'"""
+    if n_bytes is None:
+        return '?'
+    size = float(n_bytes)
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(size) < 1024 or unit == 'GiB':
+            break
+        size /= 1024
+    if unit == 'B':
+        return "{0:d} B".format(int(size))
+    return "{0:.1f} {1}".format(size, unit)
+
+
+class FootprintAnalyser(object):
+    """
+    Disk footprint of an environment's distributions.
+
+    Each distribution's size is the sum of the files it installed: sizes
+    from its RECORD, stat'ed where RECORD doesn't give one (or for egg-info
+    installed-files.txt); if it lists no files its metadata directory and
+    top-level module directories are walked instead. Distributions are sized
+    in parallel on a thread pool.
+
+    Over the graph, for each package:
+    - own: its own files;
+    - transitive: own size of it and everything it reaches;
+    - exclusive: own size of the packages that are only reachable from the
+      top-level requirements through it, i.e. that would go if it did;
+    - shared: transitive less exclusive.
+    """
+
+    def __init__(self, venv, max_workers=None):
+        self.venv = venv
+        self.max_workers = max_workers or MagellanConfig.max_workers
+        self.scanner = EnvironmentScanner(venv.site_dirs())
+        self.paths = self.scanner.distribution_paths()
+        self.versions = {n[0].lower(): n[1] for n in venv.nodes}
+        self.names = {n[0].lower(): n[0] for n in venv.nodes}
+
+    @staticmethod
+    def _file_size(path, size=None):
+        if size is not None:
+            return size
+        try:
+            return os.lstat(path).st_size
+        except OSError:  # listed but not there, e.g. uninstalled .pyc
+            return 0
+
+    @staticmethod
+    def _walk_size(path):
+        """Total size of a file, or of the files under a directory."""
+        if not os.path.isdir(path):
+            return FootprintAnalyser._file_size(path)
+        total = 0
+        for dir_path, _, files in os.walk(path):
+            for f in files:
+                total += FootprintAnalyser._file_size(
+                    os.path.join(dir_path, f))
+        return total
+
+    def distribution_size(self, key):
+        """
+        Bytes on disk installed by a distribution.
+
+        :param str key: lower case package name
+        :rtype int
+        :return: size, or None if the distribution can't be found
+        """
+        path = self.paths.get(key)
+        if path is None:
+            return None
+
+        files = EnvironmentScanner.distribution_files(path)
+        if files:
+            return sum(self._file_size(f, size) for f, size in files)
+
+        # No file list: walk the metadata and the top-level modules
+        meta = EnvironmentScanner.metadata_dir(path)
+        if meta is None:
+            return None
+        site_dir = os.path.dirname(meta)
+        maglog.debug("No file list for {}, walking {}".format(key, site_dir))
+        total = self._walk_size(meta)
+        for m in EnvironmentScanner.top_level_modules(path):
+            for candidate in [os.path.join(site_dir, m),
+                              os.path.join(site_dir, m + '.py')]:
+                if os.path.exists(candidate):
+                    total += self._walk_size(candidate)
+        return total
+
+    def sizes(self):
+        """Size of every installed distribution, read in parallel.
+
+        :rtype dict
+        :return: {key: bytes or None}
+        """
+        keys = sorted(self.versions)
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as ex:
+            return dict(zip(keys, ex.map(self.distribution_size, keys)))
+
+    def footprint(self, packages=None):
+        """
+        Own, transitive, exclusive and shared sizes of packages (default:
+        the environment's top-level requirements).
+
+        :param list packages: package names
+        :rtype dict
+        :return: {key: {'name', 'version', 'own', 'transitive', 'exclusive',
+        'shared', 'top_level'}}
+        """
+        sizes = self.sizes()
+        children = self.venv.dependency_children()
+        top_level = self.venv.top_level_packages()
+        installed = self.venv.reachable(top_level, children=children)
+
+        if packages:
+            keys = sorted(p.lower() for p in packages
+                          if p.lower() in self.versions)
+        else:
+            keys = top_level
+
+        def _total(ks):
+            return sum(sizes.get(k) or 0 for k in ks)
+
+        results = {}
+        for key in keys:
+            reach = self.venv.reachable([key], children=children)
+            without = self.venv.reachable(top_level, exclude=key,
+                                          children=children)
+            exclusive = reach & (installed - without)
+            transitive = _total(reach)
+            results[key] = {'name': self.names.get(key, key),
+                            'version': self.versions[key],
+                            'own': sizes.get(key),
+                            'transitive': transitive,
+                            'exclusive': _total(exclusive),
+                            'shared': transitive - _total(exclusive),
+                            'top_level': key in top_level}
+        return results
+
+    @staticmethod
+    def print_footprint(results, pretty=False):
+        """Prints output of footprint to stdout, largest first."""
+        if not results:
+            print_col("No packages to size.", pretty=pretty)
+            return
+
+        print_col("Disk footprint:", pretty=pretty, header=True)
+        table_data = [['PACKAGE', 'VERSION', 'TOP LEVEL', 'OWN',
+                       'TRANSITIVE', 'EXCLUSIVE', 'SHARED']]
+        for key, r in sorted(list(results.items()),
+                             key=lambda kv: (-kv[1]['transitive'], kv[0])):
+            table_data.append([
+                r['name'], r['version'], 'yes' if r['top_level'] else '',
+                human_size(r['own']), human_size(r['transitive']),
+                human_size(r['exclusive']), human_size(r['shared'])])
+        print_col(OutputTableType(table_data).table, pretty=pretty)
+
+    @staticmethod
+    def footprint_and_display(venv, packages=None, pretty=False):
+        """Convenience wrapper for the command line.
+
+        :rtype dict
+        """
+        results = FootprintAnalyser(venv).footprint(packages)
+        FootprintAnalyser.print_footprint(results, pretty)
+        return results
+
+    @staticmethod
+    def wheel_size(package, version, python_version=None, platform=None):
+        """
+        Size of the wheel of package==version most likely to be installed,
+        from (cached) PyPI release data. A pure wheel is preferred, then
+        those for the python version and platform, then any wheel.
+
+        :param str python_version: "X.Y" of the target, default this python
+        :param str platform: sys.platform of the target, default this one
+        :rtype int
+        :return: bytes, or None if there's no wheel for the version
+        """
+        package_json = PyPIHelper.acquire_package_json_info(package)
+        files = [f for f in (package_json or {}).get('releases', {}).get(
+            version) or [] if f.get('size') is not None]
+        wheel = best_wheel(files, python_version, platform)
+        return wheel['size'] if wheel else None
+
+    def estimate_upgrade(self, package, version):
+        """
+        Estimated change in own size of package on moving to version.
+
+        The installed size is scaled by the ratio of the new and current
+        wheel sizes, as wheels are compressed; for packages not in the
+        environment the new wheel size is used. If the current version has
+        no wheel there's nothing to scale by, so the estimate is unknown.
+
+        :rtype dict
+        :return: {'name', 'current_version', 'version', 'current_size',
+        'estimated_size', 'change'}; sizes None where unknown
+        """
+        key = package.lower()
+        current_version = self.versions.get(key)
+        current_size = self.distribution_size(key) if current_version else 0
+        python_version = self.scanner.python_version
+
+        new_wheel = self.wheel_size(package, version, python_version)
+        old_wheel = (self.wheel_size(package, current_version,
+                                     python_version)
+                     if current_version else None)
+
+        if new_wheel is None or current_size is None:
+            estimated = None
+        elif not current_version:
+            estimated = new_wheel
+        elif old_wheel:
+            estimated = int(round(current_size * new_wheel / float(old_wheel)))
+        else:
+            estimated = None
+
+        return {'name': self.names.get(key, package),
+                'current_version': current_version,
+                'version': version,
+                'current_size': current_size,
+                'estimated_size': estimated,
+                'change': (None if estimated is None
+                           else estimated - current_size)}
+
+    @staticmethod
+    def print_upgrade_estimates(estimates, pretty=False):
+        """Prints output of estimate_upgrade to stdout."""
+        print_col("Estimated footprint change:", pretty=pretty, header=True)
+        table_data = [['PACKAGE', 'FROM', 'TO', 'CURRENT', 'ESTIMATED',
+                       'CHANGE']]
+        for e in estimates:
+            change = e['change']
+            table_data.append([
+                e['name'], e['current_version'] or '-', e['version'],
+                human_size(e['current_size']),
+                human_size(e['estimated_size']),
+                '?' if change is None else
+                ('+' if change >= 0 else '-') + human_size(abs(change))])
+        print_col(OutputTableType(table_data).table, pretty=pretty)
+
+    @staticmethod
+    def estimate_and_display(package_versions, venv, pretty=False):
+        """Convenience wrapper for -P --footprint.
+
+        :param list package_versions: (package, version) pairs
+        :rtype list
+        """
+        analyser = FootprintAnalyser(venv)
+        estimates = [analyser.estimate_upgrade(p, v)
+                     for p, v in package_versions]
+        FootprintAnalyser.print_upgrade_estimates(estimates, pretty)
+        return estimates
@@ -0,0 +1,346 @@
+"""
+Module containing ImportScanner class.
+
+Parses a project's source with ast to find the top-level modules it imports,
+maps them to the distributions installed in an environment, and compares
+those with the project's declared requirements (the edges of its node) to
+find requirements that are never imported and imports that aren't required.
+"""
+
+import ast
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from terminaltables import SingleTable as OutputTableType
+
+from magellan.metadata_utils import EnvironmentScanner, modules_from_files
+from magellan.utils import MagellanConfig, mkdir_p, print_col
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+SKIP_DIRS = {'.git', '.hg', '.svn', '.tox', '.nox', '.eggs', '__pycache__',
+             'build', 'dist', 'node_modules', 'venv', '.venv', 'env'}
+
+STDLIB_MODULES = set(getattr(sys, 'stdlib_module_names', ())) | set(
+    sys.builtin_module_names) | {'__future__'}
+
+
+class _ImportVisitor(ast.NodeVisitor):
+    """Collects top-level imported names, noting those that are optional:
+    in the body or else of a try/except ImportError, or under
+    if TYPE_CHECKING."""
+
+    GUARD_ERRORS = {'ImportError', 'ModuleNotFoundError', 'Exception'}
+
+    def __init__(self):
+        self.required = set()
+        self.optional = set()
+        self._guarded = 0
+
+    def _add(self, name):
+        top = name.split('.')[0]
+        (self.optional if self._guarded else self.required).add(top)
+
+    def visit_Import(self, node):
+        for a in node.names:
+            self._add(a.name)
+
+    def visit_ImportFrom(self, node):
+        if not node.level and node.module:
+            self._add(node.module)
+
+    def _visit_guarded(self, nodes, guarded):
+        self._guarded += guarded
+        for n in nodes:
+            self.visit(n)
+        self._guarded -= guarded
+
+    def visit_Try(self, node):
+        guarded = any(self._catches_import_error(h.type)
+                      for h in node.handlers)
+        self._visit_guarded(node.body + node.orelse, guarded)
+        for n in node.handlers + node.finalbody:
+            self.visit(n)
+
+    visit_TryStar = visit_Try
+
+    def _catches_import_error(self, handler_type):
+        if handler_type is None:  # bare except
+            return True
+        types = handler_type.elts if isinstance(
+            handler_type, ast.Tuple) else [handler_type]
+        return any(getattr(t, 'id', getattr(t, 'attr', None))
+                   in self.GUARD_ERRORS for t in types)
+
+    def visit_If(self, node):
+        test = node.test
+        type_checking = getattr(test, 'id', getattr(test, 'attr', None)) \
+            == 'TYPE_CHECKING'
+        self.visit(test)
+        self._visit_guarded(node.body, type_checking)
+        for n in node.orelse:
+            self.visit(n)
+
+
+def imports_in_source(source, filename='<unknown>'):
+    """
+    Top-level names of the modules imported by source; relative imports
+    are ignored.
+
+    :param source: str or bytes
+    :rtype list, list
+    :return: required imports, optional imports (guarded by try/except
+    ImportError or if TYPE_CHECKING, and not also imported unguarded)
+    :raises SyntaxError: if source can't be parsed
+    """
+    visitor = _ImportVisitor()
+    visitor.visit(ast.parse(source, filename))
+    return (sorted(visitor.required),
+            sorted(visitor.optional - visitor.required))
+
+
+def _parse_file(path_and_source):
+    """Process pool worker: (path, source) -> ([required, optional], error).
+    """
+    path, source = path_and_source
+    try:
+        return list(imports_in_source(source, path)), None
+    except (SyntaxError, ValueError) as e:
+        return None, "{0}: {1}".format(type(e).__name__, e)
+
+
+class ImportScanner(object):
+    """
+    Imports of a project's source tree against its declared requirements.
+
+    Files are parsed in a process pool; results are cached by a hash of
+    each file's content in one index under the cache dir, so only files that
+    have changed are parsed again on re-runs.
+    """
+
+    cache_name = 'import_scan.json'
+
+    def __init__(self, source_dir, max_workers=None):
+        self.source_dir = source_dir
+        self.max_workers = max_workers or MagellanConfig.max_workers
+        self.errors = {}
+        self.parsed = 0
+
+    @property
+    def cache_file(self):
+        return os.path.join(MagellanConfig.cache_dir, self.cache_name)
+
+    def python_files(self):
+        """Python files in the source tree, skipping VCS, build and virtual
+        env directories.
+
+        :rtype list
+        """
+        found = []
+        for dir_path, dir_names, file_names in os.walk(self.source_dir):
+            dir_names[:] = sorted(
+                d for d in dir_names if d not in SKIP_DIRS and
+                not d.startswith('.') and not os.path.isfile(
+                    os.path.join(dir_path, d, 'pyvenv.cfg')))
+            found.extend(os.path.join(dir_path, f)
+                         for f in sorted(file_names) if f.endswith('.py'))
+        return found
+
+    def own_modules(self):
+        """Top-level modules provided by the source tree itself.
+
+        :rtype set
+        """
+        files = self.python_files()
+        own = set()
+        if os.path.isfile(os.path.join(self.source_dir, '__init__.py')):
+            own.add(os.path.basename(os.path.abspath(self.source_dir)))
+        for base in (self.source_dir, os.path.join(self.source_dir, 'src')):
+            own.update(modules_from_files(
+                [os.path.relpath(f, base) for f in files
+                 if f.startswith(os.path.join(base, ''))]))
+        return own
+
+    def _load_cache(self):
+        if not MagellanConfig.caching or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError) as e:
+            maglog.debug("Unreadable import cache {}: {}"
+                         .format(self.cache_file, e))
+            return {}
+
+    def _save_cache(self, cache):
+        if not MagellanConfig.caching:
+            return
+        try:
+            mkdir_p(os.path.dirname(self.cache_file))
+            tmp_path = "{0}.{1}.{2}.tmp".format(
+                self.cache_file, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'w') as f:
+                json.dump(cache, f)
+            os.rename(tmp_path, self.cache_file)
+        except (IOError, OSError) as e:
+            maglog.debug("Unable to write import cache {}: {}"
+                         .format(self.cache_file, e))
+
+    def file_imports(self):
+        """
+        Imports of every python file in the tree, parsing only those whose
+        content isn't in the cache.
+
+        :rtype dict
+        :return: {path: [required, optional]} top-level module names
+        """
+        cache = self._load_cache()
+        digests, to_parse = {}, []
+        for path in self.python_files():
+            try:
+                with open(path, 'rb') as f:
+                    source = f.read()
+            except (IOError, OSError) as e:
+                self.errors[path] = str(e)
+                continue
+            digest = hashlib.sha256(source).hexdigest()
+            digests[path] = digest
+            if digest not in cache:
+                to_parse.append((path, source))
+
+        self.parsed = len(to_parse)
+        maglog.info("{} python files, {} to parse".format(
+            len(digests), len(to_parse)))
+        if to_parse:
+            workers = max(1, self.max_workers)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(
+                    _parse_file, to_parse,
+                    chunksize=max(1, len(to_parse) // (4 * workers))))
+            for (path, _), (imports, error) in zip(to_parse, results):
+                if error:
+                    self.errors[path] = error
+                    continue  # not cached, so reported again
+                cache[digests[path]] = imports
+            self._save_cache(cache)
+
+        return {path: cache[digest] for path, digest in digests.items()
+                if digest in cache}
+
+    def scan(self, project, venv):
+        """
+        Compare imports in the source tree with the requirements of the
+        project's node in venv.
+
+        :param str project: project's package name in venv
+        :param venv: magellan.env_utils.Environment
+        :rtype dict
+        :return: {'unused': [keys], 'undeclared': {key: {'modules', 'files',
+        'via'}}, 'unresolved': {module: files}, 'files', 'parsed', 'errors'}
+        """
+        key = project.lower()
+        children = venv.dependency_children()
+        declared = sorted(children.get(key, ()))
+
+        scanner = EnvironmentScanner(venv.site_dirs())
+        owners = scanner.module_distributions()
+        ignore = STDLIB_MODULES | self.own_modules() | set(
+            m for m, keys in owners.items() if key in keys)
+
+        used_by = {}  # module: files importing it
+        optional = set()
+        file_imports = self.file_imports()
+        for path, (required, optional_imports) in sorted(
+                file_imports.items()):
+            optional.update(optional_imports)
+            for m in required:
+                if m not in ignore:
+                    used_by.setdefault(m, []).append(
+                        os.path.relpath(path, self.source_dir))
+        optional -= set(used_by)
+
+        via_declared = venv.reachable(declared, children=children)
+
+        used, undeclared, unresolved = set(), {}, {}
+        for m, files in sorted(used_by.items()):
+            providers = owners.get(m)
+            if not providers:
+                unresolved[m] = files
+                continue
+            declared_providers = [p for p in providers if p in declared]
+            if declared_providers:
+                used.update(declared_providers)
+                continue
+            provider = providers[0]
+            entry = undeclared.setdefault(
+                provider, {'modules': [], 'files': set(),
+                           'via': provider in via_declared})
+            entry['modules'].append(m)
+            entry['files'].update(files)
+
+        for entry in undeclared.values():
+            entry['files'] = sorted(entry['files'])
+
+        # An optional import still counts as using a requirement
+        for m in optional:
+            used.update(p for p in owners.get(m, ()) if p in declared)
+
+        return {'unused': [d for d in declared if d not in used],
+                'undeclared': undeclared,
+                'unresolved': unresolved,
+                'files': len(file_imports),
+                'parsed': self.parsed,
+                'errors': self.errors}
+
+    @staticmethod
+    def print_scan(result, pretty=False):
+        """Prints output of scan to stdout."""
+        print_col("{0} files scanned ({1} parsed, rest cached)".format(
+            result['files'], result['parsed']), pretty=pretty)
+
+        if result['unused']:
+            print_col("Declared but never imported:", pretty=pretty,
+                      header=True)
+            for d in result['unused']:
+                print_col("  {}".format(d), pretty=pretty)
+        else:
+            print_col("Every declared requirement is imported.",
+                      pretty=pretty, header=True)
+
+        if result['undeclared']:
+            print_col("Imported but not declared:", pretty=pretty,
+                      header=True)
+            table_data = [['PACKAGE', 'MODULES', 'INSTALLED VIA', 'FILES']]
+            for key, entry in sorted(result['undeclared'].items()):
+                files = entry['files']
+                table_data.append([
+                    key, ", ".join(entry['modules']),
+                    'requirements' if entry['via'] else '',
+                    "{0}{1}".format(files[0], " (+{})".format(len(files) - 1)
+                                    if len(files) > 1 else '')])
+            print_col(OutputTableType(table_data).table, pretty=pretty)
+
+        if result['unresolved']:
+            print_col("Imported but not installed in environment:",
+                      pretty=pretty, header=True)
+            for m, files in sorted(result['unresolved'].items()):
+                print_col("  {0} ({1})".format(m, files[0]), pretty=pretty)
+
+        for path, error in sorted(result['errors'].items()):
+            maglog.warning("Unable to parse {}: {}".format(path, error))
+
+    @staticmethod
+    def scan_and_display(project, source_dir, venv, pretty=False):
+        """Convenience wrapper for the command line.
+
+        :rtype dict
+        """
+        result = ImportScanner(source_dir).scan(project, venv)
+        ImportScanner.print_scan(result, pretty)
+        return result
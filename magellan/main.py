@@ -3,6 +3,7 @@
 
 
 
+import contextlib
 import logging
 import os
 import sys
@@ -13,7 +14,14 @@ from natsort import natsorted
 from magellan.utils import MagellanConfig
 from magellan.env_utils import Environment
 from magellan.package_utils import Package, Requirements
-from magellan.deps_utils import DepTools, PyPIHelper
+from magellan.deps_utils import DepTools, PyPIHelper, PyPIPrefetcher
+from magellan.footprint_utils import FootprintAnalyser
+from magellan.import_scan_utils import ImportScanner
+from magellan.plan_utils import UpgradePlanner
+from magellan.profile_utils import ImportProfiler
+from magellan.cache_utils import ResultCache
+from magellan.multi_env_utils import EnvironmentGroup
+from magellan.crawl_utils import DependencyCrawler
 from magellan.cmd import cmds
 
 maglog = logging.getLogger('magellan_logger')
@@ -29,7 +37,100 @@ def _go(venv_name, **kwargs):
     Otherwise perform general analysis on environment.
     """
 
+    _setup_config_and_list_versions(kwargs)
+
+    with _prefetching(kwargs) as names_callback:
+        venv = Environment(venv_name)
+        venv.magellan_setup_go_env(kwargs, names_callback)
+
+        _analyse_env(venv, **kwargs)
+
+
+def _go_many(venv_names, **kwargs):
+    """Run magellan over several environments.
+
+    Environments are interrogated concurrently; those that can't be are
+    reported and skipped. PyPI lookups and dependency acquisition are shared
+    across environments. Analyses run per environment, or with --aggregate
+    -s, -p, -O and -C report once across all of them.
+    """
+
     print_col = kwargs.get('colour')  # print in colour
+    aggregate = kwargs.get('aggregate')
+
+    _setup_config_and_list_versions(kwargs)
+
+    if kwargs.get('path_to_env_bin'):
+        sys.exit('LAPU LAPU! --path-to-env-bin can only be used with a '
+                 'single environment.')
+
+    with _prefetching(kwargs) as names_callback:
+        group = EnvironmentGroup(venv_names, MagellanConfig.max_workers)
+        group.setup(kwargs, names_callback)
+        group.print_failed(print_col)
+        if not group.venvs:
+            sys.exit('LAPU LAPU! None of the environments could be '
+                     'interrogated.')
+
+        if (kwargs['show_all_packages'] or
+                kwargs['show_all_packages_and_versions']):
+            group.show_all_packages(
+                kwargs['show_all_packages_and_versions'], aggregate,
+                print_col)
+            sys.exit(0)
+
+        if kwargs['outdated']:
+            group.check_outdated_packages(kwargs, print_col, aggregate)
+            sys.exit()
+
+        # Environment independent, so only done once:
+        if kwargs['get_dependencies']:  # -D
+            DepTools.acquire_and_display_dependencies(
+                kwargs['get_dependencies'], print_col)
+
+        if kwargs['package_conflicts']:  # -P
+            group.prefetch_dependencies(kwargs['package_conflicts'])
+
+        if kwargs['detect_env_conflicts'] and aggregate:  # -C --aggregate
+            env_conflicts = group.detect_env_conflicts(print_col)
+
+        per_env_kwargs = dict(
+            kwargs, get_dependencies=None,
+            detect_env_conflicts=(kwargs['detect_env_conflicts'] and
+                                  not aggregate))
+        per_env = ['get_ancestors', 'get_descendants', 'package_conflicts',
+                   'plan_upgrade', 'detect_env_conflicts',
+                   'import_profile', 'footprint', 'scan_imports',
+                   'compare_env_to_req_file']
+        if not any(per_env_kwargs.get(k) for k in per_env):
+            return
+
+        for venv in group.venvs:
+            group.print_header(venv, print_col)
+            _analyse_env(venv, **per_env_kwargs)
+
+
+def _setup_config_and_list_versions(kwargs):
+    """Apply configuration from command line, then list package versions
+    or crawl their dependencies and exit if asked to (-l, --crawl)."""
+
+    ResultCache.enabled = not kwargs.get('no_result_cache')
+    MagellanConfig.max_workers = kwargs.get(
+        'max_workers') or MagellanConfig.max_workers
+    MagellanConfig.env_backend = kwargs.get(
+        'env_backend') or MagellanConfig.env_backend
+    MagellanConfig.json_metadata = not kwargs.get('no_json_metadata')
+    MagellanConfig.wheel_metadata = not kwargs.get('no_wheel_metadata')
+    MagellanConfig.sdist_metadata = not kwargs.get('no_sdist_metadata')
+    if kwargs.get('env_pool_size') is not None:
+        MagellanConfig.env_pool_size = max(0, kwargs['env_pool_size'])
+    if kwargs.get('wheel_store_size') is not None:
+        MagellanConfig.wheel_store_size = max(
+            0, kwargs['wheel_store_size']) * 1024 ** 2
+    MagellanConfig.pip_update = not kwargs.get('no_pip_update')
+    if kwargs.get('install_timeout') is not None:
+        MagellanConfig.install_timeout = kwargs['install_timeout'] or None
+    MagellanConfig.retry_quarantined = bool(kwargs.get('retry_quarantined'))
 
     # Environment Setup
     if not os.path.exists(MagellanConfig.cache_dir) and MagellanConfig.caching:
@@ -43,8 +144,73 @@ def _go(venv_name, **kwargs):
             pprint(natsorted(all_package_versions))
         sys.exit()
 
-    venv = Environment(venv_name)
-    venv.magellan_setup_go_env(kwargs)
+    if kwargs.get('crawl'):
+        for c in kwargs['crawl']:
+            try:
+                DependencyCrawler.crawl_and_display(
+                    c, kwargs.get('crawl_install'), kwargs.get('colour'))
+            except ValueError as e:
+                sys.exit('LAPU LAPU! Unable to crawl {}: {}'.format(c, e))
+        sys.exit()
+
+
+def _network_package_names(kwargs):
+    """
+    Packages whose PyPI data the command will fetch.
+
+    :rtype list, bool
+    :return: names known from the command line, and whether the packages in
+    the environment(s) are needed too
+    """
+    names = [p[0] for p in kwargs.get('get_dependencies') or []]
+    names += [p[0] for p in kwargs.get('package_conflicts') or []]
+    env_names = False
+
+    if (kwargs['show_all_packages'] or
+            kwargs['show_all_packages_and_versions']):
+        pass  # exits before any analysis
+    elif kwargs['outdated']:
+        if kwargs.get('packages'):
+            names += kwargs['packages']
+        elif not (kwargs.get('package_file') or
+                  kwargs.get('requirements_file')):
+            env_names = True
+    elif kwargs['package_conflicts'] and kwargs.get('transitive'):
+        env_names = True
+
+    return names, env_names
+
+
+@contextlib.contextmanager
+def _prefetching(kwargs):
+    """
+    With --prefetch, warm the PyPI cache in the background, within the
+    --prefetch-workers budget, for packages the command will need while the
+    environment is still being interrogated. Nothing is started if the
+    command doesn't need network data; fetches not yet started are cancelled
+    on exit.
+
+    Yields the package_names_callback for Environment.magellan_setup_env,
+    or None if environment packages aren't needed.
+    """
+    names, env_names = _network_package_names(kwargs)
+    if not kwargs.get('prefetch') or not (names or env_names):
+        yield None
+        return
+
+    with PyPIPrefetcher(kwargs.get('prefetch_workers')) as prefetcher:
+        prefetcher.submit(names)
+        if env_names:
+            yield prefetcher.environment_package_names
+        else:
+            yield None
+
+
+def _analyse_env(venv, **kwargs):
+    """Package specific analysis if packages are specified, otherwise
+    general analysis of the environment."""
+
+    print_col = kwargs.get('colour')  # print in colour
 
     requirements_file = kwargs.get('requirements_file')
 
@@ -61,31 +227,62 @@ def _go(venv_name, **kwargs):
         else:  # if nothing passed in then check local env.
             Package.check_outdated_packages(venv.all_packages, print_col)
 
-        sys.exit()
+        return
 
     if kwargs['get_dependencies']:  # -D
         DepTools.acquire_and_display_dependencies(
             kwargs['get_dependencies'], print_col)
 
     if kwargs['get_ancestors']:  # -A
-        ancestor_dictionary = \
-            DepTools.get_ancestors_of_packages(
-                kwargs['get_ancestors'], venv, print_col)
+        ancestor_dictionary = ResultCache.run(
+            venv, 'get_ancestors', [kwargs['get_ancestors'], print_col],
+            DepTools.get_ancestors_of_packages,
+            kwargs['get_ancestors'], venv, print_col)
 
     if kwargs['get_descendants']:  # -Z
-        descendants_dictionary = \
-            DepTools.get_descendants_of_packages(
-                kwargs['get_descendants'], venv, print_col)
+        descendants_dictionary = ResultCache.run(
+            venv, 'get_descendants', [kwargs['get_descendants'], print_col],
+            DepTools.get_descendants_of_packages,
+            kwargs['get_descendants'], venv, print_col)
+
+    if kwargs['package_conflicts'] and kwargs.get('joint'):  # -P --joint
+        joint_conflicts = DepTools.detect_joint_package_conflicts(
+            kwargs['package_conflicts'], venv, print_col)
 
-    if kwargs['package_conflicts']:  # -P
+    elif kwargs['package_conflicts']:  # -P
         addition_conflicts, upgrade_conflicts = \
             DepTools.process_package_conflicts(
-                kwargs['package_conflicts'], venv, print_col)
+                kwargs['package_conflicts'], venv, print_col,
+                transitive=kwargs.get('transitive'))
+
+    if kwargs.get('plan_upgrade'):
+        upgrade_plan = UpgradePlanner.plan_and_display(
+            kwargs['plan_upgrade'][0], kwargs['plan_upgrade'][1], venv,
+            print_col, kwargs['max_step_changes'])
 
     if kwargs['detect_env_conflicts']:  # -C
-        cur_env_conflicts = DepTools.highlight_conflicts_in_current_env(
+        cur_env_conflicts = ResultCache.run(
+            venv, 'detect_env_conflicts', [print_col],
+            DepTools.highlight_conflicts_in_current_env,
             venv.nodes, venv.package_requirements, print_col)
 
+    if kwargs.get('import_profile'):
+        import_profile = ImportProfiler.profile_and_display(
+            venv, package_list, print_col)
+
+    if kwargs.get('footprint') and kwargs['package_conflicts']:
+        footprint_change = FootprintAnalyser.estimate_and_display(
+            kwargs['package_conflicts'], venv, print_col)
+
+    elif kwargs.get('footprint'):
+        footprint = FootprintAnalyser.footprint_and_display(
+            venv, package_list, print_col)
+
+    if kwargs.get('scan_imports'):
+        import_scan = ImportScanner.scan_and_display(
+            kwargs['scan_imports'][0], kwargs['scan_imports'][1], venv,
+            print_col)
+
     if kwargs['compare_env_to_req_file']:  # -R
         if not requirements_file:
             print("Please specify a requirements file with -r <file>")
@@ -100,7 +297,18 @@ def _go(venv_name, **kwargs):
 
 def main():
     kwargs = cmds()
-    _go(**kwargs)
+    venv_globs = kwargs.pop('venv_glob')
+    venv_names = EnvironmentGroup.resolve_venv_names(
+        kwargs.pop('venv_name'), venv_globs)
+    if len(venv_names) > 1:
+        _go_many(venv_names, **kwargs)
+    elif venv_names:
+        _go(venv_names[0], **kwargs)
+    elif venv_globs:
+        sys.exit('LAPU LAPU! No virtual envs match {}'.format(
+            ", ".join(venv_globs)))
+    else:
+        _go(None, **kwargs)
 
 
 if __name__ == "__main__":
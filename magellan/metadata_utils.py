@@ -0,0 +1,475 @@
+"""
+Module containing EnvironmentScanner class and metadata parsing helpers.
+
+Reads installed distribution metadata (*.dist-info/METADATA, *.egg-info
+PKG-INFO and requires.txt) straight from disk, so an environment can be
+analysed without running anything inside it.
+"""
+
+import csv
+import glob
+import logging
+import os
+import re
+import sys
+import sysconfig
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import Parser
+
+import pkg_resources
+
+from magellan.utils import MagellanConfig
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+# As env_interrogation.py:
+SKIP = ['pipdeptree', 'magellan', 'vex', 'pip', 'python', 'distribute']
+
+MODULE_SUFFIXES = ('.py', '.so', '.pyd')
+
+
+def marker_environment(python_version=None):
+    """
+    Marker environment overrides for a target interpreter; anything not given
+    here is taken from the running interpreter.
+
+    :param str python_version: "X.Y" version of target python
+    :rtype dict
+    """
+    env = {'extra': ''}
+    if python_version:
+        env['python_version'] = python_version
+        if not sys.version.startswith(python_version + '.'):
+            env['python_full_version'] = python_version + '.0'
+    return env
+
+
+def parse_requirement_lines(lines, environment=None):
+    """
+    Parse requirement strings (e.g. Requires-Dist values), applying
+    environment markers.
+
+    :param list lines: requirement strings, may include "; marker"
+    :param dict environment: marker environment, see marker_environment
+    :rtype dict
+    :return: {key: {'project_name', 'key', 'specs'}} as
+    package_interrogation.py
+    """
+    if environment is None:
+        environment = marker_environment()
+
+    requires = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            req = pkg_resources.Requirement.parse(line)
+        except Exception as e:
+            maglog.debug("Unable to parse requirement {}: {}".format(line, e))
+            continue
+
+        if req.marker is not None:
+            try:
+                if not req.marker.evaluate(environment):
+                    continue
+            except Exception as e:
+                maglog.debug("Unable to evaluate marker on {}: {}"
+                             .format(line, e))
+                continue
+
+        if req.key in requires:
+            requires[req.key]['specs'] += [
+                s for s in req.specs if s not in requires[req.key]['specs']]
+        else:
+            requires[req.key] = {'project_name': req.project_name,
+                                 'key': req.key,
+                                 'specs': list(req.specs)}
+    return requires
+
+
+def parse_requires_txt(text, environment=None):
+    """
+    Parse an egg-info requires.txt, keeping the unconditional section and
+    any ":marker" sections whose marker holds. Extras are ignored.
+
+    :param str text: contents of requires.txt
+    :param dict environment: marker environment, see marker_environment
+    :rtype dict
+    """
+    lines = []
+    include = True
+    section_marker = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        section = re.match(r'^\[(.*)\]$', line)
+        if section:
+            extra, _, marker = section.group(1).partition(':')
+            include = not extra.strip()
+            section_marker = marker.strip() or None
+            continue
+        if include:
+            if section_marker:
+                line = "{0}; {1}".format(line, section_marker)
+            lines.append(line)
+    return parse_requirement_lines(lines, environment)
+
+
+def parse_metadata(text):
+    """
+    Parse METADATA / PKG-INFO contents.
+
+    :param str text: RFC 822 style metadata
+    :rtype dict
+    :return: {'name', 'version', 'requires_dist', 'metadata_version',
+    'dynamic'}
+    """
+    msg = Parser().parsestr(text, headersonly=True)
+    return {'name': msg.get('Name'),
+            'version': msg.get('Version'),
+            'requires_dist': msg.get_all('Requires-Dist') or [],
+            'metadata_version': msg.get('Metadata-Version'),
+            'dynamic': [d.lower() for d in msg.get_all('Dynamic') or []]}
+
+
+def requirements_from_metadata(text, environment=None):
+    """
+    Requirements dictionary from METADATA / PKG-INFO contents.
+
+    :rtype dict
+    :return: {'project_name', 'version', 'requires'} in the same format as
+    DepTools.get_deps_for_package_version.
+    """
+    meta = parse_metadata(text)
+    return {'project_name': pkg_resources.safe_name(meta['name'] or ''),
+            'version': meta['version'],
+            'requires': parse_requirement_lines(meta['requires_dist'],
+                                                environment)}
+
+
+def parse_record(text):
+    """
+    Parse a dist-info RECORD.
+
+    :param str text: contents of RECORD (CSV of path, hash, size)
+    :rtype list
+    :return: (path, size) tuples, size None where not recorded
+    """
+    rows = []
+    for row in csv.reader(text.splitlines()):
+        if not row or not row[0]:
+            continue
+        size = None
+        if len(row) > 2 and row[2].strip().isdigit():
+            size = int(row[2])
+        rows.append((row[0], size))
+    return rows
+
+
+def modules_from_files(paths):
+    """
+    Top-level importable names provided by installed files.
+
+    :param list paths: file paths relative to site-packages
+    :rtype list
+    """
+    modules = set()
+    for p in paths:
+        parts = p.replace('\\', '/').split('/')
+        top = parts[0]
+        if top in ('', '.', '..', '__pycache__') or \
+                top.endswith(('.dist-info', '.egg-info', '.data', '.pth')):
+            continue
+        if len(parts) > 1:
+            if parts[-1].endswith(MODULE_SUFFIXES):
+                modules.add(top)
+        elif top.endswith(MODULE_SUFFIXES):
+            modules.add(top.split('.')[0])
+    return sorted(modules)
+
+
+def _read(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+
+class EnvironmentScanner(object):
+    """
+    Builds nodes, edges and package_requirements for an environment by
+    reading distribution metadata from its site-packages directories.
+    """
+
+    metadata_globs = ['*.dist-info', '*.egg-info', '*.egg-link']
+
+    def __init__(self, site_dirs, python_version=None, max_workers=None):
+        self.site_dirs = site_dirs
+        if python_version is None:
+            python_version = self.python_version_from_site_dirs(site_dirs)
+        self.python_version = python_version
+        self.environment = marker_environment(python_version)
+        self.max_workers = max_workers or MagellanConfig.max_workers
+
+    @staticmethod
+    def site_dirs_for_bin(bin_dir):
+        """site-packages directories of the environment owning bin_dir."""
+        env_dir = os.path.dirname(os.path.normpath(bin_dir))
+        return sorted(
+            glob.glob(os.path.join(env_dir, 'lib', 'python*',
+                                   'site-packages')) +
+            glob.glob(os.path.join(env_dir, 'lib64', 'python*',
+                                   'site-packages')) +
+            glob.glob(os.path.join(env_dir, 'Lib', 'site-packages')))
+
+    @staticmethod
+    def site_dirs_for_running_interpreter():
+        """site-packages directories of the running interpreter."""
+        paths = sysconfig.get_paths()
+        return sorted(set(p for p in [paths.get('purelib'),
+                                      paths.get('platlib')]
+                          if p and os.path.isdir(p)))
+
+    @staticmethod
+    def python_version_from_site_dirs(site_dirs):
+        """Infer "X.Y" from .../lib/pythonX.Y/site-packages, else None."""
+        for d in site_dirs:
+            match = re.search(r'python(\d+\.\d+)', d)
+            if match:
+                return match.group(1)
+        return None
+
+    def find_distributions(self):
+        """Paths to metadata of every distribution in site_dirs, in the
+        order of site_dirs (sorted within each).
+
+        :rtype list
+        """
+        found = []
+        for d in self.site_dirs:
+            in_dir = []
+            for pattern in self.metadata_globs:
+                in_dir += glob.glob(os.path.join(d, pattern))
+            found += sorted(in_dir)
+        return found
+
+    def read_distribution(self, path):
+        """
+        Read one distribution's metadata.
+
+        :param str path: *.dist-info, *.egg-info (dir or file) or *.egg-link
+        :rtype dict
+        :return: {'project_name', 'version', 'requires'} or None
+        """
+        try:
+            if path.endswith('.egg-link'):
+                project_dir = _read(path).splitlines()[0].strip()
+                if not os.path.isabs(project_dir):
+                    project_dir = os.path.join(os.path.dirname(path),
+                                               project_dir)
+                egg_infos = glob.glob(os.path.join(project_dir, '*.egg-info'))
+                if not egg_infos:
+                    return None
+                return self.read_distribution(egg_infos[0])
+
+            if path.endswith('.dist-info'):
+                record = requirements_from_metadata(
+                    _read(os.path.join(path, 'METADATA')), self.environment)
+            elif os.path.isdir(path):
+                record = requirements_from_metadata(
+                    _read(os.path.join(path, 'PKG-INFO')), self.environment)
+                requires_txt = os.path.join(path, 'requires.txt')
+                if os.path.exists(requires_txt):
+                    record['requires'] = parse_requires_txt(
+                        _read(requires_txt), self.environment)
+            else:
+                record = requirements_from_metadata(_read(path),
+                                                    self.environment)
+        except (IOError, OSError, IndexError) as e:
+            maglog.debug("Unable to read distribution at {}: {}"
+                         .format(path, e))
+            return None
+
+        # Name as pkg_resources derives it: from the metadata filename.
+        file_name = self.name_from_path(path)
+        if file_name:
+            record['project_name'] = file_name
+        if not record.get('version'):
+            return None
+        return record
+
+    @staticmethod
+    def name_from_path(path):
+        """Project name from a metadata path, e.g. "Foo_Bar-1.0.dist-info"
+        gives "Foo-Bar"; '' if none."""
+        base = os.path.basename(path).rsplit('.', 1)[0]
+        file_name = base.split('-')[0]
+        return pkg_resources.safe_name(file_name) if file_name else ''
+
+    def package_names(self):
+        """Names of distributions in site_dirs, from their metadata
+        filenames alone (nothing is read).
+
+        :rtype list
+        """
+        names = [self.name_from_path(p) for p in self.find_distributions()]
+        return sorted(set(n for n in names if n and n.lower() not in SKIP))
+
+    @staticmethod
+    def metadata_dir(path):
+        """*.dist-info / *.egg-info for a metadata path, following an
+        *.egg-link to its project's egg-info; None if there isn't one."""
+        if not path.endswith('.egg-link'):
+            return path
+        try:
+            project_dir = _read(path).splitlines()[0].strip()
+        except (IOError, OSError, IndexError):
+            return None
+        if not os.path.isabs(project_dir):
+            project_dir = os.path.join(os.path.dirname(path), project_dir)
+        egg_infos = glob.glob(os.path.join(project_dir, '*.egg-info'))
+        return egg_infos[0] if egg_infos else None
+
+    def distribution_paths(self):
+        """Metadata path of each distribution, first on path winning as in
+        build_graph.
+
+        :rtype dict
+        :return: {key: path}
+        """
+        paths = {}
+        for p in self.find_distributions():
+            key = self.name_from_path(p).lower()
+            if key and key not in SKIP and key not in paths:
+                paths[key] = p
+        return paths
+
+    @staticmethod
+    def distribution_files(path):
+        """
+        Files installed by a distribution, from its RECORD (dist-info) or
+        installed-files.txt (egg-info).
+
+        :param str path: metadata path
+        :rtype list
+        :return: (absolute path, size) tuples, size None if not recorded;
+        empty if the distribution doesn't list its files
+        """
+        meta = EnvironmentScanner.metadata_dir(path)
+        if meta is None or not os.path.isdir(meta):
+            return []
+        try:
+            if meta.endswith('.dist-info'):
+                base = os.path.dirname(meta)
+                rows = parse_record(_read(os.path.join(meta, 'RECORD')))
+            else:
+                base = meta
+                rows = [(l.strip(), None) for l in _read(
+                    os.path.join(meta, 'installed-files.txt')).splitlines()
+                    if l.strip()]
+        except (IOError, OSError) as e:
+            maglog.debug("No file list for {}: {}".format(path, e))
+            return []
+        return [(os.path.normpath(os.path.join(base, f)), size)
+                for f, size in rows]
+
+    @staticmethod
+    def top_level_modules(path):
+        """
+        Top-level importable names of a distribution: top_level.txt, else
+        derived from its file list.
+
+        :param str path: metadata path
+        :rtype list
+        """
+        meta = EnvironmentScanner.metadata_dir(path)
+        if meta is None:
+            return []
+        top_level = os.path.join(meta, 'top_level.txt')
+        if os.path.isfile(top_level):
+            try:
+                return sorted(set(
+                    l.strip().replace('/', '.') for l in
+                    _read(top_level).splitlines() if l.strip()))
+            except (IOError, OSError) as e:
+                maglog.debug("Unable to read {}: {}".format(top_level, e))
+        site_dir = os.path.dirname(meta)
+        return modules_from_files(
+            [os.path.relpath(f, site_dir)
+             for f, _ in EnvironmentScanner.distribution_files(path)])
+
+    def module_distributions(self):
+        """Distributions providing each top-level module; several may
+        share one, e.g. namespace packages.
+
+        :rtype dict
+        :return: {module: sorted list of keys}
+        """
+        paths = self.distribution_paths()
+        keys = sorted(paths)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            modules = list(executor.map(
+                self.top_level_modules, [paths[k] for k in keys]))
+        owners = {}
+        for key, key_modules in zip(keys, modules):
+            for m in key_modules:
+                owners.setdefault(m, []).append(key)
+        return owners
+
+    def read_distributions(self, paths):
+        """Read many distributions with a thread pool.
+
+        :rtype dict
+        :return: {path: record}
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            records = list(executor.map(self.read_distribution, paths))
+        return dict(zip(paths, records))
+
+    def scan(self):
+        """
+        :rtype list, list, dict
+        :return: nodes, edges, package_requirements
+        """
+        paths = self.find_distributions()
+        records = self.read_distributions(paths)
+        return self.build_graph([records[p] for p in paths if records[p]])
+
+    @staticmethod
+    def build_graph(records):
+        """
+        Form nodes, edges and package_requirements in the same way as
+        env_interrogation.py.
+
+        :param list records: {'project_name', 'version', 'requires'} dicts
+        :rtype list, list, dict
+        """
+        pkgs = []
+        seen = set()
+        for r in records:  # first on path wins, as with a working set.
+            key = r['project_name'].lower()
+            if key in SKIP or key in seen:
+                continue
+            seen.add(key)
+            pkgs.append((key, r))
+
+        nodes = [(r['project_name'], r['version']) for _, r in pkgs]
+        installed_versions = {key: r['version'] for key, r in pkgs}
+
+        edges = []
+        package_requirements = {}
+        for key, r in pkgs:
+            p_tup = (r['project_name'], r['version'])
+            edges.append([('root', '0.0.0'), p_tup])
+            package_requirements[key] = {'project_name': r['project_name'],
+                                         'version': r['version'],
+                                         'requires': {}}
+            for r_key, req in sorted(r['requires'].items()):
+                r_tup = (r_key, installed_versions.get(r_key, ''))
+                edges.append([p_tup, r_tup, req['specs']])
+                package_requirements[key]['requires'][r_key] = {
+                    'project_name': req['project_name'],
+                    'specs': req['specs']}
+
+        return nodes, edges, package_requirements
@@ -0,0 +1,268 @@
+"""
+Module containing EnvironmentGroup class.
+
+Interrogates several environments in one invocation. Environments are set up
+concurrently with a bounded thread pool, and work that doesn't depend on the
+environment (PyPI lookups, dependency acquisition) is done once for the whole
+group.
+"""
+
+import fnmatch
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from terminaltables import SingleTable as OutputTableType
+
+from magellan.deps_utils import (DepTools, PyPIHelper,
+                                 _string_requirement_details)
+from magellan.env_utils import Environment
+from magellan.package_utils import Package, Requirements
+from magellan.utils import MagellanConfig, print_col
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+
+class EnvironmentGroup(object):
+    """A set of environments analysed together."""
+
+    def __init__(self, names, max_workers=None):
+        self.names = names
+        self.max_workers = max_workers or MagellanConfig.max_workers
+        self.venvs = []
+        self.failed = {}
+
+    @staticmethod
+    def venv_names_matching(pattern, venv_home=None):
+        """Names of virtual envs under venv_home (default WORKON_HOME)
+        matching the shell-style pattern.
+
+        :rtype list
+        """
+        if venv_home is None:
+            venv_home = Environment.venv_home()
+        try:
+            entries = os.listdir(venv_home)
+        except OSError as e:
+            maglog.warning("Unable to list virtual envs in {}: {}"
+                           .format(venv_home, e))
+            return []
+        return sorted(e for e in entries if fnmatch.fnmatch(e, pattern) and
+                      os.path.isdir(os.path.join(venv_home, e, 'bin')))
+
+    @staticmethod
+    def resolve_venv_names(venv_names=None, venv_globs=None):
+        """Environment names from -n and --venv-glob, in order, without
+        duplicates.
+
+        :param list venv_names: names given with -n
+        :param list venv_globs: patterns given with --venv-glob
+        :rtype list
+        """
+        names = []
+        for name in venv_names or []:
+            name = name.rstrip('/')
+            if name not in names:
+                names.append(name)
+        for pattern in venv_globs or []:
+            matched = EnvironmentGroup.venv_names_matching(pattern)
+            if not matched:
+                print('No virtual envs matching "{}" in {}'.format(
+                    pattern, Environment.venv_home()))
+            names += [n for n in matched if n not in names]
+        return names
+
+    @staticmethod
+    def display_name(venv):
+        """Name to show for an environment."""
+        return venv.name or 'current environment'
+
+    @staticmethod
+    def print_header(venv, pretty=False):
+        """Header introducing an environment's results."""
+        print_col("Environment: {}".format(
+            EnvironmentGroup.display_name(venv)), pretty=pretty, header=True)
+
+    def setup(self, kwargs, package_names_callback=None):
+        """
+        Interrogate every environment concurrently. Environments that can't
+        be interrogated are recorded in self.failed rather than ending the
+        run.
+
+        :param dict kwargs: command line arguments
+        :param package_names_callback: see Environment.magellan_setup_env
+        :rtype list
+        :return: set up Environments, in the order of self.names
+        """
+        if kwargs.get('keep_env_files'):
+            maglog.warning("--keep-env-files ignored when analysing more "
+                           "than one environment")
+        kwargs = dict(kwargs, keep_env_files=False)
+
+        def _setup(name):
+            venv = Environment(name)
+            try:
+                venv.magellan_setup_env(kwargs, package_names_callback)
+            except SystemExit as e:  # e.g. env doesn't exist
+                return name, None, e.code
+            except Exception as e:
+                maglog.debug("Error setting up {}".format(name), exc_info=True)
+                return name, None, e
+            return name, venv, None
+
+        workers = max(1, min(self.max_workers, len(self.names)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_setup, self.names))
+
+        self.venvs = []
+        self.failed = {}
+        for name, venv, error in results:
+            if venv is None:
+                self.failed[name] = error
+            else:
+                self.venvs.append(venv)
+        return self.venvs
+
+    def print_failed(self, pretty=False):
+        """Report environments that couldn't be interrogated."""
+        for name in self.names:
+            if name in self.failed:
+                print_col("Unable to interrogate {}: {}".format(
+                    name, self.failed[name]), pretty=pretty)
+
+    def show_all_packages(self, with_versions=False, aggregate=False,
+                          pretty=False):
+        """
+        Print packages of every environment, or with aggregate a single table
+        of package versions against environments.
+        """
+        if not aggregate:
+            for venv in self.venvs:
+                self.print_header(venv, pretty)
+                venv.show_all_packages(with_versions)
+            return
+
+        versions = {}
+        names = {}
+        for i, venv in enumerate(self.venvs):
+            for p_k, p in list(venv.all_packages.items()):
+                names.setdefault(p_k, p.name)
+                versions.setdefault(p_k, [''] * len(self.venvs))[i] = \
+                    p.version if with_versions else 'x'
+
+        table_data = [['PACKAGE'] + [self.display_name(v)
+                                     for v in self.venvs]]
+        for p_k in sorted(names):
+            table_data.append([names[p_k]] + versions[p_k])
+        print_col(OutputTableType(table_data).table, pretty=pretty)
+
+    def version_info(self, packages):
+        """
+        Major/minor version info (Package.check_versions) for each distinct
+        package version, looked up concurrently, once each.
+
+        :param list packages: list of Package
+        :rtype dict
+        :return: {(package_key, version): version_info}
+        """
+        unique = {}
+        for p in packages:
+            unique.setdefault((p.key, p.version), p)
+
+        keys = sorted(unique)
+        workers = max(1, min(self.max_workers, len(keys) or 1))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            infos = list(executor.map(
+                lambda k: unique[k].check_versions(), keys))
+        return dict(zip(keys, infos))
+
+    def check_outdated_packages(self, kwargs, pretty=False, aggregate=False):
+        """
+        -O over every environment; each package version is checked against
+        PyPI once however many environments contain it.
+        """
+        to_check = []
+        for venv in self.venvs:
+            package_list = Package.resolve_package_list(venv, kwargs)
+            if package_list:
+                packages = {p.lower(): venv.all_packages[p.lower()]
+                            for p in package_list}
+            elif kwargs.get('requirements_file'):
+                packages = {}
+            else:
+                packages = venv.all_packages
+            to_check.append((venv, packages))
+
+        if not any(packages for _, packages in to_check) and \
+                kwargs.get('requirements_file'):
+            print("Analysing requirements file for outdated packages.")
+            Requirements.check_outdated_requirements_file(
+                kwargs['requirements_file'], pretty=pretty)
+            return
+
+        info = self.version_info(
+            [p for _, packages in to_check for p in list(packages.values())])
+
+        if aggregate:
+            in_envs = {}
+            for venv, packages in to_check:
+                for p in list(packages.values()):
+                    in_envs.setdefault((p.key, p.version), (p, []))[1].append(
+                        self.display_name(venv))
+            for k in sorted(in_envs):
+                p, env_names = in_envs[k]
+                Package.detail_version_info(info[k], p.name, p.version,
+                                            pretty)
+                print_col("In: {}".format(", ".join(env_names)),
+                          pretty=pretty)
+            return
+
+        for venv, packages in to_check:
+            self.print_header(venv, pretty)
+            for p_k, p in sorted(packages.items()):
+                Package.detail_version_info(info[(p.key, p.version)],
+                                            p.name, p.version, pretty)
+
+    def prefetch_dependencies(self, package_versions):
+        """
+        Acquire requirements of the -P (package, version) pairs once, up front
+        and concurrently, so that the per environment analyses find them in
+        the cache.
+
+        :param list package_versions: list of (package, version)
+        """
+        to_fetch = [(p, v) for p, v in package_versions
+                    if PyPIHelper.check_package_version_on_pypi(p, v)]
+        DepTools.acquire_deps_for_package_versions(to_fetch,
+                                                   self.max_workers)
+
+    def detect_env_conflicts(self, pretty=False):
+        """
+        -C aggregated over every environment: each distinct conflict listed
+        once along with the environments it occurs in.
+
+        :rtype dict
+        :return: {environment name: conflicts}
+        """
+        results = {}
+        rows = {}
+        for venv in self.venvs:
+            name = self.display_name(venv)
+            results[name] = DepTools.find_conflicts_in_env(
+                venv.nodes, venv.package_requirements)
+            for c in results[name]:
+                row = (" ".join([c[0][0], c[0][1]]), c[1],
+                       _string_requirement_details(c[-1]))
+                rows.setdefault(row, []).append(name)
+
+        if not rows:
+            print_col("No conflicts detected in environments", pretty=pretty)
+            return results
+
+        print_col("Conflicts in environments:", pretty=pretty, header=True)
+        table_data = [['PACKAGE', 'DEPENDENCY', 'CONFLICT', 'ENVIRONMENTS']]
+        for row in sorted(rows):
+            table_data.append(list(row) + ["\n".join(rows[row])])
+        print_col(OutputTableType(table_data).table, pretty=pretty)
+        return results
@@ -10,7 +10,6 @@ import logging
 import re
 
 from natsort import natsorted
-import yarg
 
 from magellan.utils import print_col
 
@@ -203,9 +202,11 @@ class Package(object):
         return list: version info
         """
 
+        # Shares PyPIHelper's package JSON cache (and any prefetch).
+        from magellan.deps_utils import PyPIHelper
+
         try:
-            yp = yarg.get(package)
-            rels = yp.release_ids
+            rels = PyPIHelper.all_package_versions_on_pypi(package)
         except Exception as e:
             maglog.debug("Unable to obtain {0} from PyPI; {1}."
                          .format(package, e))
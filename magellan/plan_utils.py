@@ -0,0 +1,422 @@
+"""
+Module containing UpgradePlanner class.
+
+Plans a route from the current environment to a target version of a package
+through its intermediate releases, upgrading the packages that depend on it
+along the way.
+"""
+
+import logging
+
+from pkg_resources import parse_version
+from terminaltables import SingleTable as OutputTableType
+
+from magellan.deps_utils import DepTools, PyPIHelper
+from magellan.package_utils import Package
+from magellan.utils import MagellanConfig, print_col
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+
+class UpgradePlanner(object):
+    """
+    Searches for a sequence of consistent environment states leading from
+    the current environment to package==target_version.
+
+    Each step moves the package to one of its intermediate releases (the
+    latest patch release of each major.minor series) together with the
+    smallest set of upgrades to its key ancestors (the packages that directly
+    depend on it) and its own requirements that keeps every spec satisfied;
+    a step is only taken if the requirements of every package it changes,
+    and those on them, hold in the resulting state. The furthest release
+    reachable with at most max_step_changes upgrades is taken at each step.
+
+    Requirements are acquired concurrently a batch of candidate versions at a
+    time, stopping at the first that fits, and memoised, as are
+    compatibility checks, so later steps reuse the work of earlier ones.
+    """
+
+    def __init__(self, venv, package, target_version, max_step_changes=3,
+                 max_workers=None):
+        self.venv = venv
+        self.key = package.lower()
+        self.package = package
+        self.target_version = target_version
+        self.max_step_changes = max_step_changes
+        self.max_workers = max_workers
+
+        self._requirements = {}  # (key, version): requirements
+        self._compatible = {}  # (anc_key, anc_ver, dep_key, dep_ver): bool
+        self._unknown = set()  # (key, version) whose acquisition failed
+        self._versions = {}  # key: list of release versions
+
+        self.names = {x[0].lower(): x[0] for x in venv.nodes}
+        if self.key in venv.all_packages:
+            self.package = venv.all_packages[self.key].name
+
+    def plan(self):
+        """
+        Run the search.
+
+        :rtype dict
+        :return: {steps, reached, blocked_at, blockers}
+        steps is a list of {version, upgrades} where upgrades maps package
+        name to (from_version, to_version), including the package itself.
+        """
+        state = {x[0].lower(): x[1] for x in self.venv.nodes}
+        steps = []
+        out = {'steps': steps, 'reached': False,
+               'blocked_at': None, 'blockers': []}
+
+        if self.key not in state:
+            maglog.info("{} not in environment".format(self.package))
+            out['blockers'] = ["{} not in environment".format(self.package)]
+            return out
+
+        if not self.target_released():
+            out['blockers'] = ["{} {} not found on PyPI".format(
+                self.package, self.target_version)]
+            return out
+
+        if parse_version(self.target_version) <= \
+                parse_version(state[self.key]):
+            out['blockers'] = ["{} {} is not newer than installed {}".format(
+                self.package, self.target_version, state[self.key])]
+            return out
+
+        milestones = self.milestones(state[self.key])
+        if not milestones:
+            out['blockers'] = ["No releases of {} between {} and {}".format(
+                self.package, state[self.key], self.target_version)]
+            return out
+
+        while parse_version(state[self.key]) != \
+                parse_version(self.target_version):
+            ahead = [m for m in milestones
+                     if parse_version(m) > parse_version(state[self.key])]
+            step = None
+            blockers = []
+            for m in reversed(ahead):
+                upgrades, blockers_m = self._upgrades_for(state, m)
+                if upgrades is not None and \
+                        len(upgrades) <= self.max_step_changes:
+                    step = (m, upgrades)
+                    break
+                if m == ahead[0]:
+                    blockers = blockers_m or [
+                        "more than {} upgrades needed".format(
+                            self.max_step_changes)]
+
+            if step is None:
+                out['blocked_at'] = ahead[0]
+                out['blockers'] = blockers
+                return out
+
+            m, upgrades = step
+            upgrades[self.key] = m
+            changes = {}
+            for k, v in sorted(upgrades.items()):
+                changes[self.names.get(k, k)] = (state.get(k), v)
+                state[k] = v
+            steps.append({'version': m, 'upgrades': changes})
+
+        out['reached'] = True
+        return out
+
+    def milestones(self, current_version):
+        """
+        Intermediate releases of the package after current_version up to and
+        including the target: the latest patch release of each major.minor
+        series, and the target itself if it is a release.
+
+        :param str current_version: current version of package
+        :rtype list
+        :return: versions in ascending order
+        """
+        lo = parse_version(current_version)
+        hi = parse_version(self.target_version)
+        series = {}
+        for v in self.release_versions(self.key):
+            pv = parse_version(v)
+            if pv <= lo or pv > hi:
+                continue
+            series_key = tuple(pv.release[:2])
+            if series_key not in series or \
+                    pv > parse_version(series[series_key]):
+                series[series_key] = v
+        milestones = [v for v in list(series.values())
+                      if parse_version(v) != hi]
+        if self.target_released():
+            milestones.append(self.target_version)
+        return sorted(milestones, key=parse_version)
+
+    def target_released(self):
+        """Whether the target version is a release of the package on PyPI
+        (pre-releases included).
+
+        :rtype bool
+        """
+        target = parse_version(self.target_version)
+        for v in PyPIHelper.all_package_versions_on_pypi(self.package):
+            try:
+                if parse_version(v) == target:
+                    return True
+            except Exception as e:
+                maglog.debug("Skipping version {} of {}: {}"
+                             .format(v, self.package, e))
+        return False
+
+    def key_ancestors(self):
+        """Names of packages in the environment that depend on the package.
+
+        :rtype list
+        """
+        ancestors, _ = Package.get_direct_links_to_any_package(
+            self.key, self.venv.edges)
+        return sorted(set(x[0][0].lower() for x in ancestors
+                          if x[0][0] != 'root'))
+
+    def release_versions(self, key):
+        """Non pre-release versions of package on PyPI, ascending.
+
+        :param str key: package key
+        :rtype list
+        """
+        if key not in self._versions:
+            versions = []
+            for v in PyPIHelper.all_package_versions_on_pypi(
+                    self.names.get(key, key)):
+                try:
+                    if not parse_version(v).is_prerelease:
+                        versions.append(v)
+                except Exception as e:
+                    maglog.debug("Skipping version {} of {}: {}"
+                                 .format(v, key, e))
+            self._versions[key] = sorted(versions, key=parse_version)
+        return self._versions[key]
+
+    def requirements(self, key, version):
+        """Requirements of key==version; from the environment if installed at
+        that version, otherwise acquired (see prefetch).
+
+        :rtype dict
+        """
+        env_pr = self.venv.package_requirements.get(key)
+        if env_pr and env_pr.get('version') == version:
+            return env_pr
+        if (key, version) not in self._requirements:
+            self.prefetch([(key, version)])
+        return self._requirements[(key, version)]
+
+    def prefetch(self, key_versions):
+        """Acquire requirements for many (key, version) pairs concurrently.
+
+        :param list key_versions: list of (key, version)
+        """
+        to_fetch = [(self.names.get(k, k), v) for k, v in key_versions
+                    if (k, v) not in self._requirements]
+        if not to_fetch:
+            return
+        acquired = DepTools.acquire_deps_for_package_versions(
+            to_fetch, self.max_workers)
+        for (name, version), reqs in list(acquired.items()):
+            if not reqs:
+                self._unknown.add((name.lower(), version))
+            self._requirements[(name.lower(), version)] = reqs or {}
+
+    def known(self, key, version):
+        """Whether the requirements of key==version are known: installed
+        at that version, or acquired successfully.
+
+        :rtype bool
+        """
+        self.requirements(key, version)
+        return (key, version) not in self._unknown
+
+    def specs_on(self, key, version, dep_key):
+        """Specs placed by key==version on dep_key, None if not required.
+
+        :rtype list
+        """
+        reqs = self.requirements(key, version).get('requires', {})
+        if dep_key not in reqs:
+            return None
+        return reqs[dep_key]['specs']
+
+    def compatible(self, anc_key, anc_version, dep_key, dep_version):
+        """Whether anc_key==anc_version accepts dep_key==dep_version.
+
+        :rtype bool
+        """
+        memo_key = (anc_key, anc_version, dep_key, dep_version)
+        if memo_key not in self._compatible:
+            specs = self.specs_on(anc_key, anc_version, dep_key) or []
+            self._compatible[memo_key] = _specs_satisfied(dep_version, specs)
+        return self._compatible[memo_key]
+
+    def _first_fitting(self, key, candidates, fits):
+        """
+        First of candidates (versions of key, in order of preference) whose
+        requirements are known and that fits. Requirements are acquired a
+        batch of max_workers at a time, so no more are fetched than needed.
+
+        :rtype str
+        :return: version, or None
+        """
+        size = max(1, self.max_workers or MagellanConfig.max_workers)
+        for i in range(0, len(candidates), size):
+            batch = candidates[i:i + size]
+            self.prefetch([(key, v) for v in batch])
+            for v in batch:
+                if self.known(key, v) and fits(v):
+                    return v
+        return None
+
+    def _conflicts(self, state, changed, involving=None):
+        """
+        Specs broken in state, a {key: version} environment, by or on the
+        changed packages (only those by or on involving if given).
+
+        :rtype list
+        :return: blockers, e.g. "A 2.0.0 requires Django [('<', '1.6')]"
+        """
+        conflicts = []
+        for key, version in sorted(state.items()):
+            if key in changed:
+                reqs = self.requirements(key, version)
+            else:  # as installed, or acquired for an earlier step
+                reqs = (self._requirements.get((key, version)) or
+                        self.venv.package_requirements.get(key) or {})
+            for r_key, r in sorted((reqs.get('requires') or {}).items()):
+                if r_key not in state or \
+                        key not in changed and r_key not in changed:
+                    continue
+                if involving is not None and involving not in (key, r_key):
+                    continue
+                if not _specs_satisfied(state[r_key], r['specs']):
+                    conflicts.append("{} {} requires {} {}".format(
+                        self.names.get(key, key), version,
+                        r['project_name'], r['specs']))
+        return conflicts
+
+    def _upgrades_for(self, state, milestone):
+        """
+        Smallest set of upgrades that makes state consistent with the package
+        at milestone. Each upgrade is the earliest newer release that fits
+        the state with the upgrades chosen before it, and the whole step is
+        then checked against the requirements of every package it changes.
+        Releases whose requirements couldn't be acquired are never taken as
+        compatible.
+
+        :rtype dict, list
+        :return: upgrades {key: version} (None if impossible), blockers
+        """
+        upgrades = {}
+        blockers = []
+        new_state = dict(state)
+        new_state[self.key] = milestone
+        changed = {self.key}
+
+        def _newer(key):
+            return [v for v in self.release_versions(key)
+                    if parse_version(v) > parse_version(state[key])]
+
+        def _fits(key):
+            def fits(v):
+                return not self._conflicts(dict(new_state, **{key: v}),
+                                           changed | {key}, involving=key)
+            return fits
+
+        # The milestone's requirements must be known:
+        if not self.known(self.key, milestone):
+            blockers.append("requirements of {} {} could not be acquired"
+                            .format(self.package, milestone))
+            return None, blockers
+
+        # Key ancestors must accept the milestone:
+        for anc in self.key_ancestors():
+            if self.compatible(anc, state[anc], self.key, milestone):
+                continue
+            chosen = self._first_fitting(anc, _newer(anc), _fits(anc))
+            if chosen is None:
+                blockers.append("no release of {} accepts {} {}".format(
+                    self.names.get(anc, anc), self.package, milestone))
+                return None, blockers
+            upgrades[anc] = new_state[anc] = chosen
+            changed.add(anc)
+
+        # The milestone's own requirements must be met:
+        reqs = self.requirements(self.key, milestone).get('requires', {})
+        for r_key, r in sorted(reqs.items()):
+            if r_key not in state or _specs_satisfied(new_state[r_key],
+                                                      r['specs']):
+                continue
+            candidates = [v for v in _newer(r_key)
+                          if _specs_satisfied(v, r['specs'])]
+            chosen = self._first_fitting(r_key, candidates, _fits(r_key))
+            if chosen is None:
+                blockers.append("{} {} requires {} {}".format(
+                    self.package, milestone, r['project_name'], r['specs']))
+                return None, blockers
+            upgrades[r_key] = new_state[r_key] = chosen
+            changed.add(r_key)
+
+        # and the step as a whole must be consistent:
+        blockers = self._conflicts(new_state, changed)
+        if blockers:
+            return None, blockers
+        return upgrades, blockers
+
+    @staticmethod
+    def print_plan(plan, package, target_version, pretty=False):
+        """Prints output of plan to stdout.
+
+        :param dict plan: output from UpgradePlanner.plan
+        """
+        print_col("Upgrade plan for {} {}:".format(package, target_version),
+                  pretty=pretty, header=True)
+
+        if plan['steps']:
+            table_data = [['STEP', 'PACKAGE', 'FROM', 'TO']]
+            for i, step in enumerate(plan['steps']):
+                for name, (from_v, to_v) in sorted(step['upgrades'].items()):
+                    table_data.append([str(i + 1), name, from_v or '', to_v])
+            print_col(OutputTableType(table_data).table, pretty=pretty)
+
+        if plan['reached']:
+            print_col("Target reached in {} step(s).".format(
+                len(plan['steps'])), pretty=pretty)
+        else:
+            s = "Unable to reach target"
+            if plan['blocked_at']:
+                s += "; blocked at {} {}".format(package, plan['blocked_at'])
+            print_col(s + ":", pretty=pretty)
+            for b in plan['blockers']:
+                print_col("  " + b, pretty=pretty)
+
+    @staticmethod
+    def plan_and_display(package, target_version, venv, pretty=False,
+                         max_step_changes=3):
+        """Convenience wrapper for the command line.
+
+        :rtype dict
+        :return: plan
+        """
+        planner = UpgradePlanner(venv, package, target_version,
+                                 max_step_changes=max_step_changes,
+                                 max_workers=MagellanConfig.max_workers)
+        plan = planner.plan()
+        UpgradePlanner.print_plan(plan, planner.package, target_version,
+                                  pretty)
+        return plan
+
+
+def _specs_satisfied(version, specs):
+    """True if version satisfies every (spec, version) in specs."""
+    try:
+        return all(DepTools.check_requirement_satisfied(version, s)[0]
+                   for s in specs)
+    except Exception as e:
+        maglog.debug("Unable to compare {} to {}: {}".format(version, specs, e))
+        return False
@@ -0,0 +1,267 @@
+"""
+Module containing ImportProfiler class.
+
+Measures the import time of every distribution in an environment with
+python -X importtime and rolls it up along the dependency graph, to show
+which top-level requirements carry the most import cost.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from terminaltables import SingleTable as OutputTableType
+
+from magellan.metadata_utils import EnvironmentScanner
+from magellan.utils import MagellanConfig, mkdir_p, print_col
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+IMPORTTIME_LINE = re.compile(
+    r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+def parse_importtime(text):
+    """
+    Parse python -X importtime output.
+
+    :param str text: stderr of the run
+    :rtype list
+    :return: (module, self_us, cumulative_us, depth) tuples in output order
+    """
+    rows = []
+    for line in text.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us),
+                         (len(indent) - 1) // 2))
+    return rows
+
+
+class ImportProfiler(object):
+    """
+    Import profile of an environment's distributions.
+
+    Each top-level module of each distribution (from top_level.txt, else its
+    RECORD) is imported on its own in a fresh interpreter inside the
+    environment with -X importtime; runs happen in parallel on a thread pool.
+    From the timings each distribution gets:
+    - self: time spent in its own modules;
+    - cumulative: wall time of importing its top-level modules, including
+      whatever they import;
+    - transitive: self time summed over the distribution and everything it
+      reaches through the dependency edges (each counted once).
+
+    Run results are cached per (package, version, interpreter).
+    """
+
+    subdir = 'importtime'
+
+    def __init__(self, venv, max_workers=None, timeout=120):
+        self.venv = venv
+        self.max_workers = max_workers or MagellanConfig.max_workers
+        self.timeout = timeout
+
+        if venv.is_running_interpreter():
+            self.python_cmd = shlex.quote(sys.executable)
+        else:
+            self.python_cmd = venv.python_cmd()
+
+        self.scanner = EnvironmentScanner(venv.site_dirs())
+        self.paths = self.scanner.distribution_paths()
+        self.versions = {n[0].lower(): n[1] for n in venv.nodes}
+        self.names = {n[0].lower(): n[0] for n in venv.nodes}
+
+        self._modules = {}
+        self._owners = None
+
+    def interpreter_id(self):
+        """Identity of the environment's interpreter for cache keys."""
+        return "{0}|{1}".format(self.python_cmd, self.scanner.python_version)
+
+    def modules(self, key):
+        """Top-level modules of distribution key.
+
+        :rtype list
+        """
+        if key not in self._modules:
+            path = self.paths.get(key)
+            self._modules[key] = \
+                EnvironmentScanner.top_level_modules(path) if path else []
+        return self._modules[key]
+
+    def owners(self):
+        """Distribution owning each top-level module name.
+
+        :rtype dict
+        :return: {module: key}
+        """
+        if self._owners is None:
+            owners = {}
+            for key in sorted(self.paths):
+                for m in self.modules(key):
+                    owners.setdefault(m, key)
+            self._owners = owners
+        return self._owners
+
+    def cache_path(self, key):
+        return os.path.join(
+            MagellanConfig.cache_dir, self.subdir, "{0}.json".format(
+                hashlib.sha256(json.dumps(
+                    [key, self.versions.get(key), self.interpreter_id()])
+                    .encode('utf-8')).hexdigest()))
+
+    def run_import(self, module):
+        """
+        Import module alone with -X importtime.
+
+        :rtype dict
+        :return: {'rows': parse_importtime rows, 'error': str or None}
+        """
+        cmd_args = shlex.split(self.python_cmd) + [
+            '-X', 'importtime', '-c', 'import {0}'.format(module)]
+        try:
+            p = subprocess.run(cmd_args, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return {'rows': [], 'error': str(e)}
+        stderr = p.stderr.decode('utf-8', 'replace')
+        error = None
+        if p.returncode != 0:
+            error = (stderr.strip().splitlines() or
+                     ["exit {}".format(p.returncode)])[-1]
+        return {'rows': parse_importtime(stderr), 'error': error}
+
+    def profile_distribution(self, key):
+        """
+        Import runs for each top-level module of a distribution, from cache
+        if available.
+
+        :rtype dict
+        :return: {module: run_import result}
+        """
+        path = self.cache_path(key)
+        if MagellanConfig.caching and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    return json.load(f)
+            except (IOError, ValueError) as e:
+                maglog.debug("Unreadable import profile {}: {}"
+                             .format(path, e))
+
+        runs = {m: self.run_import(m) for m in self.modules(key)}
+
+        if MagellanConfig.caching:
+            try:
+                mkdir_p(os.path.dirname(path))
+                tmp_path = "{0}.{1}.{2}.tmp".format(
+                    path, os.getpid(), threading.get_ident())
+                with open(tmp_path, 'w') as f:
+                    json.dump(runs, f)
+                os.rename(tmp_path, path)
+            except (IOError, OSError) as e:
+                maglog.debug("Unable to write import profile {}: {}"
+                             .format(path, e))
+        return runs
+
+    def profile(self, packages=None):
+        """
+        Profile packages (default: every distribution in the environment)
+        and everything they depend on.
+
+        :param list packages: package names
+        :rtype dict
+        :return: {key: {'name', 'version', 'modules', 'self_us',
+        'cumulative_us', 'transitive_us', 'errors', 'top_level'}}
+        """
+        if packages:
+            keys = self.venv.reachable(p.lower() for p in packages)
+        else:
+            keys = set(self.versions)
+        keys = sorted(k for k in keys if k in self.versions)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as ex:
+            runs = dict(zip(keys, ex.map(self.profile_distribution, keys)))
+
+        owners = self.owners()
+        module_self = {}  # fully qualified module: self time, first seen
+        results = {}
+        for key in keys:
+            cumulative = 0
+            errors = []
+            for module, run in sorted(runs[key].items()):
+                if run['error']:
+                    errors.append("{}: {}".format(module, run['error']))
+                # the module may be imported at start up (e.g. by a .pth
+                # file), so isn't necessarily at depth 0
+                cumulative += next((r[2] for r in run['rows']
+                                    if r[0] == module), 0)
+                for name, self_us, _, _ in run['rows']:
+                    module_self.setdefault(name, (self_us, name.split('.')[0]))
+            results[key] = {'name': self.names.get(key, key),
+                            'version': self.versions[key],
+                            'modules': self.modules(key),
+                            'cumulative_us': cumulative,
+                            'errors': errors}
+
+        self_us = {k: 0 for k in keys}
+        for self_time, top in list(module_self.values()):
+            owner = owners.get(top)
+            if owner in self_us:
+                self_us[owner] += self_time
+
+        children = self.venv.dependency_children()
+        top_level = set(self.venv.top_level_packages())
+        for key in keys:
+            results[key]['self_us'] = self_us[key]
+            results[key]['transitive_us'] = sum(
+                self_us.get(k, 0)
+                for k in self.venv.reachable([key], children=children))
+            results[key]['top_level'] = key in top_level
+        return results
+
+    @staticmethod
+    def print_profile(results, pretty=False):
+        """Prints output of profile to stdout, top-level requirements first,
+        most expensive first."""
+        if not results:
+            print_col("No distributions to profile.", pretty=pretty)
+            return
+
+        print_col("Import time (ms):", pretty=pretty, header=True)
+        table_data = [['PACKAGE', 'VERSION', 'TOP LEVEL', 'SELF',
+                       'CUMULATIVE', 'TRANSITIVE']]
+        for key, r in sorted(
+                list(results.items()),
+                key=lambda kv: (not kv[1]['top_level'],
+                                -kv[1]['transitive_us'], kv[0])):
+            table_data.append([
+                r['name'], r['version'], 'yes' if r['top_level'] else '',
+                "{:.1f}".format(r['self_us'] / 1000.0),
+                "{:.1f}".format(r['cumulative_us'] / 1000.0),
+                "{:.1f}".format(r['transitive_us'] / 1000.0)])
+        print_col(OutputTableType(table_data).table, pretty=pretty)
+
+        for key, r in sorted(results.items()):
+            for e in r['errors']:
+                maglog.info("Unable to import {} of {}".format(e, r['name']))
+
+    @staticmethod
+    def profile_and_display(venv, packages=None, pretty=False):
+        """Convenience wrapper for the command line.
+
+        :rtype dict
+        """
+        results = ImportProfiler(
+            venv, max_workers=MagellanConfig.max_workers).profile(packages)
+        ImportProfiler.print_profile(results, pretty)
+        return results
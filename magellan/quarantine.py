@@ -0,0 +1,138 @@
+"""
+Module containing Quarantine class.
+
+Records installs that failed (or were killed for running too long) so that
+later runs skip them straight away instead of repeating a doomed install,
+until a retry-after time that backs off with each further failure.
+"""
+
+import json
+import logging
+import os
+import shlex
+import sys
+import threading
+import time
+
+from magellan.utils import MagellanConfig
+from magellan.wheel_store import WheelStore
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+MAX_QUARANTINE_DAYS = 30
+
+
+class Quarantine(object):
+    """
+    Failed (package, version, interpreter) installs, kept in
+    cache_dir/quarantine.json as:
+
+        {"<key>==<version>|<interpreter>": {"package", "version",
+         "interpreter", "error", "failures", "failed_at", "retry_after"}}
+
+    The first failure is quarantined for MagellanConfig.quarantine_hours,
+    doubling with each failure after (up to MAX_QUARANTINE_DAYS). A
+    success clears the entry.
+    """
+
+    filename = 'quarantine.json'
+
+    _lock = threading.Lock()
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(MagellanConfig.cache_dir,
+                                         self.filename)
+
+    @staticmethod
+    def interpreter(python_cmd=None):
+        """
+        Interpreter run by python_cmd, e.g. the backend's
+        base_python_cmd() temp envs are made from, as
+        WheelStore.interpreter_tag; this one if not given or it can't be
+        run.
+
+        :rtype str
+        """
+        tag = WheelStore.interpreter_tag(python_cmd) if python_cmd else None
+        return tag or WheelStore.interpreter_tag(shlex.quote(sys.executable))
+
+    @staticmethod
+    def key(package, version, interpreter):
+        return "{0}=={1}|{2}".format(package.lower(), version, interpreter)
+
+    def load(self):
+        """
+        :rtype dict
+        :return: every entry, expired or not
+        """
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _update(self, change):
+        """Apply change to the entries (re-read so concurrent runs'
+        entries aren't lost) and write them back atomically."""
+        with Quarantine._lock:
+            entries = self.load()
+            change(entries)
+            if not os.path.isdir(os.path.dirname(self.path)):
+                return
+            tmp_path = "{0}.{1}.{2}.tmp".format(
+                self.path, os.getpid(), threading.get_ident())
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(entries, f, indent=1, sort_keys=True)
+                os.rename(tmp_path, self.path)
+            except (IOError, OSError) as e:
+                maglog.debug("Unable to write {}: {}".format(self.path, e))
+
+    def check(self, package, version, interpreter=None, now=None):
+        """
+        The entry for a quarantined install, if it isn't due a retry yet.
+
+        :rtype dict
+        :return: entry, or None
+        """
+        entry = self.load().get(self.key(
+            package, version, interpreter or self.interpreter()))
+        if entry and entry.get('retry_after', 0) > (now or time.time()):
+            return entry
+        return None
+
+    def record(self, package, version, error, interpreter=None, now=None):
+        """
+        Quarantine a failed install.
+
+        :param str error: why it failed
+        :rtype dict
+        :return: the new entry
+        """
+        interpreter = interpreter or self.interpreter()
+        now = now or time.time()
+        key = self.key(package, version, interpreter)
+        new = {}
+
+        def _record(entries):
+            failures = entries.get(key, {}).get('failures', 0) + 1
+            hours = min(MagellanConfig.quarantine_hours * 2 ** (failures - 1),
+                        MAX_QUARANTINE_DAYS * 24)
+            new.update({'package': package, 'version': version,
+                        'interpreter': interpreter, 'error': error,
+                        'failures': failures, 'failed_at': now,
+                        'retry_after': now + hours * 3600})
+            entries[key] = new
+
+        self._update(_record)
+        maglog.warning("Quarantined {0} {1} for {2:.0f}h: {3}".format(
+            package, version, (new['retry_after'] - now) / 3600, error))
+        return new
+
+    def clear(self, package, version, interpreter=None):
+        """Forget a failure, e.g. once the install has worked."""
+        key = self.key(package, version, interpreter or self.interpreter())
+        if key in self.load():
+            self._update(lambda entries: entries.pop(key, None))
@@ -0,0 +1,285 @@
+"""
+Module containing SdistHelper class and sdist reading helpers.
+
+Reads a release's requirements statically from its source distribution:
+PKG-INFO, *.egg-info/requires.txt, setup.cfg or pyproject.toml, streamed out
+of the archive as it downloads. Nothing is built or installed, so no
+compiler or system libraries are needed.
+"""
+
+import configparser
+import hashlib
+import io
+import logging
+import posixpath
+import tarfile
+import zipfile
+
+import pkg_resources
+import requests
+
+from magellan.metadata_utils import (parse_metadata, parse_requirement_lines,
+                                     parse_requires_txt)
+
+try:
+    import tomllib
+except ImportError:  # python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+SDIST_SUFFIXES = ('.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.zip', '.tar')
+
+# Files read from an sdist, relative to its top directory:
+SDIST_FILES = ('PKG-INFO', 'setup.cfg', 'pyproject.toml')
+EGG_INFO_FILES = ('PKG-INFO', 'requires.txt')
+
+MAX_MEMBER_SIZE = 1024 * 1024
+
+
+def sdist_file(files):
+    """
+    The source distribution among a release's files, preferring .tar.gz.
+
+    :param list files: release file dicts from PyPI JSON ('filename', ...)
+    :rtype dict
+    :return: file dict, or None if there isn't one
+    """
+    for suffix in SDIST_SUFFIXES:
+        for f in files or []:
+            if f.get('filename', '').lower().endswith(suffix):
+                return f
+    return None
+
+
+def _member_key(name):
+    """Where a member of the archive is kept by read_sdist_files, or None
+    if it isn't wanted: 'PKG-INFO', 'foo.egg-info/requires.txt',
+    'src/foo.egg-info/requires.txt', ..."""
+    parts = posixpath.normpath(name.replace('\\', '/')).split('/')[1:]
+    if len(parts) == 1 and parts[0] in SDIST_FILES:
+        return parts[0]
+    if 2 <= len(parts) <= 3 and parts[-2].endswith('.egg-info') and \
+            parts[-1] in EGG_INFO_FILES:
+        return '/'.join(parts)
+    return None
+
+
+def read_sdist_files(fileobj, filename):
+    """
+    Read the files SDIST_FILES and EGG_INFO_FILES from an sdist archive.
+    Tarballs are read as a stream, in one pass.
+
+    :param fileobj: binary file-like object of the archive
+    :param str filename: archive filename, for its format
+    :rtype dict
+    :return: {key: text}, see _member_key
+    """
+    found = {}
+    if filename.lower().endswith('.zip'):
+        if not (hasattr(fileobj, 'seekable') and fileobj.seekable()):
+            fileobj = io.BytesIO(fileobj.read())
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                key = _member_key(info.filename)
+                if key and info.file_size <= MAX_MEMBER_SIZE:
+                    found[key] = zf.read(info).decode('utf-8', 'replace')
+        return found
+
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tf:
+        for member in tf:
+            key = _member_key(member.name)
+            if key and member.isfile() and member.size <= MAX_MEMBER_SIZE:
+                found[key] = tf.extractfile(member).read().decode(
+                    'utf-8', 'replace')
+    return found
+
+
+def _setup_cfg_requires(text):
+    """install_requires from setup.cfg, or None if not declared there (or
+    read from a file:)."""
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        parser.read_string(text)
+    except configparser.Error as e:
+        maglog.debug("Unable to parse setup.cfg: {}".format(e))
+        return None
+    if not parser.has_option('options', 'install_requires'):
+        return None
+    value = parser.get('options', 'install_requires').strip()
+    if value.startswith(('file:', 'attr:')):
+        return None
+    # as setuptools: one per line, or on one line separated by ';'
+    if '\n' in value:
+        return value.splitlines()
+    return value.split(';')
+
+
+def _pyproject_requires(text):
+    """[project] dependencies from pyproject.toml, or None if not declared
+    statically (or tomllib isn't available)."""
+    if tomllib is None:
+        return None
+    try:
+        project = tomllib.loads(text).get('project')
+    except (tomllib.TOMLDecodeError, UnicodeDecodeError) as e:
+        maglog.debug("Unable to parse pyproject.toml: {}".format(e))
+        return None
+    if not isinstance(project, dict) or \
+            'dependencies' in project.get('dynamic', []):
+        return None
+    return project.get('dependencies', [])
+
+
+def requirements_from_sdist_files(files, environment=None):
+    """
+    Requirements from the files read out of an sdist, taken from the first
+    of these that settles them:
+
+    1. PKG-INFO Requires-Dist, if it has any or is metadata 2.2+ without
+       Requires-Dist marked Dynamic
+    2. *.egg-info/requires.txt; an egg-info without one has no requirements
+    3. pyproject.toml [project] dependencies, unless marked dynamic
+    4. setup.cfg [options] install_requires
+
+    :param dict files: as read_sdist_files
+    :param dict environment: marker environment, see marker_environment
+    :rtype tuple
+    :return: (requirements dict as
+    DepTools.get_deps_for_package_version, file it came from), or
+    ({}, None) if they can't be known without running setup.py
+    """
+    meta = parse_metadata(files.get('PKG-INFO', ''))
+    egg_infos = sorted(k.rsplit('/', 1)[0] for k in files
+                       if k.endswith('.egg-info/PKG-INFO') or
+                       k.endswith('.egg-info/requires.txt'))
+    if not meta['name'] and egg_infos:
+        meta = parse_metadata(files.get(egg_infos[0] + '/PKG-INFO', ''))
+    if not meta['name'] or not meta['version']:
+        return {}, None
+
+    def _result(requires, source):
+        return ({'project_name': pkg_resources.safe_name(meta['name']),
+                 'version': meta['version'],
+                 'requires': requires}, source)
+
+    try:
+        metadata_version = tuple(
+            int(x) for x in (meta['metadata_version'] or '0').split('.'))
+    except ValueError:
+        metadata_version = (0,)
+    if meta['requires_dist'] or (metadata_version >= (2, 2) and
+                                 'requires-dist' not in meta['dynamic']):
+        return _result(parse_requirement_lines(
+            meta['requires_dist'], environment), 'PKG-INFO')
+
+    if egg_infos:
+        requires_txt = egg_infos[0] + '/requires.txt'
+        return _result(parse_requires_txt(
+            files.get(requires_txt, ''), environment), requires_txt)
+
+    if 'pyproject.toml' in files:
+        lines = _pyproject_requires(files['pyproject.toml'])
+        if lines is not None:
+            return _result(parse_requirement_lines(lines, environment),
+                           'pyproject.toml')
+
+    if 'setup.cfg' in files:
+        lines = _setup_cfg_requires(files['setup.cfg'])
+        if lines is not None:
+            return _result(parse_requirement_lines(lines, environment),
+                           'setup.cfg')
+
+    return {}, None
+
+
+class _HashingReader(object):
+    """Read-only stream wrapper computing the sha256 of what's read."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.digest.update(data)
+        return data
+
+    def drain(self):
+        while self.read(65536):
+            pass
+        return self.digest.hexdigest()
+
+
+class SdistHelper(object):
+    """Collection of static methods for reading requirements from source
+    distributions without building them."""
+
+    @staticmethod
+    def stream_sdist_files(file_info):
+        """
+        Download an sdist, reading the files we want from it as it arrives;
+        nothing is written to disk. Its sha256 is checked if PyPI gave one.
+
+        :param dict file_info: release file dict from PyPI JSON
+        :rtype dict
+        :return: as read_sdist_files, or None if it couldn't be read
+        """
+        if not file_info.get('url'):
+            return None
+        expected = (file_info.get('digests') or {}).get('sha256')
+        try:
+            # As pip: the archive's own bytes, not undone by a
+            # Content-Encoding (often set for .tar.gz); tarfile decompresses.
+            r = requests.get(file_info['url'], stream=True, timeout=60,
+                             headers={'Accept-Encoding': 'identity'})
+            if r.status_code != 200:
+                maglog.info("failed to download {0}: {1}".format(
+                    file_info['url'], r.status_code))
+                return None
+            reader = _HashingReader(r.raw)
+            files = read_sdist_files(reader, file_info['filename'])
+            digest = reader.drain()
+        except (requests.RequestException, tarfile.TarError,
+                zipfile.BadZipfile, IOError, OSError, EOFError) as e:
+            maglog.info("Unable to read {0}: {1}".format(
+                file_info['filename'], e))
+            return None
+
+        if expected and digest != expected:
+            maglog.warning("sha256 mismatch for {0}, discarding".format(
+                file_info['filename']))
+            return None
+        return files
+
+    @staticmethod
+    def get_deps_from_sdist(package, version, release_files=None):
+        """
+        Requirements of package==version read statically from its sdist
+        among release_files, see requirements_from_sdist_files.
+
+        :param list release_files: file dicts of the release from PyPI JSON
+        :rtype dict
+        :return: {'project_name', 'version', 'requires'} as
+        DepTools.get_deps_for_package_version, or {} if there's no sdist or
+        the requirements are only known by running its setup.py
+        """
+        file_info = sdist_file(release_files)
+        if file_info is None:
+            return {}
+        files = SdistHelper.stream_sdist_files(file_info)
+        if not files:
+            return {}
+
+        result, source = requirements_from_sdist_files(files)
+        if not result:
+            maglog.info("Requirements of {} {} not declared statically in {}"
+                        .format(package, version, file_info['filename']))
+            return {}
+        maglog.info("Read requirements of {} {} from {} in {}".format(
+            package, version, source, file_info['filename']))
+        return result
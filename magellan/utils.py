@@ -1,17 +1,38 @@
 import os
 import errno
+import json
+import logging
 import subprocess
 import shlex
+import signal
+import threading
 from pkg_resources import resource_filename as pkg_res_resource_filename
 
+maglog = logging.getLogger('magellan_logger')
+
+
 class MagellanConfig(object):
     """Holds magellan config info"""
     tmp_dir = '/tmp/magellan'
     caching = True
     cache_dir = os.path.join(tmp_dir, 'cache')
     tmp_env_dir = "MagellanTmp"
+    max_workers = 4
+    prefetch_workers = 8
     vexrc = pkg_res_resource_filename('magellan', 'data/tmpVexRC')
     vex_options = '--config {}'.format(vexrc)
+    env_backend = 'direct'  # or 'vex'
+    json_metadata = True  # read requirements from PyPI JSON if possible
+    wheel_metadata = True  # else from wheels
+    sdist_metadata = True  # or from sdists' PKG-INFO, setup.cfg etc.
+    env_pool_size = 4  # reusable temp envs for installs, 0 to disable
+    wheel_store_size = 2 * 1024 ** 3  # bytes of built wheels kept, 0 off
+    pip_update = True  # upgrade pip in new temp envs
+    install_timeout = 900  # seconds per pip install/build, None no limit
+    interrogate_timeout = 300  # seconds per interrogation, None no limit
+    quarantine_hours = 24  # before retrying a failed install, doubling
+    retry_quarantined = False  # retry failed installs regardless
+    pypi_json_ttl = 3600  # seconds a package's cached PyPI JSON is used
 
 
     @staticmethod
@@ -27,18 +48,171 @@ class MagellanConfig(object):
         run_in_subprocess(cmd_to_run)
 
 
-def run_in_subprocess(cmds):
-    """Splits command line arguments and runs in subprocess"""
+class CommandTimeout(Exception):
+    """A subprocess ran past its deadline and was killed, along with any
+    processes it started."""
+    pass
+
+
+def _popen(cmd_args, **kwargs):
+    """Popen in a new session, so the command's whole process tree (e.g.
+    pip and the compilers its builds run) can be killed together."""
+    return subprocess.Popen(cmd_args, start_new_session=True, **kwargs)
+
+
+def kill_process_tree(p):
+    """Kill a process started by _popen and everything in its group."""
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except (OSError, AttributeError):  # gone already, or not POSIX
+        try:
+            p.kill()
+        except OSError:
+            pass
+
+
+def run_in_subprocess(cmds, timeout=None):
+    """Splits command line arguments and runs in subprocess
+
+    :param int timeout: seconds before the command is killed
+    :return: exit code
+    :raises CommandTimeout: if killed for running past timeout
+    """
     cmd_args = shlex.split(cmds)
-    subprocess.call(cmd_args)
+    p = _popen(cmd_args)
+    try:
+        return p.wait(timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_tree(p)
+        p.wait()
+        raise CommandTimeout("'{0}' killed after {1}s".format(cmds, timeout))
+    except BaseException:  # e.g. KeyboardInterrupt; it has its own session
+        kill_process_tree(p)
+        raise
+
+
+def run_args(cmd_args, timeout=None):
+    """
+    Runs argument list in subprocess, capturing its output.
+
+    :param int timeout: seconds before the command is killed
+    :rtype subprocess.CompletedProcess
+    :raises CommandTimeout: if killed for running past timeout
+    """
+    p = _popen(cmd_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        out, err = p.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_tree(p)
+        p.communicate()
+        raise CommandTimeout("'{0}' killed after {1}s".format(
+            ' '.join(cmd_args), timeout))
+    except BaseException:
+        kill_process_tree(p)
+        raise
+    return subprocess.CompletedProcess(cmd_args, p.returncode, out, err)
 
 
-def run_in_subp_ret_stdout(cmds):
-    """Runs in subprocess and returns std out output."""
+def run_in_subp_ret_stdout(cmds, timeout=None):
+    """Runs in subprocess and returns std out output.
+
+    :raises CommandTimeout: if killed for running past timeout
+    """
+    p = run_args(shlex.split(cmds), timeout)
+    return p.stdout, p.stderr
+
+
+class DocumentError(Exception):
+    """A subprocess did not produce a valid JSON document on stdout."""
+    pass
+
+
+def read_json_document(stream, chunk_size=65536):
+    """
+    Read one length-prefixed JSON document (see
+    env_interrogation.write_document) from a binary stream, as it arrives.
+
+    :param stream: binary file-like object, e.g. Popen.stdout
+    :return: decoded JSON document
+    :raises DocumentError: if the stream ends early or the header is bad
+    """
+    while True:
+        header = stream.readline()
+        if not header:
+            raise DocumentError("No document header received")
+        header = header.strip()
+        if header.isdigit():
+            break
+        # anything printed before the header isn't ours; skip it.
+
+    remaining = int(header)
+    chunks = []
+    while remaining > 0:
+        chunk = stream.read(min(chunk_size, remaining))
+        if not chunk:
+            raise DocumentError("Document truncated, {} bytes missing"
+                                .format(remaining))
+        chunks.append(chunk)
+        remaining -= len(chunk)
+
+    try:
+        return json.loads(b''.join(chunks).decode('utf-8'))
+    except ValueError as e:
+        raise DocumentError("Invalid JSON document: {}".format(e))
+
+
+def run_in_subp_ret_json(cmds, timeout=None):
+    """
+    Runs in subprocess and returns the JSON document it writes to stdout.
+    stderr is drained concurrently and included in any error raised.
+
+    :param int timeout: seconds before the command is killed
+    :raises DocumentError: on non-zero exit or bad/missing document
+    :raises CommandTimeout: if killed for running past timeout
+    """
     cmd_args = shlex.split(cmds)
-    p = subprocess.Popen(cmd_args,
-                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return p.communicate()
+    p = _popen(cmd_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    err_chunks = []
+    err_thread = threading.Thread(
+        target=lambda: err_chunks.append(p.stderr.read()))
+    err_thread.daemon = True
+    err_thread.start()
+    timed_out = threading.Event()
+
+    def _expire():
+        timed_out.set()
+        kill_process_tree(p)
+
+    deadline = threading.Timer(timeout, _expire) if timeout else None
+    if deadline:
+        deadline.daemon = True
+        deadline.start()
+
+    try:
+        try:
+            doc = read_json_document(p.stdout)
+            error = None
+        except DocumentError as e:
+            doc, error = None, e
+        p.stdout.close()
+        returncode = p.wait()
+        err_thread.join()
+    except BaseException:
+        kill_process_tree(p)
+        raise
+    finally:
+        if deadline:
+            deadline.cancel()
+    stderr = b''.join(err_chunks).decode('utf-8', 'replace').strip()
+
+    if timed_out.is_set():
+        raise CommandTimeout("'{0}' killed after {1}s".format(cmds, timeout))
+    if returncode != 0 or error is not None:
+        raise DocumentError("'{0}' failed (exit {1}): {2}".format(
+            cmds, returncode, stderr or error))
+    if stderr:
+        maglog.debug(stderr)
+    return doc
 
 
 def mkdir_p(path):
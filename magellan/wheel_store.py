@@ -0,0 +1,222 @@
+"""
+Module containing WheelStore class.
+
+Wheels built from sdists while finding their requirements, kept under the
+cache dir so the next analysis of the same sdist (from any environment,
+by any user sharing the cache) installs or reads the wheel instead of
+building it again.
+"""
+
+import logging
+import os
+import re
+import shutil
+import threading
+
+from magellan.sdist_utils import sdist_file
+from magellan.utils import MagellanConfig, mkdir_p, run_in_subp_ret_stdout
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+# Printed by the target interpreter: what a wheel built there depends on.
+TAG_SCRIPT = ("import sys, sysconfig; print(sys.implementation.cache_tag, "
+              "sysconfig.get_config_var('SOABI') or 'none', "
+              "sysconfig.get_platform())")
+# Printed by the target interpreter: what its wheels are chosen by.
+TARGET_SCRIPT = ("import sys; print('{0}.{1}'.format(*sys.version_info), "
+                 "sys.platform)")
+
+
+class WheelStore(object):
+    """
+    Content addressed store of built wheels:
+
+        <root>/<interpreter tag>/<sha[:2]>/<sdist sha256>/<wheel>
+
+    Entries are used least recently first evicted once the store is over
+    max_size bytes (default MagellanConfig.wheel_store_size).
+    """
+
+    subdir = 'built_wheels'
+
+    _tags = {}
+    _targets = {}
+    _tags_lock = threading.Lock()
+
+    def __init__(self, root=None, max_size=None):
+        self.root = root or os.path.join(MagellanConfig.cache_dir, self.subdir)
+        self.max_size = (MagellanConfig.wheel_store_size if max_size is None
+                         else max_size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def interpreter_tag(python_cmd):
+        """
+        Implementation, ABI and platform of the interpreter run by
+        python_cmd, as a directory name, e.g.
+        'cpython_311_cpython_311_x86_64_linux_gnu_linux_x86_64'.
+
+        :rtype str
+        :return: tag, or None if the interpreter can't be run
+        """
+        with WheelStore._tags_lock:
+            if python_cmd in WheelStore._tags:
+                return WheelStore._tags[python_cmd]
+        try:
+            out = run_in_subp_ret_stdout('{} -c "{}"'.format(
+                python_cmd, TAG_SCRIPT))[0].decode('utf-8').strip()
+        except OSError as e:
+            maglog.info("Unable to run {}: {}".format(python_cmd, e))
+            return None
+        if not out:
+            return None
+        tag = re.sub(r'[^A-Za-z0-9]+', '_', out.splitlines()[-1]).strip('_')
+        with WheelStore._tags_lock:
+            WheelStore._tags[python_cmd] = tag
+        return tag
+
+    @staticmethod
+    def interpreter_target(python_cmd):
+        """
+        Python version and platform of the interpreter run by python_cmd,
+        as taken by wheel_utils.best_wheel, e.g. ('3.11', 'linux').
+
+        :rtype tuple
+        :return: (python_version, platform), or None if the interpreter
+        can't be run
+        """
+        with WheelStore._tags_lock:
+            if python_cmd in WheelStore._targets:
+                return WheelStore._targets[python_cmd]
+        try:
+            out = run_in_subp_ret_stdout('{} -c "{}"'.format(
+                python_cmd, TARGET_SCRIPT))[0].decode('utf-8').split()
+        except OSError as e:
+            maglog.info("Unable to run {}: {}".format(python_cmd, e))
+            return None
+        if len(out) < 2:
+            return None
+        target = tuple(out[-2:])
+        with WheelStore._tags_lock:
+            WheelStore._targets[python_cmd] = target
+        return target
+
+    @staticmethod
+    def sdist_sha256(release_files):
+        """sha256 of the sdist among release_files, None if not known."""
+        info = sdist_file(release_files)
+        return ((info or {}).get('digests') or {}).get('sha256')
+
+    def entry_dir(self, sdist_sha256, tag):
+        return os.path.join(self.root, tag, sdist_sha256[:2], sdist_sha256)
+
+    @staticmethod
+    def _wheel_in(directory):
+        try:
+            wheels = sorted(f for f in os.listdir(directory)
+                            if f.endswith('.whl'))
+        except OSError:
+            return None
+        return os.path.join(directory, wheels[0]) if wheels else None
+
+    def _touch(self, path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def get(self, sdist_sha256, tag):
+        """
+        The wheel built from the sdist for the interpreter tag.
+
+        :rtype str
+        :return: path, or None
+        """
+        path = self._wheel_in(self.entry_dir(sdist_sha256, tag))
+        if path:
+            self._touch(path)
+        return path
+
+    def find(self, sdist_sha256):
+        """A wheel built from the sdist for any interpreter, e.g. to read
+        its metadata.
+
+        :rtype str
+        :return: path, or None
+        """
+        if not os.path.isdir(self.root):
+            return None
+        for tag in sorted(os.listdir(self.root)):
+            path = self.get(sdist_sha256, tag)
+            if path:
+                return path
+        return None
+
+    def add(self, sdist_sha256, tag, wheel_path):
+        """
+        Copy a wheel built from the sdist into the store, then evict down
+        to max_size (never evicting the wheel just added).
+
+        :rtype str
+        :return: path of the stored wheel
+        """
+        entry = self.entry_dir(sdist_sha256, tag)
+        mkdir_p(entry)
+        path = os.path.join(entry, os.path.basename(wheel_path))
+        tmp_path = "{0}.{1}.{2}.tmp".format(
+            path, os.getpid(), threading.get_ident())
+        shutil.copyfile(wheel_path, tmp_path)
+        os.rename(tmp_path, path)
+        maglog.info("Stored {} built from sdist {}".format(
+            os.path.basename(path), sdist_sha256[:12]))
+        self.evict(keep=path)
+        return path
+
+    def entries(self):
+        """
+        :rtype list
+        :return: (last used, size, wheel path) of every stored wheel
+        """
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for f in filenames:
+                if not f.endswith('.whl'):
+                    continue
+                path = os.path.join(dirpath, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, st.st_size, path))
+        return found
+
+    def size(self):
+        return sum(e[1] for e in self.entries())
+
+    def evict(self, max_size=None, keep=None):
+        """
+        Remove least recently used wheels until the store is at most
+        max_size bytes.
+
+        :rtype int
+        :return: number of wheels removed
+        """
+        if max_size is None:
+            max_size = self.max_size
+        removed = 0
+        with self._lock:
+            entries = sorted(self.entries())
+            total = sum(e[1] for e in entries)
+            for _, size, path in entries:
+                if total <= max_size:
+                    break
+                if path == keep:
+                    continue
+                shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+                total -= size
+                removed += 1
+        if removed:
+            maglog.info("Evicted {} built wheels, store now {} bytes".format(
+                removed, total))
+        return removed
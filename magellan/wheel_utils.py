@@ -0,0 +1,384 @@
+"""
+Module containing WheelHelper class and wheel filename helpers.
+
+Reads a release's requirements straight from the .dist-info/METADATA inside
+its wheel, so they can be found without creating an environment and
+installing the package. Where possible only the METADATA is fetched, not the
+whole wheel.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import re
+import sys
+import threading
+import zipfile
+
+import requests
+from pkg_resources import parse_version
+
+from magellan.metadata_utils import requirements_from_metadata
+from magellan.utils import MagellanConfig, mkdir_p
+from magellan.wheel_store import WheelStore
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+# name-version(-build)?-python-abi-platform.whl
+WHEEL_TAGS = re.compile(
+    r'^(?P<name>.+?)-(?P<ver>[^-]+)(-\d[^-]*)?-(?P<py>[^-]+)-(?P<abi>[^-]+)'
+    r'-(?P<plat>[^-]+)\.whl$')
+
+PLATFORM_TAGS = {'linux': 'linux', 'darwin': 'macosx', 'win32': 'win'}
+
+
+def normalise_name(name):
+    """As wheel filenames and PEP 503: 'Foo.Bar-baz' -> 'foo_bar_baz'"""
+    return re.sub(r'[-_.]+', '_', name).lower()
+
+
+def best_wheel(files, python_version=None, platform=None, any_wheel=True):
+    """
+    The wheel among a release's files most likely to be installed: a pure
+    wheel for the python version, then one for its cpXY tag (or an abi3
+    one for an earlier cp3Y) and platform, then any wheel.
+
+    :param list files: release file dicts from PyPI JSON ('filename', ...)
+    :param str python_version: "X.Y" of the target, default this python
+    :param str platform: sys.platform of the target, default this one
+    :param bool any_wheel: if False, only a wheel pip would install on the
+    target, i.e. not the last of those
+    :rtype dict
+    :return: file dict, or None if there are no wheels
+    """
+    if python_version is None:
+        python_version = "{0}.{1}".format(*sys.version_info[:2])
+    platform = PLATFORM_TAGS.get(platform or sys.platform, '')
+    cp_tag = 'cp' + python_version.replace('.', '')
+    py_tag = 'py' + python_version.split('.')[0]
+
+    def _abi3(py_tags):
+        """an abi3 wheel for cp3Y installs on any later python 3"""
+        minors = [int(t[3:]) for t in py_tags
+                  if t.startswith('cp3') and t[3:].isdigit()]
+        return (python_version.startswith('3.') and bool(minors) and
+                min(minors) <= int(python_version.split('.')[1]))
+
+    pure, matching, others = [], [], []
+    for f in files or []:
+        tags = WHEEL_TAGS.match(f.get('filename', ''))
+        if not tags:
+            continue
+        py_tags = tags.group('py').split('.')
+        if tags.group('plat') == 'any' and (
+                py_tag in py_tags or cp_tag in py_tags):
+            pure.append(f)
+        elif platform in tags.group('plat') and (
+                cp_tag in py_tags or
+                tags.group('abi') == 'abi3' and _abi3(py_tags)):
+            matching.append(f)
+        else:
+            others.append(f)
+    for group in (pure, matching, others if any_wheel else []):
+        if group:
+            return max(group, key=lambda f: (f.get('size') or 0,
+                                             f['filename']))
+    return None
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """
+    Read-only, seekable file over HTTP range requests, enough for zipfile
+    to read a remote wheel's central directory and one member without
+    downloading the rest.
+
+    The last tail_size bytes (where the central directory usually is) are
+    fetched up front; other reads fetch at least min_fetch bytes. Bytes
+    fetched are counted in fetched.
+    """
+
+    tail_size = 64 * 1024
+    min_fetch = 64 * 1024
+
+    def __init__(self, url, size=None, session=None):
+        super(HTTPRangeFile, self).__init__()
+        self.url = url
+        self.session = session or requests
+        if not size:
+            r = self.session.head(url, allow_redirects=True, timeout=60)
+            if r.status_code != 200 or 'Content-Length' not in r.headers:
+                raise IOError("Unable to find size of {}".format(url))
+            size = int(r.headers['Content-Length'])
+        self.size = size
+        self.fetched = 0
+        self.requests = 0
+        self._pos = 0
+        self._blocks = []  # (start, bytes)
+        self._fetch(max(0, size - self.tail_size), size)
+
+    def _fetch(self, start, end):
+        r = self.session.get(
+            self.url, headers={'Range': 'bytes={0}-{1}'.format(start, end - 1)},
+            stream=True, timeout=60)
+        try:
+            if r.status_code != 206:
+                raise IOError("Range request to {} not honoured ({})".format(
+                    self.url, r.status_code))
+            data = r.content
+        finally:
+            r.close()
+        self.requests += 1
+        self.fetched += len(data)
+        if len(data) != end - start:
+            raise IOError("Short range response from {}".format(self.url))
+        self._blocks.append((start, data))
+        return data
+
+    def _read_at(self, start, end):
+        for b_start, data in self._blocks:
+            if b_start <= start and end <= b_start + len(data):
+                return data[start - b_start:end - b_start]
+        fetch_end = min(self.size, max(end, start + self.min_fetch))
+        return self._fetch(start, fetch_end)[:end - start]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def read(self, size=-1):
+        start = self._pos
+        end = self.size if size is None or size < 0 else \
+            min(self.size, start + size)
+        if start >= end:
+            return b''
+        data = self._read_at(start, end)
+        self._pos = end
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class WheelHelper(object):
+    """Collection of static methods for finding, downloading and reading
+    wheels. Downloaded wheels are kept under the cache dir."""
+
+    subdir = 'wheels'
+
+    @staticmethod
+    def wheel_dir():
+        return os.path.join(MagellanConfig.cache_dir, WheelHelper.subdir)
+
+    @staticmethod
+    def find_local_wheel(package, version):
+        """
+        A wheel for package==version already in the wheel dir.
+
+        :rtype str
+        :return: path, or None
+        """
+        wheel_dir = WheelHelper.wheel_dir()
+        if not os.path.isdir(wheel_dir):
+            return None
+        name = normalise_name(package)
+        candidates = []
+        for f in os.listdir(wheel_dir):
+            tags = WHEEL_TAGS.match(f)
+            if (tags and normalise_name(tags.group('name')) == name and
+                    parse_version(tags.group('ver')) ==
+                    parse_version(version)):
+                candidates.append({'filename': f})
+        chosen = best_wheel(candidates)
+        return os.path.join(wheel_dir, chosen['filename']) if chosen else None
+
+    @staticmethod
+    def download_wheel(file_info):
+        """
+        Download a release file to the wheel dir, checking its sha256 if
+        PyPI gave one.
+
+        :param dict file_info: release file dict from PyPI JSON
+        :rtype str
+        :return: path, or None if the download failed
+        """
+        path = os.path.join(WheelHelper.wheel_dir(), file_info['filename'])
+        if os.path.exists(path):
+            return path
+
+        mkdir_p(WheelHelper.wheel_dir())
+        tmp_path = "{0}.{1}.{2}.tmp".format(
+            path, os.getpid(), threading.get_ident())
+        expected = (file_info.get('digests') or {}).get('sha256')
+        digest = hashlib.sha256()
+        try:
+            r = requests.get(file_info['url'], stream=True, timeout=60)
+            if r.status_code != 200:
+                maglog.info("failed to download {0}: {1}".format(
+                    file_info['url'], r.status_code))
+                return None
+            with open(tmp_path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=65536):
+                    digest.update(chunk)
+                    f.write(chunk)
+        except (requests.RequestException, IOError, OSError) as e:
+            maglog.info("failed to download {0}: {1}".format(
+                file_info.get('url'), e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+        if expected and digest.hexdigest() != expected:
+            maglog.warning("sha256 mismatch for {0}, discarding".format(
+                file_info['filename']))
+            os.remove(tmp_path)
+            return None
+        os.rename(tmp_path, path)
+        return path
+
+    @staticmethod
+    def read_metadata(wheel_path):
+        """
+        Contents of the METADATA in a wheel's .dist-info.
+
+        :param wheel_path: path, or seekable binary file-like object
+        :rtype str
+        :return: METADATA text, or None if the wheel can't be read
+        """
+        try:
+            with zipfile.ZipFile(wheel_path) as zf:
+                names = [n for n in zf.namelist()
+                         if re.match(r'^[^/]+\.dist-info/METADATA$', n)]
+                if not names:
+                    maglog.info("No METADATA in {}".format(wheel_path))
+                    return None
+                return zf.read(names[0]).decode('utf-8', 'replace')
+        except (zipfile.BadZipfile, IOError, OSError,
+                requests.RequestException) as e:
+            maglog.info("Unable to read {}: {}".format(wheel_path, e))
+            return None
+
+    @staticmethod
+    def fetch_core_metadata(file_info):
+        """
+        The wheel's METADATA from the index's PEP 658 companion file
+        (<url>.metadata), checking its sha256 where the index gives one
+        (PEP 714 'core-metadata', or the older 'data-dist-info-metadata').
+        Tried unless the index says there isn't one.
+
+        :param dict file_info: release file dict from PyPI JSON
+        :rtype str
+        :return: METADATA text, or None
+        """
+        available = file_info.get(
+            'core-metadata', file_info.get('data-dist-info-metadata', True))
+        if not available or not file_info.get('url'):
+            return None
+        expected = available.get('sha256') if isinstance(
+            available, dict) else None
+        try:
+            r = requests.get(file_info['url'] + '.metadata', timeout=60)
+        except requests.RequestException as e:
+            maglog.info("failed to fetch metadata of {0}: {1}".format(
+                file_info['filename'], e))
+            return None
+        if r.status_code != 200:
+            maglog.debug("No metadata file for {0}: {1}".format(
+                file_info['filename'], r.status_code))
+            return None
+        if expected and hashlib.sha256(r.content).hexdigest() != expected:
+            maglog.warning("sha256 mismatch for metadata of {0}, "
+                           "discarding".format(file_info['filename']))
+            return None
+        return r.content.decode('utf-8', 'replace')
+
+    @staticmethod
+    def read_remote_metadata(file_info):
+        """
+        The wheel's METADATA read from the index with HTTP range requests:
+        the zip's central directory and that member only.
+
+        :param dict file_info: release file dict from PyPI JSON
+        :rtype str
+        :return: METADATA text, or None if the server doesn't support range
+        requests (or the wheel can't be read)
+        """
+        if not file_info.get('url'):
+            return None
+        try:
+            with requests.Session() as session:
+                remote = HTTPRangeFile(file_info['url'], file_info.get('size'),
+                                       session)
+                text = WheelHelper.read_metadata(remote)
+        except (requests.RequestException, IOError, OSError) as e:
+            maglog.info("Unable to read {0} remotely: {1}".format(
+                file_info['filename'], e))
+            return None
+        if text is not None:
+            maglog.info("Read METADATA of {0} with {1} range requests, "
+                        "{2} of {3} bytes".format(
+                            file_info['filename'], remote.requests,
+                            remote.fetched, remote.size))
+        return text
+
+    @staticmethod
+    def get_deps_from_wheel(package, version, release_files=None):
+        """
+        Requirements of package==version from its wheel: one already in the
+        wheel dir or built from its sdist (see WheelStore), else the best
+        wheel among release_files. For that the
+        METADATA is fetched on its own if the index serves it (PEP 658),
+        else read with range requests, and only failing both is the wheel
+        downloaded.
+
+        :param list release_files: file dicts of the release from PyPI JSON
+        :rtype dict
+        :return: {'project_name', 'version', 'requires'} as
+        DepTools.get_deps_for_package_version, or {} if there's no usable
+        wheel (e.g. an sdist-only release)
+        """
+        text = None
+        wheel_path = WheelHelper.find_local_wheel(package, version)
+        if wheel_path is None and MagellanConfig.wheel_store_size:
+            sdist_sha256 = WheelStore.sdist_sha256(release_files)
+            if sdist_sha256:
+                wheel_path = WheelStore().find(sdist_sha256)
+        if wheel_path is None:
+            file_info = best_wheel(release_files)
+            if file_info is None:
+                return {}
+            wheel_name = file_info['filename']
+            text = (WheelHelper.fetch_core_metadata(file_info) or
+                    WheelHelper.read_remote_metadata(file_info))
+            if text is None:
+                wheel_path = WheelHelper.download_wheel(file_info)
+                if wheel_path is None:
+                    return {}
+        if text is None:
+            wheel_name = os.path.basename(wheel_path)
+            text = WheelHelper.read_metadata(wheel_path)
+        if text is None:
+            return {}
+
+        result = requirements_from_metadata(text)
+        if not result['project_name'] or not result['version']:
+            return {}
+        maglog.info("Read requirements of {} {} from {}".format(
+            package, version, wheel_name))
+        return result
@@ -44,12 +44,17 @@ setup(
         'Natural Language :: English',
         'License :: OSI Approved :: MIT License',
         'Operating System :: POSIX :: Linux',
-        'Programming Language :: Python :: 2.7',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
         'Topic :: Software Development :: Quality Assurance',
         'Topic :: Utilities',
     ],
     license='MIT',
+    python_requires='>=3.9',
     long_description=open('README.rst').read(),
     packages=['magellan'],
     package_dir={'magellan': 'magellan'},
@@ -0,0 +1,103 @@
+"""
+Test suite for the agent_utils module.
+
+Tests are for EnvironmentAgent class, run against this interpreter.
+"""
+
+import os
+import signal
+import sys
+import unittest
+from mock import patch
+
+from magellan import env_interrogation
+from magellan.agent_utils import AgentError, EnvironmentAgent
+from magellan.env_utils import Environment
+
+
+class TestEnvironmentAgent(unittest.TestCase):
+    """Requests and responses over the agent's pipes."""
+
+    def setUp(self):
+        self.agent = EnvironmentAgent(sys.executable)
+        self.agent.start()
+
+    def tearDown(self):
+        self.agent.stop()
+
+    def test_ping(self):
+        """agent runs under the given python"""
+        self.assertEqual(self.agent.ping()['executable'], sys.executable)
+
+    def test_interrogate_matches_in_process(self):
+        """same nodes as interrogating in process"""
+        nodes, _, _ = env_interrogation.interrogate()
+        doc = self.agent.interrogate()
+        self.assertEqual(sorted(tuple(n) for n in doc['nodes']),
+                         sorted(nodes))
+
+    def test_package_in_env(self):
+        """as Environment.package_in_env"""
+        found, (name, version) = self.agent.package_in_env('MOCK')
+        self.assertTrue(found)
+        self.assertEqual(name.lower(), 'mock')
+        self.assertEqual(self.agent.package_in_env('NoSuchPackage'),
+                         (False, (None, None)))
+
+    def test_metadata(self):
+        """requirements as package_interrogation.py"""
+        meta = self.agent.metadata('requests')
+        self.assertEqual(meta['project_name'].lower(), 'requests')
+        self.assertIn('urllib3', meta['requires'])
+        self.assertEqual(meta['requires']['urllib3']['key'], 'urllib3')
+
+    def test_errors_raised_agent_survives(self):
+        """a bad request doesn't kill the agent"""
+        pid = self.agent.ping()['pid']
+        with self.assertRaises(AgentError):
+            self.agent.metadata('NoSuchPackage')
+        with self.assertRaises(AgentError):
+            self.agent.request('no_such_op')
+        self.assertEqual(self.agent.ping()['pid'], pid)
+
+    def test_restarted_if_killed(self):
+        """next request starts a new agent"""
+        pid = self.agent.ping()['pid']
+        os.kill(self.agent.process.pid, signal.SIGKILL)
+        self.agent.process.wait()
+        self.assertNotEqual(self.agent.ping()['pid'], pid)
+        self.assertEqual(self.agent.restarts, 1)
+
+    def test_restarted_if_hung(self):
+        """an agent that stops answering is killed and replaced"""
+        self.agent.timeout = 0.5
+        pid = self.agent.ping()['pid']
+        os.kill(pid, signal.SIGSTOP)
+        self.assertNotEqual(self.agent.ping()['pid'], pid)
+        self.assertEqual(self.agent.restarts, 1)
+
+    def test_gives_up_after_max_restarts(self):
+        """an agent that can't stay up isn't restarted forever"""
+        self.agent.stop()
+        self.agent = EnvironmentAgent(
+            "{} -c 'import sys'".format(sys.executable), max_restarts=2)
+        with self.assertRaises(AgentError):
+            self.agent.ping()
+        self.assertEqual(self.agent.restarts, 2)
+
+
+class TestEnvironmentWithAgent(unittest.TestCase):
+    """Environment interrogated through its agent."""
+
+    def test_query_via_agent(self):
+        venv = Environment()
+        with patch.object(
+                Environment, 'python_cmd', return_value=sys.executable):
+            try:
+                venv.query_nodes_edges_via_agent()
+                agent = venv.agent()
+                self.assertIs(venv.agent(), agent)  # reused
+            finally:
+                venv.stop_agent()
+        self.assertIn('mock', [n[0].lower() for n in venv.nodes])
+        self.assertIsNone(venv._agent)
@@ -0,0 +1,210 @@
+"""
+Test suite for the cache_utils module.
+
+Tests are for ResultCache and SnapshotCache classes.
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock, patch
+
+from magellan.cache_utils import ResultCache, SnapshotCache
+from magellan.env_utils import Environment
+from magellan.metadata_utils import EnvironmentScanner
+from magellan.utils import MagellanConfig
+
+
+class TestResultCache(unittest.TestCase):
+    """Hits, misses and invalidation of cached analysis results."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.patch = patch.object(MagellanConfig, 'cache_dir', self.cache_dir)
+        self.patch.start()
+
+        self.venv = MagicMock()
+        self.venv.name = 'TestEnv'
+        self.venv.nodes = [('A', '1.0.0'), ('B', '1.0.0')]
+        self.venv.package_requirements = {
+            'a': {'project_name': 'A', 'version': '1.0.0',
+                  'requires': {'b': {'project_name': 'B',
+                                     'specs': [['>=', '1.0.0']]}}},
+            'b': {'project_name': 'B', 'version': '1.0.0', 'requires': {}}}
+
+        self.calls = []
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def analysis(self, arg):
+        self.calls.append(arg)
+        print("analysed {}".format(arg))
+        return {'arg': arg}
+
+    def test_repeat_invocation_is_a_hit(self):
+        """Second run with same env and args does not recompute"""
+        r1 = ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        r2 = ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        self.assertEqual(self.calls, ['x'])
+        self.assertEqual(r1, r2)
+
+    def test_output_replayed(self):
+        """Console output is replayed on a hit"""
+        ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        with patch('sys.stdout') as stdout:
+            ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        stdout.write.assert_called_with("analysed x\n")
+
+    def test_different_args_miss(self):
+        """Arguments are part of the key"""
+        ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        ResultCache.run(self.venv, 'cmd', ['y'], self.analysis, 'y')
+        self.assertEqual(self.calls, ['x', 'y'])
+
+    def test_changed_env_invalidates(self):
+        """A change in requirement specs makes the entry stale"""
+        ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        self.venv.package_requirements['a']['requires']['b']['specs'] = []
+        ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        self.assertEqual(self.calls, ['x', 'x'])
+
+    def test_stale_entry_replaced_concurrently(self):
+        """A stale entry removed by another run meanwhile isn't an error"""
+        ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        self.venv.package_requirements['a']['requires']['b']['specs'] = []
+        path = ResultCache.entry_path(self.venv, 'cmd', ['x'])
+        real_open = open
+
+        def _open(f, *args, **kwargs):
+            handle = real_open(f, *args, **kwargs)
+            if f == path and os.path.exists(path):
+                os.remove(path)  # the other run
+            return handle
+
+        with patch('builtins.open', side_effect=_open):
+            ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        self.assertEqual(self.calls, ['x', 'x'])
+
+    def test_changed_version_invalidates(self):
+        """Magellan version is part of the key"""
+        ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        with patch('magellan.cache_utils.__version__', '0.0.0'):
+            ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        self.assertEqual(self.calls, ['x', 'x'])
+
+    def test_disabled(self):
+        """No caching when disabled"""
+        with patch.object(ResultCache, 'enabled', False):
+            ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+            ResultCache.run(self.venv, 'cmd', ['x'], self.analysis, 'x')
+        self.assertEqual(self.calls, ['x', 'x'])
+
+
+class TestSnapshotCache(unittest.TestCase):
+    """Incremental refresh of environment snapshots."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.patch = patch.object(MagellanConfig, 'cache_dir', self.cache_dir)
+        self.patch.start()
+
+        self.site = tempfile.mkdtemp()
+        self.add_dist('A', '1.0', ['B>=1'])
+        self.add_dist('B', '1.0', [])
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.site)
+
+    def add_dist(self, name, version, requires):
+        d = os.path.join(self.site, "{}-{}.dist-info".format(name, version))
+        os.mkdir(d)
+        with open(os.path.join(d, 'METADATA'), 'w') as f:
+            f.write("Name: {}\nVersion: {}\n".format(name, version))
+            for r in requires:
+                f.write("Requires-Dist: {}\n".format(r))
+        return d
+
+    def scan(self, refresh=False):
+        return SnapshotCache.scan(EnvironmentScanner([self.site]), refresh)
+
+    def test_first_scan_reads_all(self):
+        nodes, _, _, stats = self.scan()
+        self.assertEqual(stats, {'reused': 0, 'read': 2, 'removed': 0})
+        self.assertEqual(sorted(nodes), [['A', '1.0'], ['B', '1.0']])
+
+    def test_unchanged_reuses_all(self):
+        _, edges1, pr1, _ = self.scan()
+        _, edges2, pr2, stats = self.scan()
+        self.assertEqual(stats, {'reused': 2, 'read': 0, 'removed': 0})
+        self.assertEqual(pr1, pr2)
+
+    def test_only_changed_distributions_read(self):
+        self.scan()
+        shutil.rmtree(os.path.join(self.site, 'B-1.0.dist-info'))
+        self.add_dist('B', '2.0', [])
+        self.add_dist('C', '1.0', [])
+        nodes, edges, pr, stats = self.scan()
+        self.assertEqual(stats, {'reused': 1, 'read': 2, 'removed': 1})
+        self.assertEqual(sorted(nodes),
+                         [['A', '1.0'], ['B', '2.0'], ['C', '1.0']])
+        self.assertIn([['A', '1.0'], ['b', '2.0'], [['>=', '1']]], edges)
+
+    def test_modified_metadata_reread(self):
+        d = os.path.join(self.site, 'A-1.0.dist-info')
+        self.scan()
+        with open(os.path.join(d, 'METADATA'), 'a') as f:
+            f.write("Requires-Dist: C\n")
+        _, _, pr, stats = self.scan()
+        self.assertEqual(stats['read'], 1)
+        self.assertIn('c', pr['a']['requires'])
+
+    def test_develop_install_egg_info_change_reread(self):
+        """an *.egg-link is fingerprinted with the egg-info it points to"""
+        project = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, project)
+        egg_info = os.path.join(project, 'D.egg-info')
+        os.mkdir(egg_info)
+        with open(os.path.join(egg_info, 'PKG-INFO'), 'w') as f:
+            f.write("Name: D\nVersion: 1.0\n")
+        with open(os.path.join(self.site, 'D.egg-link'), 'w') as f:
+            f.write(project + "\n.\n")
+        nodes, _, _, _ = self.scan()
+        self.assertIn(['D', '1.0'], nodes)
+
+        with open(os.path.join(egg_info, 'PKG-INFO'), 'w') as f:
+            f.write("Name: D\nVersion: 1.0.1\n")
+        nodes, _, _, stats = self.scan()
+        self.assertEqual(stats['read'], 1)
+        self.assertIn(['D', '1.0.1'], nodes)
+
+    def test_refresh_reads_all(self):
+        self.scan()
+        _, _, _, stats = self.scan(refresh=True)
+        self.assertEqual(stats, {'reused': 0, 'read': 2, 'removed': 0})
+
+    def test_reuse_reported(self):
+        """without -v, on the normal output"""
+        venv = Environment('MyEnv')
+        out = io.StringIO()
+        with patch.object(Environment, 'site_dirs',
+                          return_value=[self.site]), \
+                contextlib.redirect_stdout(out):
+            venv.scan_nodes_edges_from_disk()
+            venv.scan_nodes_edges_from_disk()
+        self.assertIn("for MyEnv: 0 distributions reused, 2 re-read, "
+                      "0 removed", out.getvalue())
+        self.assertIn("for MyEnv: 2 distributions reused, 0 re-read, "
+                      "0 removed", out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+"""
+Test suite for the crawl_utils module.
+
+Tests are for the requirement set and changelog helpers, and the
+DependencyCrawler class with PyPI and the metadata sources replaced.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from magellan.crawl_utils import (DependencyCrawler, changelog,
+                                  requirement_set, requirement_set_id)
+from magellan.deps_utils import DependencyScheduler, DepTools, PyPIHelper
+from magellan.utils import MagellanConfig
+
+FILES = [{'filename': 'celery-x.tar.gz'}]
+RELEASES = {'releases': {'3.0': FILES, '3.1': FILES, '3.2': FILES,
+                         '4.0': FILES, '4.1rc1': FILES, '4.1': FILES,
+                         '5.0': FILES, '2.0': []}}
+
+
+def _requires(**specs):
+    return {'requires': {k: {'project_name': k, 'key': k, 'specs': v}
+                         for k, v in specs.items()}}
+
+
+STATIC = {
+    '3.0': _requires(kombu=[('>=', '3.0')], anyjson=[]),
+    '3.1': _requires(kombu=[('>=', '3.0')], anyjson=[]),
+    '4.0': _requires(kombu=[('<', '5'), ('>=', '4.0')]),
+    '4.1': _requires(kombu=[('>=', '4.0'), ('<', '5')]),
+    '5.0': _requires(kombu=[('>=', '5.0')], vine=[]),
+}
+
+
+class TestRequirementSets(unittest.TestCase):
+
+    def test_requirement_set(self):
+        self.assertEqual(requirement_set(STATIC['4.0']), {'kombu': '<5,>=4.0'})
+        self.assertEqual(requirement_set(STATIC['4.0']),
+                         requirement_set(STATIC['4.1']))
+        self.assertEqual(requirement_set({}), {})
+        self.assertEqual(requirement_set_id({'a': '', 'b': '>1'}),
+                         requirement_set_id({'b': '>1', 'a': ''}))
+
+    def test_changelog(self):
+        sets = {v: requirement_set(r) for v, r in STATIC.items()}
+        log = changelog(['3.0', '3.1', '3.2', '4.0', '4.1', '5.0'], sets)
+        self.assertEqual([e['version'] for e in log], ['3.0', '4.0', '5.0'])
+        self.assertEqual(log[0]['added'], {'anyjson': '', 'kombu': '>=3.0'})
+        self.assertEqual(log[1]['removed'], {'anyjson': ''})
+        self.assertEqual(log[1]['changed'], {'kombu': ('>=3.0', '<5,>=4.0')})
+        self.assertEqual(log[2]['added'], {'vine': ''})
+
+
+class TestDependencyCrawler(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.fetched = []
+        self.patches = [
+            patch.object(MagellanConfig, 'cache_dir', self.cache_dir),
+            patch.object(PyPIHelper, 'acquire_package_json_info',
+                         return_value=RELEASES),
+            patch.object(DepTools, 'get_static_deps',
+                         side_effect=self._static)]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def _static(self, package, version):
+        self.fetched.append(version)
+        result = dict(STATIC.get(version, {}))
+        if result:
+            result['source'] = 'wheel'
+        return result
+
+    def test_versions(self):
+        self.assertEqual(DependencyCrawler('celery').versions(),
+                         ['3.0', '3.1', '3.2', '4.0', '4.1', '5.0'])
+        self.assertEqual(DependencyCrawler('celery', '>=3.1,<5').versions(),
+                         ['3.1', '3.2', '4.0', '4.1'])
+        self.assertEqual(DependencyCrawler.parse_crawl_arg('celery>=3,<5'),
+                         ('celery', '<5,>=3'))
+
+    def test_crawl_stored_deduplicated(self):
+        with patch.object(DependencyScheduler, 'run') as run:
+            result = DependencyCrawler('celery', max_workers=3).crawl()
+        self.assertFalse(run.called)
+        self.assertEqual(result['unknown'], ['3.2'])
+        self.assertEqual(result['distinct'], 3)
+        self.assertEqual(result['sources']['4.1'], 'wheel')
+
+        with open(os.path.join(self.cache_dir, 'crawl', 'celery.json')) as f:
+            store = json.load(f)
+        self.assertEqual(len(store['versions']), 5)
+        self.assertEqual(len(store['requirement_sets']), 3)
+        self.assertEqual(store['versions']['4.0'], store['versions']['4.1'])
+
+        # only the unknown release is tried again
+        self.fetched = []
+        self.assertEqual(DependencyCrawler('celery').crawl()['sets'],
+                         result['sets'])
+        self.assertEqual(self.fetched, ['3.2'])
+
+    def test_cached_result_used(self):
+        with open(DepTools.cached_deps_path('celery', '3.2'), 'w') as f:
+            json.dump(STATIC['3.1'], f)
+        result = DependencyCrawler('celery', '==3.2').crawl()
+        self.assertEqual(self.fetched, [])
+        self.assertEqual(result['sources'], {'3.2': 'cache'})
+
+    def test_install(self):
+        installed = dict(STATIC['3.1'], source='install')
+        with patch.object(DependencyScheduler, 'run',
+                          return_value={('celery', '3.2'): installed}) as run:
+            result = DependencyCrawler('celery', install=True).crawl()
+        run.assert_called_once_with([('celery', '3.2')])
+        self.assertEqual(result['unknown'], [])
+        self.assertEqual(result['sources']['3.2'], 'install')
+
+    def test_display(self):
+        with patch('magellan.crawl_utils.print_col') as printed:
+            DependencyCrawler.crawl_and_display('celery<5')
+        output = "\n".join(c[0][0] for c in printed.call_args_list)
+        self.assertIn("~ kombu >=3.0 -> <5,>=4.0", output)
+        self.assertIn("- anyjson", output)
+        self.assertIn("unknown without installing", output)
+        self.assertIn("3.2", output)
@@ -22,10 +22,21 @@ ANCESTOR DEPENDENCIES:
 import unittest
 import pickle
 import json
-from mock import MagicMock
+from mock import MagicMock, patch
 
 from magellan.deps_utils import DepTools
 from magellan.package_utils import Package
+from magellan.utils import MagellanConfig
+
+
+def _reqs(name, version, requires):
+    """Remote requirements of name version, as returned by
+    acquire_deps_for_package_versions; requires is [(name, specs)]."""
+    return {'project_name': name, 'version': version,
+            'requires': {r[0].lower(): {'key': r[0].lower(),
+                                        'project_name': r[0],
+                                        'specs': r[1]}
+                         for r in requires}}
 
 
 class TestPackageClass(unittest.TestCase):
@@ -634,3 +645,293 @@ class TestAncestorContrivedExamples(unittest.TestCase):
             package, version, ancestors, self.package_requirements)
 
         self.assertIn('z', res['conflicts'])
+
+
+class TestTransitiveUpgradeContrivedExamples(unittest.TestCase):
+    """
+    Testing contrived examples for detect_transitive_upgrade_conflicts.
+
+    Current Env:
+    A 1.0.0 depends on B (==1.0.0)
+    B 1.0.0 depends on C (<2.0.0)
+    X 1.0.0 depends on B (>=1.0.0)
+    Y 1.0.0 depends on C (<2.0.0)
+
+    Upgrading A to 2.0.0 requires B>=2.0.0; B 2.0.0 requires C>=2.0.0, so
+    C must change too, which breaks Y (two steps away from A).
+    """
+
+    def setUp(self):
+        self.nodes = [('A', '1.0.0'), ('B', '1.0.0'), ('C', '1.0.0'),
+                      ('X', '1.0.0'), ('Y', '1.0.0')]
+        self.edges = [[('root', '0.0.0'), n] for n in self.nodes]
+        self.edges += [[('A', '1.0.0'), ('B', '1.0.0'), [('==', '1.0.0')]],
+                       [('B', '1.0.0'), ('C', '1.0.0'), [('<', '2.0.0')]],
+                       [('X', '1.0.0'), ('B', '1.0.0'), [('>=', '1.0.0')]],
+                       [('Y', '1.0.0'), ('C', '1.0.0'), [('<', '2.0.0')]], ]
+
+        p_r = {n[0].lower(): {'project_name': n[0], 'version': n[1],
+                              'requires': {}} for n in self.nodes}
+        for e in self.edges[len(self.nodes):]:
+            p_r[e[0][0].lower()]['requires'][e[1][0].lower()] = {
+                'project_name': e[1][0], 'specs': e[2]}
+
+        self.venv = MagicMock()
+        self.venv.nodes = self.nodes
+        self.venv.edges = self.edges
+        self.venv.package_requirements = p_r
+        self.venv.all_packages = {n[0].lower(): Package(n[0], n[1])
+                                  for n in self.nodes}
+
+        self.remote_reqs = {
+            ('A', '2.0.0'): _reqs('A', '2.0.0', [('B', [('>=', '2.0.0')])]),
+            ('B', '2.0.0'): _reqs('B', '2.0.0', [('C', [('>=', '2.0.0')])]),
+            ('C', '2.0.0'): _reqs('C', '2.0.0', []),
+        }
+        self.remote_versions = {'A': ['1.0.0', '2.0.0'],
+                                'B': ['1.0.0', '2.0.0', '3.0.0b1'],
+                                'C': ['1.0.0', '2.0.0']}
+
+    def _run(self, packages):
+        acquire = (lambda pvs, max_workers=None:
+                   {pv: self.remote_reqs.get(pv, {}) for pv in pvs})
+        with patch('magellan.deps_utils.PyPIHelper'
+                   '.check_package_version_on_pypi', return_value=True), \
+                patch('magellan.deps_utils.PyPIHelper'
+                      '.all_package_versions_on_pypi',
+                      side_effect=lambda p: self.remote_versions[p]), \
+                patch('magellan.deps_utils.DepTools'
+                      '.acquire_deps_for_package_versions',
+                      side_effect=acquire), \
+                patch('magellan.deps_utils.DepTools'
+                      '.table_print_transitive_upgrade_conflicts'):
+            return DepTools.detect_transitive_upgrade_conflicts(
+                packages, self.venv)
+
+    def test_forced_changes_propagate(self):
+        """B and C should be changed to their latest satisfying versions"""
+        res = self._run([('A', '2.0.0')])['A_2_0_0']
+        self.assertEqual(res['changes']['b'], ('B', '1.0.0', '2.0.0', 1))
+        self.assertEqual(res['changes']['c'], ('C', '1.0.0', '2.0.0', 2))
+
+    def test_indirect_ancestor_conflict(self):
+        """Y's spec on C is broken, X's spec on B is not"""
+        res = self._run([('A', '2.0.0')])['A_2_0_0']
+        broken = [(c[0][0], c[1]) for c in res['conflicts']]
+        self.assertEqual(broken, [('Y', 'C')])
+
+    def test_no_changes_needed(self):
+        """Upgrading C within X and Y's specs changes nothing else"""
+        self.remote_reqs[('C', '1.5.0')] = {'project_name': 'C',
+                                            'version': '1.5.0',
+                                            'requires': {}}
+        res = self._run([('C', '1.5.0')])['C_1_5_0']
+        self.assertEqual(list(res['changes'].keys()), ['c'])
+        self.assertEqual(res['conflicts'], [])
+        self.assertIn(('Y', '1.0.0'), res['at_risk'])
+
+
+class TestTransitiveAdditionContrivedExamples(unittest.TestCase):
+    """
+    Testing contrived examples for
+    detect_transitive_package_addition_conflicts.
+
+    Current Env:
+    B 1.0.0, C 1.0.0
+
+    New package N 1.0.0 requires M (>=1.0.0) and B (>=1.0.0)
+    M 1.0.0 (not in env) requires C (>=2.0.0) and Q
+    Q 1.0.0 (not in env) requires M (<1.0.0)
+    """
+
+    def setUp(self):
+        self.venv = MagicMock()
+        self.venv.nodes = [('B', '1.0.0'), ('C', '1.0.0')]
+
+        self.remote_reqs = {
+            ('N', '1.0.0'): _reqs('N', '1.0.0', [('M', [('>=', '1.0.0')]),
+                                                 ('B', [('>=', '1.0.0')])]),
+            ('M', '1.0.0'): _reqs('M', '1.0.0', [('C', [('>=', '2.0.0')]),
+                                                 ('Q', [])]),
+            ('Q', '1.0.0'): _reqs('Q', '1.0.0', [('M', [('<', '1.0.0')])]),
+        }
+        self.remote_versions = {'M': ['0.5.0', '1.0.0'], 'Q': ['1.0.0']}
+        self.acquired = []
+
+    def _run(self, packages):
+        def acquire(pvs, max_workers=None):
+            self.acquired.append(list(pvs))
+            return {pv: self.remote_reqs.get(pv, {}) for pv in pvs}
+
+        with patch('magellan.deps_utils.PyPIHelper'
+                   '.check_package_version_on_pypi', return_value=True), \
+                patch('magellan.deps_utils.PyPIHelper'
+                      '.all_package_versions_on_pypi',
+                      side_effect=lambda p: self.remote_versions[p]), \
+                patch('magellan.deps_utils.DepTools'
+                      '.acquire_deps_for_package_versions',
+                      side_effect=acquire):
+            return DepTools.detect_transitive_package_addition_conflicts(
+                packages, self.venv)
+
+    def test_levels_fetched_breadth_first(self):
+        """Each level of the tree is acquired as one batch"""
+        self._run([('N', '1.0.0')])
+        self.assertEqual(self.acquired, [[('N', '1.0.0')],
+                                         [('M', '1.0.0')],
+                                         [('Q', '1.0.0')]])
+
+    def test_sub_dependency_conflicts_with_env(self):
+        """M's requirement on C is checked against the current env"""
+        res = self._run([('N', '1.0.0')])['N_1_0_0']
+        self.assertEqual(res['may_try_upgrade'],
+                         [('M -> C', ('1.0.0', '>=', '2.0.0', False))])
+        self.assertEqual(res['new_packages'],
+                         [('M', '1.0.0', 1), ('Q', '1.0.0', 2)])
+
+    def test_conflict_between_new_packages(self):
+        """Q wants an older M than N does"""
+        res = self._run([('N', '1.0.0')])['N_1_0_0']
+        self.assertEqual(res['new_conflicts'],
+                         [('Q -> M', ('1.0.0', '<', '1.0.0', False))])
+
+
+class TestFindConflictsInEnv(unittest.TestCase):
+    """Versions that can't be compared in find_conflicts_in_env."""
+
+    nodes = [('A', '1.0'), ('B', '1.0')]
+    package_requirements = {
+        'a': _reqs('A', '1.0', [('B', [('>=', '1.0')])]),
+        'b': _reqs('B', '1.0', []),
+    }
+
+    def test_unparseable_version_is_a_conflict(self):
+        with patch.object(DepTools, 'check_requirement_satisfied',
+                          side_effect=ValueError("Invalid version: ''")):
+            conflicts = DepTools.find_conflicts_in_env(
+                self.nodes, self.package_requirements)
+        self.assertEqual(conflicts,
+                         [(('A', '1.0'), 'B', ('1.0', '>=', '1.0', False))])
+
+    def test_other_errors_not_hidden(self):
+        with patch.object(DepTools, 'check_requirement_satisfied',
+                          side_effect=TypeError("bug")):
+            self.assertRaises(TypeError, DepTools.find_conflicts_in_env,
+                              self.nodes, self.package_requirements)
+
+
+class TestJointPackageConflicts(unittest.TestCase):
+    """
+    Testing detect_joint_package_conflicts with contrived examples.
+
+    Current Env:
+    Django 1.6.0
+    djangorestframework 3.0.0 depends on Django (<1.7)
+    six 1.9.0
+    """
+
+    def setUp(self):
+        self.venv = MagicMock()
+        self.venv.nodes = [('Django', '1.6.0'),
+                           ('djangorestframework', '3.0.0'),
+                           ('six', '1.9.0')]
+        self.venv.package_requirements = {
+            'django': {'project_name': 'Django', 'version': '1.6.0',
+                       'requires': {}},
+            'djangorestframework': {
+                'project_name': 'djangorestframework', 'version': '3.0.0',
+                'requires': {'django': {'project_name': 'Django',
+                                        'specs': [['<', '1.7']]}}},
+            'six': {'project_name': 'six', 'version': '1.9.0',
+                    'requires': {}},
+        }
+
+        self.remote_reqs = {
+            ('Django', '1.8'): _reqs('Django', '1.8', []),
+            ('djangorestframework', '3.2'): _reqs(
+                'djangorestframework', '3.2', [('Django', [('>=', '1.7')])]),
+            ('newpkg', '1.0'): _reqs('newpkg', '1.0', [('six', [('<', '1.9')])]),
+        }
+
+    def _run(self, pins):
+        acquire = (lambda pvs, max_workers=None:
+                   {pv: self.remote_reqs.get(pv, {}) for pv in pvs})
+        with patch('magellan.deps_utils.PyPIHelper'
+                   '.check_package_version_on_pypi', return_value=True), \
+                patch('magellan.deps_utils.DepTools'
+                      '.acquire_deps_for_package_versions',
+                      side_effect=acquire), \
+                patch('magellan.deps_utils.DepTools'
+                      '.table_print_joint_package_conflicts'):
+            return DepTools.detect_joint_package_conflicts(pins, self.venv)
+
+    def test_single_pin_introduces_conflict(self):
+        """Django alone breaks djangorestframework"""
+        res = self._run([('Django', '1.8')])
+        self.assertEqual([(c[0][0], c[1]) for c in res['introduced']],
+                         [('djangorestframework', 'Django')])
+
+    def test_pins_resolve_together(self):
+        """Django and djangorestframework together are fine"""
+        res = self._run([('Django', '1.8'), ('djangorestframework', '3.2')])
+        self.assertEqual(res['introduced'], [])
+        self.assertEqual(res['conflicts'], [])
+
+    def test_addition_checked_in_combined_graph(self):
+        """A new package's requirements are checked in the joint graph"""
+        res = self._run([('newpkg', '1.0')])
+        self.assertEqual([(c[0][0], c[1]) for c in res['introduced']],
+                         [('newpkg', 'six')])
+
+
+class TestStaticDepsChain(unittest.TestCase):
+    """
+    get_static_deps tries PyPI JSON, the wheel, then the sdist, and records
+    which one answered.
+    """
+
+    def _run(self, json_res, wheel_res, sdist_res, **config):
+        calls = []
+
+        def _source(name, result):
+            def _get(*args):
+                calls.append(name)
+                return dict(result)
+            return _get
+
+        patches = [
+            patch('magellan.deps_utils.PyPIHelper.acquire_package_json_info',
+                  return_value={}),
+            patch('magellan.deps_utils.PyPIHelper.get_deps_from_version_json',
+                  side_effect=_source('pypi-json', json_res)),
+            patch('magellan.deps_utils.WheelHelper.get_deps_from_wheel',
+                  side_effect=_source('wheel', wheel_res)),
+            patch('magellan.deps_utils.SdistHelper.get_deps_from_sdist',
+                  side_effect=_source('sdist', sdist_res))]
+        patches += [patch.object(MagellanConfig, k, v)
+                    for k, v in config.items()]
+        for p in patches:
+            p.start()
+        try:
+            return DepTools.get_static_deps('foo', '1.0'), calls
+        finally:
+            for p in patches:
+                p.stop()
+
+    def test_first_answer_used(self):
+        found = {'project_name': 'foo', 'version': '1.0', 'requires': {}}
+        result, calls = self._run({}, found, found)
+        self.assertEqual(calls, ['pypi-json', 'wheel'])
+        self.assertEqual(result['source'], 'wheel')
+
+    def test_disabled_skipped(self):
+        found = {'project_name': 'foo', 'version': '1.0', 'requires': {}}
+        result, calls = self._run(found, {}, found, json_metadata=False,
+                                  wheel_metadata=False)
+        self.assertEqual(calls, ['sdist'])
+        self.assertEqual(result['source'], 'sdist')
+
+    def test_none_known(self):
+        result, calls = self._run({}, {}, {})
+        self.assertEqual(calls, ['pypi-json', 'wheel', 'sdist'])
+        self.assertEqual(result, {})
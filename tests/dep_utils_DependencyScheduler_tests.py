@@ -0,0 +1,95 @@
+"""
+Test suite for the Magellan dep_utils module.
+
+Tests are for DependencyScheduler class, with
+DepTools.get_deps_for_package_version replaced by a stand-in that records
+its calls.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from mock import patch
+
+from magellan.deps_utils import DepTools, DependencyScheduler
+from magellan.utils import MagellanConfig
+
+
+class TestDependencyScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(MagellanConfig, 'cache_dir', self.cache_dir),
+            patch.object(MagellanConfig, 'env_pool_size', 0)]
+        for p in self.patches:
+            p.start()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def _get_deps(self, package, version, vex_options=None,
+                  tmp_env_name=None):
+        with self.lock:
+            self.calls.append((package, version, tmp_env_name))
+        return {'project_name': package, 'version': version, 'requires': {}}
+
+    def _run(self, package_versions, max_workers=1):
+        with patch.object(DepTools, 'get_deps_for_package_version',
+                          side_effect=self._get_deps):
+            return DependencyScheduler(max_workers).run(package_versions)
+
+    def _write_timings(self, timings):
+        with open(DependencyScheduler.timings_path(), 'w') as f:
+            json.dump(timings, f)
+
+    def test_deduplicated_in_given_order(self):
+        result = self._run([('b', '1'), ('a', '2'), ('b', '1'), ['a', '2']])
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(list(result), [('b', '1'), ('a', '2')])
+        self.assertEqual(result[('a', '2')]['version'], '2')
+
+    def test_slowest_first(self):
+        """known slow package first, unknown at the mean, cached last"""
+        self._write_timings({'fast': 1.0, 'slow': 9.0})
+        with open(DepTools.cached_deps_path('cached', '1'), 'w') as f:
+            json.dump({}, f)
+        pairs = [('cached', '1'), ('fast', '1'), ('new', '1'), ('slow', '1')]
+
+        result = self._run(pairs)
+        self.assertEqual([c[:2] for c in self.calls],
+                         [('slow', '1'), ('new', '1'), ('fast', '1'),
+                          ('cached', '1')])
+        self.assertEqual(list(result), pairs)
+
+    def test_unique_workspaces(self):
+        self._run([('a', '1'), ('b', '1'), ('c', '1')], max_workers=3)
+        names = [c[2] for c in self.calls]
+        self.assertEqual(len(set(names)), 3)
+        for name in names:
+            self.assertTrue(name.startswith("{}{}_".format(
+                MagellanConfig.tmp_env_dir, os.getpid())))
+
+    def test_pool_used_when_enabled(self):
+        with patch.object(MagellanConfig, 'env_pool_size', 2):
+            self._run([('a', '1'), ('b', '1')])
+        self.assertEqual([c[2] for c in self.calls], [None, None])
+
+    def test_timings_recorded_and_merged(self):
+        self._write_timings({'other': 5.0})
+        with open(DepTools.cached_deps_path('cached', '1'), 'w') as f:
+            json.dump({}, f)
+        self._run([('a', '1'), ('cached', '1')])
+
+        timings = DependencyScheduler.load_timings()
+        self.assertEqual(sorted(timings), ['a', 'other'])
+        self.assertEqual(timings['other'], 5.0)
+        self.assertFalse([f for f in os.listdir(self.cache_dir)
+                          if f.endswith('.tmp')])
@@ -1,12 +1,18 @@
 """
 Test suite for the Magellan dep_utils module.
 
-Tests are for PyPIHelper class
+Tests are for PyPIHelper and PyPIPrefetcher classes
 
 """
 
-from magellan.deps_utils import PyPIHelper
+from magellan.deps_utils import PyPIHelper, PyPIPrefetcher
+from magellan.utils import MagellanConfig
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from mock import MagicMock, patch
 # from mock import MagicMock, mock_open, patch
 
 
@@ -117,3 +123,148 @@ class TestCheckPackageVersionOnPyPI(TestPackageClass):
         package, version = "Django", "9999.9999.9999"
         res = PyPIHelper.check_package_version_on_pypi(package, version)
         self.assertEqual(res, False)
+
+
+class TestPyPIPrefetcher(unittest.TestCase):
+    """
+    Background warming of the package JSON cache.
+    """
+
+    def setUp(self):
+        self.running = 0
+        self.max_running = 0
+        self.fetched = []
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+
+        def slow_fetch(package, localcache=None):
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            self.release.wait(5)
+            with self.lock:
+                self.running -= 1
+                self.fetched.append(package)
+            return {'releases': {}}
+
+        self.patches = [patch.object(PyPIHelper, '_json_memo', {}),
+                        patch.object(PyPIHelper, '_fetch_package_json_info',
+                                     staticmethod(slow_fetch))]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        self.release.set()
+        for p in self.patches:
+            p.stop()
+
+    def test_concurrency_budget(self):
+        """never more than max_workers fetches at once"""
+        prefetcher = PyPIPrefetcher(max_workers=2)
+        prefetcher.submit(['a', 'b', 'c', 'd', 'e'])
+        time.sleep(0.1)
+        self.release.set()
+        prefetcher.wait()
+        prefetcher.close()
+        self.assertEqual(self.max_running, 2)
+        self.assertEqual(sorted(self.fetched), ['a', 'b', 'c', 'd', 'e'])
+
+    def test_unneeded_speculative_names_cancelled(self):
+        """speculative names not confirmed by interrogation are dropped"""
+        prefetcher = PyPIPrefetcher(max_workers=1)
+        prefetcher.environment_package_names(['a', 'b', 'c', 'd'], True)
+        time.sleep(0.05)  # 'a' is running, the rest queued
+        prefetcher.environment_package_names(['A', 'c'], False)
+        self.release.set()
+        prefetcher.wait()
+        prefetcher.close()
+        self.assertEqual(sorted(self.fetched), ['a', 'c'])
+
+    def test_close_cancels_queued(self):
+        """nothing not yet started is fetched after close"""
+        prefetcher = PyPIPrefetcher(max_workers=1)
+        prefetcher.submit(['a', 'b', 'c'])
+        time.sleep(0.05)
+        self.release.set()
+        prefetcher.close()
+        prefetcher.submit(['d'])  # ignored once closed
+        self.assertEqual(self.fetched, ['a'])
+
+
+class TestVersionJSON(unittest.TestCase):
+    """
+    Requirements from requires_dist in PyPI's JSON for a release.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.patch = patch.object(MagellanConfig, 'cache_dir', self.cache_dir)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def _get(self, info):
+        response = MagicMock(status_code=200)
+        response.json.return_value = {'info': info}
+        with patch('requests.get', return_value=response) as get:
+            result = PyPIHelper.get_deps_from_version_json('Foo', '1.0')
+        return result, get
+
+    def test_requires_dist(self):
+        result, get = self._get({
+            'name': 'Foo', 'version': '1.0',
+            'requires_dist': ['six (>=1.9)', 'pytest ; extra == "test"']})
+        self.assertEqual(get.call_args[0][0],
+                         'https://pypi.python.org/pypi/Foo/1.0/json')
+        self.assertEqual(result, {
+            'project_name': 'Foo', 'version': '1.0',
+            'requires': {'six': {'project_name': 'six', 'key': 'six',
+                                 'specs': [('>=', '1.9')]}}})
+
+        with patch('requests.get') as get:  # cached
+            PyPIHelper.get_deps_from_version_json('Foo', '1.0')
+        self.assertFalse(get.called)
+
+    def test_not_recorded(self):
+        """null requires_dist isn't 'no requirements'"""
+        result, _ = self._get({'name': 'Foo', 'version': '1.0',
+                               'requires_dist': None})
+        self.assertEqual(result, {})
+
+
+class TestPackageJSONExpiry(unittest.TestCase):
+    """
+    Package JSON (release lists, e.g. for -O) is refetched once older than
+    MagellanConfig.pypi_json_ttl.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.patch = patch.object(MagellanConfig, 'cache_dir', self.cache_dir)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def _fetch(self, releases, status_code=200):
+        response = MagicMock(status_code=status_code)
+        response.json.return_value = {'releases': releases}
+        with patch('requests.get', return_value=response) as get:
+            result = PyPIHelper._fetch_package_json_info('foo')
+        return result, get.called
+
+    def test_expiry(self):
+        self.assertEqual(self._fetch({'1.0': []}), ({'releases': {'1.0': []}},
+                                                    True))
+        self.assertEqual(self._fetch({'2.0': []}), ({'releases': {'1.0': []}},
+                                                    False))
+
+        with patch.object(MagellanConfig, 'pypi_json_ttl', 0):
+            self.assertEqual(self._fetch({'2.0': []}),
+                             ({'releases': {'2.0': []}}, True))
+            # stale cache still used if PyPI can't be reached
+            self.assertEqual(self._fetch({}, status_code=503),
+                             ({'releases': {'2.0': []}}, True))
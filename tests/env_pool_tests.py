@@ -0,0 +1,200 @@
+"""
+Test suite for the env_pool module.
+
+Tests are for TempEnvPool class, using a stand-in backend whose "pip" is a
+script keeping the installed packages in a JSON file in the env dir.
+"""
+
+import json
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from mock import patch
+
+from magellan.deps_utils import DepTools
+from magellan.env_pool import EnvPoolError, TempEnvPool
+from magellan.env_utils import Environment
+from magellan.utils import CommandTimeout, MagellanConfig
+
+FAKE_PIP = r"""
+import json, os, sys
+env_dir, args = sys.argv[1], [a for a in sys.argv[2:] if not a.startswith('--')]
+state = os.path.join(env_dir, 'installed.json')
+with open(state) as f:
+    installed = json.load(f)
+if args[0] == 'list':
+    print(json.dumps([{'name': k, 'version': v} for k, v in installed.items()]))
+elif args[0] == 'install':
+    for a in args[1:]:
+        name, _, version = a.partition('==')
+        installed[name] = version or str(float(installed.get(name, 0)) + 1)
+elif args[0] == 'uninstall':
+    for a in args[1:]:
+        if a != '-y':
+            installed.pop(a, None)
+with open(state, 'w') as f:
+    json.dump(installed, f)
+"""
+
+
+class FakeBackend(object):
+
+    def __init__(self, venv_home):
+        self.venv_home = venv_home
+        self.pip_script = os.path.join(venv_home, 'fake_pip.py')
+        with open(self.pip_script, 'w') as f:
+            f.write(FAKE_PIP)
+        self.created = []
+
+    def env_dir(self, name):
+        return os.path.join(self.venv_home, name)
+
+    def env_exists(self, name):
+        return os.path.isdir(self.env_dir(name))
+
+    def pip_cmd(self, name):
+        return "{} {} {}".format(sys.executable, self.pip_script,
+                                 self.env_dir(name))
+
+    def base_python_cmd(self):
+        return shlex.quote(sys.executable)
+
+    def create_env(self, name):
+        self.created.append(name)
+        shutil.rmtree(self.env_dir(name), ignore_errors=True)
+        os.makedirs(self.env_dir(name))
+        with open(os.path.join(self.env_dir(name), 'installed.json'),
+                  'w') as f:
+            json.dump({'pip': '1.0', 'setuptools': '1.0'}, f)
+
+    def remove_env(self, name):
+        shutil.rmtree(self.env_dir(name), ignore_errors=True)
+
+
+class TestTempEnvPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.backend = FakeBackend(self.tmp)
+        self.patches = [
+            patch.object(MagellanConfig, 'cache_dir',
+                         os.path.join(self.tmp, 'cache')),
+            patch.object(Environment, 'backend',
+                         staticmethod(lambda vex_options=None: self.backend)),
+            patch('sys.stdout')]  # "Creating virtual env" messages
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmp)
+
+    def _install(self, pool, name, requirement):
+        pool._pip(name, ['install', requirement])
+
+    def test_reset_to_baseline_and_reused(self):
+        pool = TempEnvPool(size=1)
+        with pool.acquire() as name:
+            self.assertEqual(pool.baselines[name],
+                             {'pip': '2.0', 'setuptools': '1.0'})  # upgraded
+            self._install(pool, name, 'foo==1.2')
+            self.assertIn('foo', pool.installed(name))
+        self.assertNotIn('foo', pool.installed(name))
+
+        with pool.acquire() as again:
+            self.assertEqual(again, name)
+        self.assertEqual(self.backend.created, [name])
+        self.assertEqual(pool.replaced, 0)
+
+    def test_changed_baseline_package_rebuilt(self):
+        pool = TempEnvPool(size=1, pip_update=False)
+        with pool.acquire() as name:
+            self._install(pool, name, 'setuptools==50.0')
+        self.assertEqual(pool.replaced, 1)
+        self.assertEqual(pool.installed(name),
+                         {'pip': '1.0', 'setuptools': '1.0'})
+
+    def test_removed_env_replaced(self):
+        pool = TempEnvPool(size=1, pip_update=False)
+        with pool.acquire() as name:
+            pass
+        self.backend.remove_env(name)
+        with pool.acquire() as name:
+            self.assertTrue(pool.healthy(name))
+        self.assertEqual(pool.replaced, 1)
+
+    def test_kept_between_runs(self):
+        TempEnvPool(size=2, pip_update=False).warm()
+        self.backend.created = []
+        pool = TempEnvPool(size=2, pip_update=False)
+        pool.warm()
+        self.assertEqual(self.backend.created, [])
+        self.assertEqual(sorted(pool.baselines),
+                         ['MagellanPool0', 'MagellanPool1'])
+
+    def test_at_most_size_in_use(self):
+        pool = TempEnvPool(size=2, pip_update=False)
+        in_use, peak = set(), []
+        lock = threading.Lock()
+
+        def _use():
+            with pool.acquire() as name:
+                with lock:
+                    self.assertNotIn(name, in_use)
+                    in_use.add(name)
+                    peak.append(len(in_use))
+                time.sleep(0.05)
+                with lock:
+                    in_use.remove(name)
+
+        threads = [threading.Thread(target=_use) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(len(self.backend.created), 2)
+
+    def test_used_by_get_deps(self):
+        """installs go into a pool env, not a new MagellanTmp"""
+        pool = TempEnvPool(size=1, pip_update=False)
+        used = []
+
+        def fake_install(package, version, env_name, vex_options,
+                         interpreter=None):
+            used.append(env_name)
+            return {'project_name': package, 'version': version,
+                    'requires': {}}
+
+        with patch.object(DepTools, 'get_static_deps', return_value={}), \
+                patch.object(TempEnvPool, 'shared', return_value=pool), \
+                patch.object(DepTools, '_install_and_interrogate',
+                             side_effect=fake_install), \
+                patch.object(Environment, 'create_vex_new_virtual_env') as c:
+            DepTools.acquire_deps_for_package_versions(
+                [('a', '1'), ('b', '1')])
+        self.assertEqual(used, ['MagellanPool0', 'MagellanPool0'])
+        self.assertFalse(c.called)
+
+    def test_build_failures_are_pool_errors(self):
+        """a pip upgrade past its deadline or a failed create doesn't escape
+        get_deps_for_package_version"""
+        pool = TempEnvPool(size=1)
+        with patch.object(TempEnvPool, '_pip',
+                          side_effect=CommandTimeout('killed after 1s')):
+            self.assertRaises(EnvPoolError, pool.build, 'MagellanPool0')
+
+        with patch.object(self.backend, 'create_env',
+                          side_effect=OSError('no space')), \
+                patch.object(DepTools, 'get_static_deps', return_value={}), \
+                patch.object(TempEnvPool, 'shared', return_value=pool), \
+                patch.object(DepTools, '_install_and_interrogate') as install:
+            self.assertEqual(DepTools.acquire_deps_for_package_versions(
+                [('a', '1')]), {('a', '1'): {}})
+        self.assertFalse(install.called)
@@ -1,10 +1,21 @@
 """
 Test suite for the env_utils module.
 """
-from mock import MagicMock
+from concurrent.futures import ThreadPoolExecutor
+from mock import MagicMock, patch
+import io
+import json
+import os
 import pickle
+import shutil
+import sys
+import tempfile
 import unittest
+import venv
+from pkg_resources import resource_filename as pkg_res_resource_filename
 from magellan.env_utils import Environment
+from magellan.utils import (DocumentError, MagellanConfig,
+                            read_json_document, run_in_subp_ret_json)
 
 
 class TestEnvSetup(unittest.TestCase):
@@ -50,5 +61,211 @@ class TestVexCheckEnvExists(unittest.TestCase):
         self.assertIn(bool_back, [True, False])
 
 
+class TestInProcessInterrogation(unittest.TestCase):
+    """
+    In process interrogation should match running env_interrogation.py in a
+    subprocess with the same interpreter.
+    """
+
+    def test_matches_subprocess(self):
+        script = pkg_res_resource_filename('magellan', 'env_interrogation.py')
+        doc = run_in_subp_ret_json("{} {}".format(sys.executable, script))
+        sub_nodes = doc['nodes']
+        sub_pr = doc['package_requirements']
+
+        venv = Environment()
+        venv.query_nodes_edges_in_process()
+
+        def _sorted_specs(pr):  # spec order is not stable across processes
+            for p in pr.values():
+                for r in p['requires'].values():
+                    r['specs'] = sorted(r['specs'])
+            return pr
+
+        self.assertEqual(sorted(map(list, venv.nodes)), sorted(sub_nodes))
+        self.assertEqual(
+            _sorted_specs(json.loads(json.dumps(venv.package_requirements))),
+            _sorted_specs(sub_pr))
+
+    def test_is_running_interpreter(self):
+        """Only true for unnamed env when "python" is alongside us"""
+        here = os.path.join(os.path.dirname(sys.executable), 'python')
+        with patch('magellan.env_utils.shutil.which', return_value=here):
+            self.assertTrue(Environment().is_running_interpreter())
+            self.assertFalse(Environment('other').is_running_interpreter())
+        with patch('magellan.env_utils.shutil.which',
+                   return_value='/elsewhere/bin/python'):
+            self.assertFalse(Environment().is_running_interpreter())
+
+
+class TestInterrogationDocument(unittest.TestCase):
+    """
+    Interrogation results are streamed over stdout as a length-prefixed
+    JSON document.
+    """
+
+    def setUp(self):
+        self.script = pkg_res_resource_filename(
+            'magellan', 'env_interrogation.py')
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_document(self):
+        stream = io.BytesIO(b'noise\n7\n[1,2,3]trailing')
+        self.assertEqual(read_json_document(stream, chunk_size=2), [1, 2, 3])
+
+    def test_truncated_document(self):
+        stream = io.BytesIO(b'10\n[1,2]')
+        self.assertRaises(DocumentError, read_json_document, stream)
+
+    def test_no_files_written(self):
+        doc = run_in_subp_ret_json("{} {}".format(sys.executable, self.script))
+        self.assertEqual(sorted(doc),
+                         ['edges', 'nodes', 'package_requirements'])
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_concurrent_runs(self):
+        cmd = "{} {}".format(sys.executable, self.script)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            docs = list(executor.map(run_in_subp_ret_json, [cmd] * 4))
+        for d in docs[1:]:
+            self.assertEqual(sorted(map(tuple, d['nodes'])),
+                             sorted(map(tuple, docs[0]['nodes'])))
+
+    def test_error_on_stderr(self):
+        script = pkg_res_resource_filename(
+            'magellan', 'package_interrogation.py')
+        with self.assertRaises(DocumentError) as cm:
+            run_in_subp_ret_json("{} {} NoSuchPackage123".format(
+                sys.executable, script))
+        self.assertIn("NoSuchPackage123 not found", str(cm.exception))
+
+    def test_package_interrogation(self):
+        script = pkg_res_resource_filename(
+            'magellan', 'package_interrogation.py')
+        doc = run_in_subp_ret_json("{} {} requests".format(
+            sys.executable, script))
+        self.assertEqual(doc['project_name'], 'requests')
+        self.assertIn('urllib3', doc['requires'])
+
+
 if __name__ == '__main__':
     unittest.main()
+
+
+class TestDirectBackend(unittest.TestCase):
+    """
+    Environments found, run and removed without vex.
+    """
+
+    def setUp(self):
+        self.venv_home = tempfile.mkdtemp()
+        self.env_dir = os.path.join(self.venv_home, 'TestEnv')
+        # Share this interpreter's packages so pkg_resources is available:
+        venv.EnvBuilder(system_site_packages=True, with_pip=False).create(
+            self.env_dir)
+        self.patch_home = patch.dict(os.environ,
+                                     {'WORKON_HOME': self.venv_home})
+        self.patch_home.start()
+        self.patch_backend = patch.object(MagellanConfig, 'env_backend',
+                                          'direct')
+        self.patch_backend.start()
+
+    def tearDown(self):
+        self.patch_backend.stop()
+        self.patch_home.stop()
+        shutil.rmtree(self.venv_home)
+
+    def test_env_exists(self):
+        """envs are directories under WORKON_HOME with a bin/python"""
+        self.assertTrue(Environment.vex_check_venv_exists('TestEnv'))
+        self.assertFalse(Environment.vex_check_venv_exists('NoSuchEnv'))
+
+    def test_missing_env_exits(self):
+        """as with vex, a named env that doesn't exist ends the run"""
+        with self.assertRaises(SystemExit):
+            Environment.vex_resolve_venv_name('NoSuchEnv')
+
+    def test_interrogates_with_env_python(self):
+        """env_interrogation.py run with the env's bin/python"""
+        venv_obj = Environment('TestEnv')
+        venv_obj.resolve_venv_bin(None)
+        self.assertEqual(
+            Environment.backend().python_cmd('TestEnv', venv_obj.bin),
+            os.path.join(self.env_dir, 'bin', 'python'))
+
+        venv_obj.query_nodes_edges_in_venv()
+        self.assertIn('mock', [n[0].lower() for n in venv_obj.nodes])
+
+    def test_temp_envs_under_tmp_dir(self):
+        """vex options select magellan's temporary env home"""
+        backend = Environment.backend(MagellanConfig.vex_options)
+        self.assertEqual(backend.env_dir('MagellanTmp0'),
+                         os.path.join(MagellanConfig.tmp_dir, 'MagellanTmp0'))
+
+    def test_create_replaces_and_remove_deletes(self):
+        """extant env of the same name is replaced, then removed"""
+        venv_obj = Environment('TestEnv')
+        with patch.object(venv.EnvBuilder, 'create') as create:
+            venv_obj.create_vex_new_virtual_env()
+        create.assert_called_once_with(self.env_dir)
+        self.assertFalse(os.path.exists(self.env_dir))  # removed first
+
+        os.makedirs(self.env_dir)
+        Environment.vex_remove_virtual_env('TestEnv')
+        self.assertFalse(os.path.exists(self.env_dir))
+
+    def test_vex_backend_still_available(self):
+        """--env-backend vex routes commands through vex"""
+        with patch.object(MagellanConfig, 'env_backend', 'vex'):
+            backend = Environment.backend()
+        self.assertEqual(backend.python_cmd('TestEnv').split(),
+                         ['vex', 'TestEnv', 'python'])
+
+
+class TestPackageNamesCallback(unittest.TestCase):
+    """
+    Package names are reported speculatively before interrogation, then
+    confirmed from the interrogated nodes.
+    """
+
+    def test_speculative_then_confirmed(self):
+        calls = []
+        kwargs = {'path_to_env_bin': None, 'keep_env_files': False}
+        venv = Environment()
+        with patch.object(Environment, 'is_running_interpreter',
+                          return_value=True):
+            venv.magellan_setup_env(
+                kwargs, lambda names, speculative: calls.append(
+                    (speculative, sorted(n.lower() for n in names))))
+
+        self.assertEqual([c[0] for c in calls], [True, False])
+        self.assertIn('mock', calls[0][1])
+        self.assertEqual(calls[1][1],
+                         sorted(n[0].lower() for n in venv.nodes))
+
+
+class TestDependencyGraph(unittest.TestCase):
+    """Reachability over the edges."""
+
+    def setUp(self):
+        root = ('root', '0.0.0')
+        self.venv = Environment()
+        self.venv.nodes = [('A', '1'), ('B', '1'), ('C', '1'), ('X', '1'),
+                           ('Y', '1')]
+        self.venv.edges = [[root, n] for n in self.venv.nodes] + [
+            [('A', '1'), ('B', '1'), []], [('B', '1'), ('C', '1'), []],
+            [('X', '1'), ('Y', '1'), []], [('Y', '1'), ('X', '1'), []]]
+
+    def test_reachable(self):
+        self.assertEqual(self.venv.reachable(['a']), {'a', 'b', 'c'})
+        self.assertEqual(self.venv.reachable(['a'], exclude='b'), {'a'})
+
+    def test_top_level_includes_cycles(self):
+        """X and Y only require each other, so one stands for the cycle"""
+        self.assertEqual(self.venv.top_level_packages(), ['a', 'x'])
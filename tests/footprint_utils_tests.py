@@ -0,0 +1,143 @@
+"""
+Test suite for the footprint_utils module.
+
+Tests are for FootprintAnalyser class, on a fake site-packages.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from magellan.deps_utils import PyPIHelper
+from magellan.env_utils import Environment
+from magellan.footprint_utils import FootprintAnalyser, human_size
+
+ROOT = ('root', '0.0.0')
+
+
+def _write(path, n_bytes):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(b'x' * n_bytes)
+
+
+class TestFootprint(unittest.TestCase):
+    """app -> (lib, common), tool -> common; lib -> common."""
+
+    def setUp(self):
+        self.env_dir = tempfile.mkdtemp()
+        self.site = os.path.join(self.env_dir, 'lib', 'python3.7',
+                                 'site-packages')
+        # RECORD with sizes, one missing (stat'ed)
+        self._dist('app', "app/__init__.py,sha256=x,1000\n"
+                          "app/big.py,,\n", {'app/big.py': 500})
+        self._dist('lib', "lib.py,sha256=x,200\n")
+        self._dist('tool', "tool.py,sha256=x,50\n")
+        # no RECORD: walked
+        _write(os.path.join(self.site, 'common', '__init__.py'), 4000)
+        meta = os.path.join(self.site, 'common-1.0.dist-info')
+        _write(os.path.join(meta, 'METADATA'), 0)
+        with open(os.path.join(meta, 'top_level.txt'), 'w') as f:
+            f.write('common\n')
+
+        self.venv = Environment()
+        self.venv.bin = os.path.join(self.env_dir, 'bin')
+        self.venv.nodes = [('app', '1.0'), ('lib', '1.0'), ('tool', '1.0'),
+                           ('common', '1.0')]
+        self.venv.edges = [[ROOT, n] for n in self.venv.nodes] + [
+            [('app', '1.0'), ('lib', '1.0'), []],
+            [('app', '1.0'), ('common', '1.0'), []],
+            [('lib', '1.0'), ('common', '1.0'), []],
+            [('tool', '1.0'), ('common', '1.0'), []]]
+
+    def _dist(self, name, record, extra=None):
+        meta = os.path.join(self.site, '{}-1.0.dist-info'.format(name))
+        _write(os.path.join(meta, 'METADATA'), 0)
+        with open(os.path.join(meta, 'RECORD'), 'w') as f:
+            f.write(record)
+        for rel, n_bytes in (extra or {}).items():
+            _write(os.path.join(self.site, rel), n_bytes)
+
+    def tearDown(self):
+        shutil.rmtree(self.env_dir)
+
+    def test_sizes(self):
+        sizes = FootprintAnalyser(self.venv).sizes()
+        self.assertEqual(sizes['app'], 1500)
+        self.assertEqual(sizes['lib'], 200)
+        self.assertEqual(sizes['common'], 4007)  # + top_level.txt
+
+    def test_exclusive_and_shared(self):
+        results = FootprintAnalyser(self.venv).footprint()
+        self.assertEqual(sorted(results), ['app', 'tool'])
+        self.assertEqual(results['app']['transitive'], 5707)
+        self.assertEqual(results['app']['exclusive'], 1700)  # app + lib
+        self.assertEqual(results['app']['shared'], 4007)  # common
+        self.assertEqual(results['tool']['exclusive'], 50)
+
+    def test_dominated_by_non_top_level(self):
+        """lib goes if app does; lib alone only takes itself"""
+        results = FootprintAnalyser(self.venv).footprint(['lib'])
+        self.assertEqual(results['lib']['exclusive'], 200)
+        self.assertFalse(results['lib']['top_level'])
+
+    def test_human_size(self):
+        self.assertEqual(human_size(100), '100 B')
+        self.assertEqual(human_size(1536), '1.5 KiB')
+        self.assertEqual(human_size(None), '?')
+
+
+class TestUpgradeEstimate(unittest.TestCase):
+    """-P --footprint from PyPI wheel sizes."""
+
+    releases = {'releases': {
+        '1.0': [{'filename': 'lib-1.0-py2.py3-none-any.whl', 'size': 100},
+                {'filename': 'lib-1.0.tar.gz', 'size': 900}],
+        '2.0': [{'filename': 'lib-2.0-cp37-cp37m-manylinux1_x86_64.whl',
+                 'size': 300},
+                {'filename': 'lib-2.0-cp37-cp37m-win_amd64.whl', 'size': 50},
+                {'filename': 'lib-2.0-cp36-cp36m-manylinux1_x86_64.whl',
+                 'size': 250}],
+        '3.0': []}}
+
+    def setUp(self):
+        self.patch = patch.object(PyPIHelper, 'acquire_package_json_info',
+                                  return_value=self.releases)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_wheel_choice(self):
+        self.assertEqual(FootprintAnalyser.wheel_size('lib', '1.0', '3.7'),
+                         100)
+        self.assertEqual(FootprintAnalyser.wheel_size(
+            'lib', '2.0', '3.7', 'linux'), 300)
+        self.assertEqual(FootprintAnalyser.wheel_size(
+            'lib', '2.0', '3.7', 'win32'), 50)
+        self.assertIsNone(FootprintAnalyser.wheel_size('lib', '3.0', '3.7'))
+
+    def test_estimate_scales_installed_size(self):
+        with patch.object(FootprintAnalyser, '__init__', return_value=None):
+            analyser = FootprintAnalyser(None)
+        analyser.versions = {'lib': '1.0'}
+        analyser.names = {'lib': 'lib'}
+        analyser.scanner = type('Scanner', (), {'python_version': '3.7'})
+        with patch('sys.platform', 'linux'), \
+                patch.object(FootprintAnalyser, 'distribution_size',
+                             return_value=1000):
+            e = analyser.estimate_upgrade('lib', '2.0')
+            self.assertEqual(e['estimated_size'], 3000)
+            self.assertEqual(e['change'], 2000)
+            self.assertIsNone(analyser.estimate_upgrade('lib', '3.0')
+                              ['change'])
+            self.assertEqual(analyser.estimate_upgrade('new', '1.0')
+                             ['change'], 100)
+
+            analyser.versions['lib'] = '3.0'  # no wheel to scale by
+            e = analyser.estimate_upgrade('lib', '2.0')
+            self.assertIsNone(e['estimated_size'])
+            self.assertIsNone(e['change'])
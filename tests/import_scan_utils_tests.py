@@ -0,0 +1,131 @@
+"""
+Test suite for the import_scan_utils module.
+
+Tests are for imports_in_source and the ImportScanner class, on a fake
+project and site-packages.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from magellan.env_utils import Environment
+from magellan.import_scan_utils import ImportScanner, imports_in_source
+from magellan.utils import MagellanConfig
+
+ROOT = ('root', '0.0.0')
+
+SOURCE = """
+import os, json
+import yaml.constructor
+from requests.adapters import HTTPAdapter
+from . import sibling
+from .sub import thing
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+if TYPE_CHECKING:
+    from typing_extensions import Protocol
+
+def f():
+    import lxml.etree
+"""
+
+
+def _write(path, text):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+class TestImportsInSource(unittest.TestCase):
+
+    def test_required_and_optional(self):
+        required, optional = imports_in_source(SOURCE)
+        self.assertEqual(required, ['json', 'lxml', 'os', 'requests',
+                                    'yaml'])
+        self.assertEqual(optional, ['simplejson', 'typing_extensions'])
+
+    def test_unguarded_import_not_optional(self):
+        required, optional = imports_in_source(
+            "import six\ntry:\n    import six\nexcept ImportError:\n"
+            "    pass\n")
+        self.assertEqual((required, optional), (['six'], []))
+
+    def test_syntax_error(self):
+        with self.assertRaises(SyntaxError):
+            imports_in_source("import (")
+
+
+class TestImportScanner(unittest.TestCase):
+    """myproj requires requests, pyyaml and unused; imports requests, yaml,
+    six (installed via requests) and notinstalled."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.patch = patch.object(MagellanConfig, 'cache_dir',
+                                  os.path.join(self.tmp, 'cache'))
+        self.patch.start()
+
+        self.site = os.path.join(self.tmp, 'env', 'lib', 'python3.7',
+                                 'site-packages')
+        for name, top_level in [('requests', 'requests'),
+                                ('PyYAML', 'yaml\n_yaml'),
+                                ('unused', 'unused'), ('six', 'six'),
+                                ('myproj', 'myproj')]:
+            meta = os.path.join(self.site, '{}-1.0.dist-info'.format(name))
+            _write(os.path.join(meta, 'METADATA'), '')
+            _write(os.path.join(meta, 'top_level.txt'), top_level)
+
+        self.venv = Environment()
+        self.venv.bin = os.path.join(self.tmp, 'env', 'bin')
+        nodes = [('requests', '1.0'), ('PyYAML', '1.0'), ('unused', '1.0'),
+                 ('six', '1.0'), ('myproj', '1.0')]
+        self.venv.nodes = nodes
+        self.venv.edges = [[ROOT, n] for n in nodes] + [
+            [('myproj', '1.0'), n, []] for n in nodes[:3]] + [
+            [('requests', '1.0'), ('six', '1.0'), []]]
+
+        self.src = os.path.join(self.tmp, 'src_tree')
+        _write(os.path.join(self.src, 'myproj', '__init__.py'),
+               "import requests\nfrom myproj import helpers\n")
+        _write(os.path.join(self.src, 'myproj', 'helpers.py'),
+               "import yaml, six, notinstalled, sys\n")
+        _write(os.path.join(self.src, 'setup.py'),
+               "from setuptools import setup\n")
+        _write(os.path.join(self.src, 'build', 'lib', 'copy.py'),
+               "import skipped\n")
+        _write(os.path.join(self.src, 'broken.py'), "import (\n")
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_scan(self):
+        result = ImportScanner(self.src, max_workers=2).scan(
+            'myproj', self.venv)
+        self.assertEqual(result['unused'], ['unused'])
+        self.assertEqual(sorted(result['undeclared']), ['six'])
+        self.assertTrue(result['undeclared']['six']['via'])
+        self.assertEqual(result['undeclared']['six']['files'],
+                         [os.path.join('myproj', 'helpers.py')])
+        self.assertEqual(sorted(result['unresolved']),
+                         ['notinstalled', 'setuptools'])
+        self.assertEqual(list(result['errors']),
+                         [os.path.join(self.src, 'broken.py')])
+
+    def test_rerun_only_parses_changed_files(self):
+        ImportScanner(self.src).scan('myproj', self.venv)
+
+        _write(os.path.join(self.src, 'myproj', 'helpers.py'),
+               "import yaml, unused\n")
+        scanner = ImportScanner(self.src)
+        result = scanner.scan('myproj', self.venv)
+
+        self.assertEqual(result['parsed'], 2)  # helpers.py and broken.py
+        self.assertEqual(result['unused'], [])
+        self.assertEqual(result['undeclared'], {})
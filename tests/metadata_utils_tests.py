@@ -0,0 +1,187 @@
+"""
+Test suite for the metadata_utils module.
+
+Tests are for metadata parsing and the EnvironmentScanner class.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from magellan import env_interrogation
+from magellan.metadata_utils import (EnvironmentScanner, parse_requires_txt,
+                                     parse_requirement_lines,
+                                     marker_environment, parse_record,
+                                     modules_from_files)
+
+METADATA = """Metadata-Version: 2.1
+Name: Foo_Bar
+Version: 1.2.0
+Requires-Dist: six (>=1.9)
+Requires-Dist: enum34 ; python_version < "3.4"
+Requires-Dist: typing-extensions>=3.7 ; python_version < "3.8"
+Requires-Dist: pytest ; extra == 'test'
+
+Long description here.
+"""
+
+PKG_INFO = """Metadata-Version: 1.1
+Name: Baz
+Version: 0.1
+"""
+
+REQUIRES_TXT = """six>=1.0,<2
+
+[:python_version < "3"]
+futures
+
+[docs]
+sphinx
+"""
+
+
+class TestParsing(unittest.TestCase):
+    """Requirement parsing and marker evaluation."""
+
+    def test_markers_for_target_python(self):
+        lines = ['a', 'b; python_version < "3"', 'c; extra == "x"']
+        self.assertEqual(
+            sorted(parse_requirement_lines(lines,
+                                           marker_environment('2.7'))),
+            ['a', 'b'])
+        self.assertEqual(
+            sorted(parse_requirement_lines(lines,
+                                           marker_environment('3.9'))),
+            ['a'])
+
+    def test_specs(self):
+        res = parse_requirement_lines(['Six (>=1.9,<2)'])
+        self.assertEqual(res['six']['project_name'], 'Six')
+        self.assertEqual(sorted(res['six']['specs']),
+                         [('<', '2'), ('>=', '1.9')])
+
+    def test_requires_txt_sections(self):
+        py2 = parse_requires_txt(REQUIRES_TXT, marker_environment('2.7'))
+        py3 = parse_requires_txt(REQUIRES_TXT, marker_environment('3.9'))
+        self.assertEqual(sorted(py2), ['futures', 'six'])
+        self.assertEqual(sorted(py3), ['six'])
+
+    def test_record(self):
+        record = ("six.py,sha256=abc,34549\n"
+                  "six-1.10.0.dist-info/RECORD,,\n"
+                  '"odd,name.py",sha256=def,10\n')
+        self.assertEqual(parse_record(record), [
+            ('six.py', 34549), ('six-1.10.0.dist-info/RECORD', None),
+            ('odd,name.py', 10)])
+
+    def test_modules_from_files(self):
+        files = ['foo/__init__.py', 'foo/bar.py', '_foo.cpython-37m.so',
+                 'six.py', '../../bin/foo', 'foo-1.0.dist-info/METADATA',
+                 '__pycache__/six.cpython-37.pyc', 'data/readme.txt']
+        self.assertEqual(modules_from_files(files), ['_foo', 'foo', 'six'])
+
+
+class TestEnvironmentScanner(unittest.TestCase):
+    """Scanning a fake site-packages."""
+
+    def setUp(self):
+        self.env_dir = tempfile.mkdtemp()
+        self.site = os.path.join(self.env_dir, 'lib', 'python3.7',
+                                 'site-packages')
+        dist_info = os.path.join(self.site, 'Foo_Bar-1.2.0.dist-info')
+        egg_info = os.path.join(self.site, 'Baz-0.1-py3.7.egg-info')
+        six_info = os.path.join(self.site, 'six-1.10.0.dist-info')
+        for d in (dist_info, egg_info, six_info):
+            os.makedirs(d)
+        with open(os.path.join(dist_info, 'METADATA'), 'w') as f:
+            f.write(METADATA)
+        with open(os.path.join(egg_info, 'PKG-INFO'), 'w') as f:
+            f.write(PKG_INFO)
+        with open(os.path.join(egg_info, 'requires.txt'), 'w') as f:
+            f.write(REQUIRES_TXT)
+        with open(os.path.join(six_info, 'METADATA'), 'w') as f:
+            f.write("Name: six\nVersion: 1.10.0\n")
+        with open(os.path.join(six_info, 'RECORD'), 'w') as f:
+            f.write("six.py,sha256=abc,34549\n"
+                    "six-1.10.0.dist-info/METADATA,,\n")
+        with open(os.path.join(egg_info, 'top_level.txt'), 'w') as f:
+            f.write("baz\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.env_dir)
+
+    def test_site_dirs_for_bin(self):
+        self.assertEqual(EnvironmentScanner.site_dirs_for_bin(
+            os.path.join(self.env_dir, 'bin') + '/'), [self.site])
+
+    def test_python_version_inferred(self):
+        scanner = EnvironmentScanner([self.site])
+        self.assertEqual(scanner.python_version, '3.7')
+
+    def test_distribution_files_and_modules(self):
+        paths = EnvironmentScanner([self.site]).distribution_paths()
+        self.assertEqual(sorted(paths), ['baz', 'foo-bar', 'six'])
+        self.assertEqual(
+            EnvironmentScanner.distribution_files(paths['six']),
+            [(os.path.join(self.site, 'six.py'), 34549),
+             (os.path.join(self.site, 'six-1.10.0.dist-info', 'METADATA'),
+              None)])
+        self.assertEqual(EnvironmentScanner.top_level_modules(paths['six']),
+                         ['six'])  # from RECORD
+        self.assertEqual(EnvironmentScanner.top_level_modules(paths['baz']),
+                         ['baz'])  # from top_level.txt
+
+    def test_scan(self):
+        nodes, edges, package_requirements = \
+            EnvironmentScanner([self.site]).scan()
+        self.assertEqual(sorted(nodes), [('Baz', '0.1'),
+                                         ('Foo-Bar', '1.2.0'),
+                                         ('six', '1.10.0')])
+        self.assertIn([('Foo-Bar', '1.2.0'), ('six', '1.10.0'),
+                       [('>=', '1.9')]], edges)
+        self.assertIn([('Foo-Bar', '1.2.0'), ('typing-extensions', ''),
+                       [('>=', '3.7')]], edges)
+        self.assertIn([('root', '0.0.0'), ('Baz', '0.1')], edges)
+        self.assertEqual(sorted(package_requirements['foo-bar']['requires']),
+                         ['six', 'typing-extensions'])
+        self.assertEqual(sorted(package_requirements['baz']['requires']),
+                         ['six'])
+
+    def test_first_site_dir_wins(self):
+        """by path order, not alphabetically, in scan and
+        distribution_paths alike"""
+        user_site = os.path.join(self.env_dir, 'z_user_site')
+        six_info = os.path.join(user_site, 'six-1.16.0.dist-info')
+        os.makedirs(six_info)
+        with open(os.path.join(six_info, 'METADATA'), 'w') as f:
+            f.write("Name: six\nVersion: 1.16.0\n")
+        scanner = EnvironmentScanner([user_site, self.site])
+        nodes, _, _ = scanner.scan()
+        self.assertIn(('six', '1.16.0'), nodes)
+        self.assertNotIn(('six', '1.10.0'), nodes)
+        self.assertEqual(scanner.distribution_paths()['six'], six_info)
+
+
+class TestScanMatchesInterrogation(unittest.TestCase):
+    """Scanning the running interpreter's site-packages should agree with
+    pkg_resources for the distributions found there."""
+
+    def test_matches_working_set(self):
+        site_dirs = EnvironmentScanner.site_dirs_for_running_interpreter()
+        _, _, scanned = EnvironmentScanner(site_dirs).scan()
+        _, _, interrogated = env_interrogation.interrogate()
+
+        self.assertTrue(scanned)
+        for key, p in scanned.items():
+            if key not in interrogated:
+                continue
+            self.assertEqual(p['version'], interrogated[key]['version'])
+            self.assertEqual(
+                {k: sorted(r['specs']) for k, r in p['requires'].items()},
+                {k: sorted(r['specs']) for k, r in
+                 interrogated[key]['requires'].items()}, key)
+
+
+if __name__ == '__main__':
+    unittest.main()
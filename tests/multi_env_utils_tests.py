@@ -0,0 +1,176 @@
+"""
+Test suite for the multi_env_utils module.
+
+Tests are for EnvironmentGroup class and the PyPI lookups it shares between
+environments.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from mock import MagicMock, patch
+
+from magellan.deps_utils import PyPIHelper
+from magellan.multi_env_utils import EnvironmentGroup
+from magellan.package_utils import Package
+
+
+def _fake_venv(name, nodes, package_requirements=None):
+    venv = MagicMock()
+    venv.name = name
+    venv.nodes = nodes
+    venv.package_requirements = package_requirements or {}
+    venv.all_packages = {n[0].lower(): Package(n[0], n[1]) for n in nodes}
+    return venv
+
+
+class TestResolveVenvNames(unittest.TestCase):
+    """Environment names from -n and --venv-glob."""
+
+    def setUp(self):
+        self.workon_home = tempfile.mkdtemp()
+        for name in ['proj-a', 'proj-b', 'other']:
+            os.makedirs(os.path.join(self.workon_home, name, 'bin'))
+        os.makedirs(os.path.join(self.workon_home, 'proj-not-an-env'))
+        self.patch = patch.dict(os.environ, {'WORKON_HOME': self.workon_home})
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.workon_home)
+
+    def test_glob_matches_envs_in_workon_home(self):
+        """only directories with a bin are envs"""
+        self.assertEqual(EnvironmentGroup.venv_names_matching('proj-*'),
+                         ['proj-a', 'proj-b'])
+
+    def test_names_then_globs_without_duplicates(self):
+        """-n names come first, in order, and aren't repeated by a glob"""
+        names = EnvironmentGroup.resolve_venv_names(
+            ['proj-b', 'other/'], ['proj-*'])
+        self.assertEqual(names, ['proj-b', 'other', 'proj-a'])
+
+    def test_nothing_given(self):
+        """no names means current environment"""
+        self.assertEqual(EnvironmentGroup.resolve_venv_names(None, None), [])
+
+
+class TestGroupSetup(unittest.TestCase):
+    """Concurrent set up of environments."""
+
+    kwargs = {'path_to_env_bin': None, 'keep_env_files': True}
+
+    def test_failed_envs_recorded_not_fatal(self):
+        """an env that exits during set up is skipped, order is kept"""
+        def fake_setup(self, kwargs, package_names_callback=None):
+            if self.name == 'bad':
+                raise SystemExit("does not exist")
+            self.nodes = [(self.name, '1.0')]
+
+        with patch('magellan.env_utils.Environment.magellan_setup_env',
+                   fake_setup):
+            group = EnvironmentGroup(['e1', 'bad', 'e2', 'e3'], max_workers=2)
+            venvs = group.setup(self.kwargs)
+
+        self.assertEqual([v.name for v in venvs], ['e1', 'e2', 'e3'])
+        self.assertEqual(group.failed, {'bad': "does not exist"})
+
+    def test_env_files_not_written(self):
+        """concurrent envs would overwrite each other's files"""
+        seen = []
+
+        def fake_setup(self, kwargs, package_names_callback=None):
+            seen.append(kwargs['keep_env_files'])
+
+        with patch('magellan.env_utils.Environment.magellan_setup_env',
+                   fake_setup):
+            EnvironmentGroup(['e1', 'e2']).setup(self.kwargs)
+
+        self.assertEqual(seen, [False, False])
+
+
+class TestSharedWork(unittest.TestCase):
+    """Work common to environments is done once."""
+
+    def test_version_info_once_per_package_version(self):
+        """same package version in two envs is looked up once"""
+        venv1 = _fake_venv('e1', [('A', '1.0'), ('B', '2.0')])
+        venv2 = _fake_venv('e2', [('A', '1.0'), ('B', '3.0')])
+        group = EnvironmentGroup(['e1', 'e2'])
+
+        looked_up = []
+
+        def fake_check(package, version=None):
+            looked_up.append((package, version))
+            return {'code': 0}
+
+        with patch.object(Package, 'check_latest_major_minor_versions',
+                          staticmethod(fake_check)):
+            info = group.version_info(
+                list(venv1.all_packages.values()) +
+                list(venv2.all_packages.values()))
+
+        self.assertEqual(sorted(looked_up),
+                         [('A', '1.0'), ('B', '2.0'), ('B', '3.0')])
+        self.assertEqual(sorted(info),
+                         [('a', '1.0'), ('b', '2.0'), ('b', '3.0')])
+
+    def test_pypi_json_acquired_once_across_threads(self):
+        """concurrent lookups of one package share a single fetch"""
+        calls = []
+
+        def slow_fetch(package, localcache=None):
+            calls.append(package)
+            time.sleep(0.05)
+            return {'releases': {'1.0': []}}
+
+        with patch.object(PyPIHelper, '_json_memo', {}), \
+                patch.object(PyPIHelper, '_fetch_package_json_info',
+                             staticmethod(slow_fetch)):
+            threads = [threading.Thread(
+                target=PyPIHelper.acquire_package_json_info, args=('Pkg',))
+                for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertTrue(PyPIHelper.check_package_version_on_pypi(
+                'Pkg', '1.0'))
+
+        self.assertEqual(calls, ['Pkg'])
+
+    def test_failed_pypi_lookup_not_memoised(self):
+        """an empty result may be retried"""
+        fetch = MagicMock(return_value={})
+        with patch.object(PyPIHelper, '_json_memo', {}), \
+                patch.object(PyPIHelper, '_fetch_package_json_info', fetch):
+            PyPIHelper.acquire_package_json_info('Nope')
+            PyPIHelper.acquire_package_json_info('Nope')
+        self.assertEqual(fetch.call_count, 2)
+
+
+class TestAggregatedConflicts(unittest.TestCase):
+    """-C --aggregate"""
+
+    def test_conflict_listed_with_its_envs(self):
+        """result is keyed by environment"""
+        reqs = {'a': {'project_name': 'A', 'version': '1.0',
+                      'requires': {'b': {'project_name': 'B',
+                                         'specs': [('>=', '2.0')]}}},
+                'b': {'project_name': 'B', 'version': '1.0', 'requires': {}}}
+        ok_reqs = dict(reqs, b={'project_name': 'B', 'version': '2.0',
+                                'requires': {}})
+        group = EnvironmentGroup(['e1', 'e2', 'e3'])
+        group.venvs = [_fake_venv('e1', [('A', '1.0'), ('B', '1.0')], reqs),
+                       _fake_venv('e2', [('A', '1.0'), ('B', '2.0')],
+                                  ok_reqs),
+                       _fake_venv('e3', [('A', '1.0'), ('B', '1.0')], reqs)]
+
+        results = group.detect_env_conflicts()
+
+        self.assertEqual(len(results['e1']), 1)
+        self.assertEqual(results['e2'], [])
+        self.assertEqual(results['e1'], results['e3'])
@@ -0,0 +1,190 @@
+"""
+Test suite for the plan_utils module.
+
+Tests are for UpgradePlanner class, with PyPI and requirement acquisition
+mocked out.
+
+Contrived environment:
+Django 1.4.0
+A 1.0.0 depends on Django (<1.6)
+B 1.0.0 depends on Django (<1.8)
+
+A 2.0.0 and B 2.0.0 accept any Django.
+"""
+
+import unittest
+from mock import MagicMock, patch
+
+from magellan.package_utils import Package
+from magellan.plan_utils import UpgradePlanner
+
+from dep_utils_DepTools_tests import _reqs
+
+
+class TestUpgradePlanner(unittest.TestCase):
+    """Planning over a contrived environment."""
+
+    def setUp(self):
+        nodes = [('Django', '1.4.0'), ('A', '1.0.0'), ('B', '1.0.0')]
+        self.venv = MagicMock()
+        self.venv.nodes = nodes
+        self.venv.edges = [[('root', '0.0.0'), n] for n in nodes] + [
+            [('A', '1.0.0'), ('Django', '1.4.0'), [('<', '1.6')]],
+            [('B', '1.0.0'), ('Django', '1.4.0'), [('<', '1.8')]], ]
+        self.venv.all_packages = {n[0].lower(): Package(n[0], n[1])
+                                  for n in nodes}
+        self.venv.package_requirements = {
+            'django': _reqs('Django', '1.4.0', []),
+            'a': _reqs('A', '1.0.0', [('Django', [('<', '1.6')])]),
+            'b': _reqs('B', '1.0.0', [('Django', [('<', '1.8')])]),
+        }
+
+        self.versions = {
+            'Django': ['1.4.0', '1.5.0', '1.5.1', '1.6.0', '1.7.0',
+                       '1.8.0', '1.9a1'],
+            'A': ['1.0.0', '2.0.0'],
+            'B': ['1.0.0', '2.0.0'],
+        }
+        self.remote = {('A', '2.0.0'): _reqs('A', '2.0.0', []),
+                       ('B', '2.0.0'): _reqs('B', '2.0.0', [])}
+        for v in self.versions['Django']:
+            self.remote[('Django', v)] = _reqs('Django', v, [])
+        self.acquired = []
+
+        def acquire(pvs, max_workers=None):
+            self.acquired += list(pvs)
+            return {pv: self.remote.get(pv, {}) for pv in pvs}
+
+        self.patches = [
+            patch('magellan.plan_utils.PyPIHelper'
+                  '.all_package_versions_on_pypi',
+                  side_effect=lambda p: self.versions[p]),
+            patch('magellan.plan_utils.DepTools'
+                  '.acquire_deps_for_package_versions',
+                  side_effect=acquire),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_milestones(self):
+        """Latest patch per minor series, no pre-releases, ends at target"""
+        planner = UpgradePlanner(self.venv, 'Django', '1.8.0')
+        self.assertEqual(planner.milestones('1.4.0'),
+                         ['1.5.1', '1.6.0', '1.7.0', '1.8.0'])
+
+    def test_single_step_when_allowed(self):
+        """Target reachable in one step if enough upgrades are allowed"""
+        plan = UpgradePlanner(self.venv, 'Django', '1.8.0',
+                              max_step_changes=2).plan()
+        self.assertTrue(plan['reached'])
+        self.assertEqual(len(plan['steps']), 1)
+        self.assertEqual(plan['steps'][0]['upgrades'],
+                         {'Django': ('1.4.0', '1.8.0'),
+                          'A': ('1.0.0', '2.0.0'),
+                          'B': ('1.0.0', '2.0.0')})
+
+    def test_multi_step_with_one_upgrade_per_step(self):
+        """A must move before Django 1.6, B before Django 1.8"""
+        plan = UpgradePlanner(self.venv, 'Django', '1.8.0',
+                              max_step_changes=1).plan()
+        self.assertTrue(plan['reached'])
+        self.assertEqual([s['version'] for s in plan['steps']],
+                         ['1.7.0', '1.8.0'])
+        self.assertEqual(plan['steps'][1]['upgrades']['B'],
+                         ('1.0.0', '2.0.0'))
+
+    def test_blocked(self):
+        """No release of A accepts Django 1.6+"""
+        self.remote[('A', '2.0.0')] = _reqs('A', '2.0.0',
+                                            [('Django', [('<', '1.6')])])
+        plan = UpgradePlanner(self.venv, 'Django', '1.8.0').plan()
+        self.assertFalse(plan['reached'])
+        self.assertEqual(plan['blocked_at'], '1.6.0')
+        self.assertEqual([s['version'] for s in plan['steps']], ['1.5.1'])
+
+    def test_target_not_newer(self):
+        """Downgrades and the installed version are rejected up front"""
+        self.versions['Django'].insert(0, '1.0.0')
+        for target in ['1.4.0', '1.0.0']:
+            plan = UpgradePlanner(self.venv, 'Django', target).plan()
+            self.assertFalse(plan['reached'])
+            self.assertEqual(plan['steps'], [])
+            self.assertIn('not newer', plan['blockers'][0])
+
+    def test_target_not_released(self):
+        """A version that isn't on PyPI is never reached"""
+        plan = UpgradePlanner(self.venv, 'Django', '9.9.9').plan()
+        self.assertFalse(plan['reached'])
+        self.assertIn('not found on PyPI', plan['blockers'][0])
+        self.assertEqual(UpgradePlanner(self.venv, 'Django', '9.9.9')
+                         .milestones('1.4.0'),
+                         ['1.5.1', '1.6.0', '1.7.0', '1.8.0'])
+
+    def test_unknown_requirements_block(self):
+        """A release whose requirements can't be acquired isn't assumed
+        compatible"""
+        del self.remote[('A', '2.0.0')]
+        plan = UpgradePlanner(self.venv, 'Django', '1.8.0').plan()
+        self.assertFalse(plan['reached'])
+        self.assertEqual(plan['blocked_at'], '1.6.0')
+
+        self.remote[('A', '2.0.0')] = _reqs('A', '2.0.0', [])
+        del self.remote[('Django', '1.5.1')]
+        plan = UpgradePlanner(self.venv, 'Django', '1.5.1').plan()
+        self.assertFalse(plan['reached'])
+        self.assertIn('could not be acquired', plan['blockers'][0])
+
+    def _add_c(self, b_spec):
+        """C 1.0.0 installed, required by B with b_spec"""
+        self.venv.nodes.append(('C', '1.0.0'))
+        self.venv.edges.append([('B', '1.0.0'), ('C', '1.0.0'), b_spec])
+        self.venv.package_requirements['c'] = _reqs('C', '1.0.0', [])
+        self.venv.package_requirements['b']['requires']['c'] = {
+            'key': 'c', 'project_name': 'C', 'specs': b_spec}
+        self.versions['C'] = ['1.0.0', '2.0.0', '3.0.0']
+        for v in self.versions['C']:
+            self.remote[('C', v)] = _reqs('C', v, [])
+
+    def test_requirement_upgrade_accepted_by_dependents(self):
+        """C 2.0.0 meets Django's spec but B won't have it"""
+        self._add_c([('!=', '2.0.0')])
+        self.remote[('Django', '1.5.1')] = _reqs(
+            'Django', '1.5.1', [('C', [('>=', '2.0.0')])])
+        plan = UpgradePlanner(self.venv, 'Django', '1.5.1').plan()
+        self.assertTrue(plan['reached'])
+        self.assertEqual(plan['steps'][0]['upgrades']['C'],
+                         ('1.0.0', '3.0.0'))
+
+    def test_upgrades_checked_together(self):
+        """A 2.0.0 (needed for Django 1.6) won't have the C Django needs"""
+        self._add_c([])
+        self.remote[('A', '2.0.0')] = _reqs('A', '2.0.0',
+                                            [('C', [('<', '2.0.0')])])
+        self.remote[('Django', '1.6.0')] = _reqs(
+            'Django', '1.6.0', [('C', [('>=', '2.0.0')])])
+        plan = UpgradePlanner(self.venv, 'Django', '1.6.0').plan()
+        self.assertFalse(plan['reached'])
+        self.assertEqual(plan['blocked_at'], '1.6.0')
+        self.assertEqual([s['version'] for s in plan['steps']], ['1.5.1'])
+
+    def test_candidates_acquired_lazily(self):
+        """Releases of A after the first that fits aren't acquired"""
+        self.versions['A'] += ['2.1.0', '2.2.0', '2.3.0']
+        UpgradePlanner(self.venv, 'Django', '1.6.0', max_step_changes=1,
+                       max_workers=1).plan()
+        self.assertIn(('A', '2.0.0'), self.acquired)
+        self.assertNotIn(('A', '2.1.0'), self.acquired)
+
+    def test_requirements_acquired_once(self):
+        """Requirements are memoised across steps"""
+        UpgradePlanner(self.venv, 'Django', '1.8.0',
+                       max_step_changes=1).plan()
+        self.assertEqual(len(self.acquired), len(set(self.acquired)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Test suite for the profile_utils module.
+
+Tests are for parse_importtime and the ImportProfiler class.
+"""
+
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from magellan.env_utils import Environment
+from magellan.profile_utils import ImportProfiler, parse_importtime
+from magellan.utils import MagellanConfig
+
+IMPORTTIME = """import time: self [us] | cumulative | imported package
+import time:       150 |        150 |   _io
+import time:       300 |        300 | site
+import time:       200 |        200 |     b_mod.inner
+import time:       400 |        600 |   b_mod
+import time:      1000 |       1600 | a_mod
+"""
+
+
+def _fake_profiler(runs, modules, edges):
+    """Profiler of a fake environment whose import runs are given."""
+    venv = Environment()
+    venv.nodes = [('A', '1.0'), ('B', '2.0')]
+    venv.edges = edges
+    with patch('magellan.profile_utils.EnvironmentScanner') as scanner:
+        scanner.return_value.distribution_paths.return_value = {
+            k: k for k in modules}
+        profiler = ImportProfiler(venv)
+    profiler._modules = dict(modules)
+    profiler.profile_distribution = lambda key: runs[key]
+    return profiler
+
+
+class TestParseImporttime(unittest.TestCase):
+
+    def test_rows(self):
+        rows = parse_importtime(IMPORTTIME)
+        self.assertEqual(rows[0], ('_io', 150, 150, 1))
+        self.assertEqual(rows[2], ('b_mod.inner', 200, 200, 2))
+        self.assertEqual(rows[-1], ('a_mod', 1000, 1600, 0))
+        self.assertEqual(len(rows), 5)  # header skipped
+
+
+class TestImportProfiler(unittest.TestCase):
+    """Attribution and roll up of import times."""
+
+    edges = [[('root', '0.0.0'), ('A', '1.0')],
+             [('root', '0.0.0'), ('B', '2.0')],
+             [('A', '1.0'), ('B', '2.0'), []]]
+
+    def setUp(self):
+        rows = parse_importtime(IMPORTTIME)
+        runs = {'a': {'a_mod': {'rows': rows, 'error': None}},
+                'b': {'b_mod': {'rows': rows[2:4], 'error': None}}}
+        self.profiler = _fake_profiler(
+            runs, {'a': ['a_mod'], 'b': ['b_mod']}, self.edges)
+
+    def test_self_cumulative_transitive(self):
+        results = self.profiler.profile()
+        self.assertEqual(results['b']['self_us'], 600)  # b_mod + inner
+        self.assertEqual(results['b']['cumulative_us'], 600)
+        self.assertEqual(results['a']['self_us'], 1000)
+        self.assertEqual(results['a']['cumulative_us'], 1600)
+        self.assertEqual(results['a']['transitive_us'], 1600)
+        self.assertTrue(results['a']['top_level'])
+        self.assertFalse(results['b']['top_level'])
+
+    def test_packages_restrict_to_closure(self):
+        self.assertEqual(sorted(self.profiler.profile(['B'])), ['b'])
+        self.assertEqual(sorted(self.profiler.profile(['A'])), ['a', 'b'])
+
+
+class TestProfileRunningInterpreter(unittest.TestCase):
+    """Real -X importtime runs against this interpreter."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.patch = patch.object(MagellanConfig, 'cache_dir', self.cache_dir)
+        self.patch.start()
+        self.venv = Environment()
+        self.venv.query_nodes_edges_in_process()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_profile_and_cache(self):
+        profiler = ImportProfiler(self.venv)
+        results = profiler.profile(['mock'])
+        self.assertGreater(results['mock']['cumulative_us'], 0)
+        self.assertEqual(results['mock']['errors'], [])
+
+        with patch.object(ImportProfiler, 'run_import') as run_import:
+            again = ImportProfiler(self.venv).profile(['mock'])
+        self.assertFalse(run_import.called)  # from cache
+        self.assertEqual(again['mock']['self_us'],
+                         results['mock']['self_us'])
+
+    def test_import_failure_reported(self):
+        run = ImportProfiler(self.venv).run_import('no_such_module_xyz')
+        self.assertIn('ModuleNotFoundError', run['error'])
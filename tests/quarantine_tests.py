@@ -0,0 +1,189 @@
+"""
+Test suite for the quarantine module and install deadlines.
+
+Tests are for Quarantine class, killing overrunning commands with their
+children (utils.run_in_subprocess, run_in_subp_ret_json) and quarantining in
+DepTools with installs replaced.
+"""
+
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from mock import patch
+
+from magellan.deps_utils import DepTools
+from magellan.env_utils import Environment
+from magellan.quarantine import MAX_QUARANTINE_DAYS, Quarantine
+from magellan.utils import (CommandTimeout, MagellanConfig,
+                            run_in_subp_ret_json, run_in_subprocess)
+
+NOW = 1000000.0
+
+
+class TestQuarantine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.quarantine = Quarantine(os.path.join(self.tmp, 'q.json'))
+        self.hours = patch.object(MagellanConfig, 'quarantine_hours', 2)
+        self.hours.start()
+
+    def tearDown(self):
+        self.hours.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_record_check(self):
+        entry = self.quarantine.record('Foo', '1.0', 'boom', now=NOW)
+        self.assertEqual(entry['retry_after'], NOW + 2 * 3600)
+        self.assertEqual(entry['interpreter'], Quarantine.interpreter())
+
+        self.assertEqual(self.quarantine.check('foo', '1.0', now=NOW + 60),
+                         entry)
+        self.assertIsNone(self.quarantine.check('foo', '1.0',
+                                                now=NOW + 2 * 3600 + 1))
+        self.assertIsNone(self.quarantine.check('foo', '2.0', now=NOW))
+        self.assertIsNone(self.quarantine.check('foo', '1.0', 'other',
+                                                now=NOW))
+
+    def test_backoff(self):
+        for _ in range(3):
+            entry = self.quarantine.record('foo', '1.0', 'boom', now=NOW)
+        self.assertEqual(entry['failures'], 3)
+        self.assertEqual(entry['retry_after'], NOW + 8 * 3600)
+
+        for _ in range(20):
+            entry = self.quarantine.record('foo', '1.0', 'boom', now=NOW)
+        self.assertEqual(entry['retry_after'],
+                         NOW + MAX_QUARANTINE_DAYS * 24 * 3600)
+
+    def test_clear(self):
+        self.quarantine.record('foo', '1.0', 'boom', now=NOW)
+        self.quarantine.record('bar', '1.0', 'boom', now=NOW)
+        self.quarantine.clear('foo', '1.0')
+        self.assertIsNone(self.quarantine.check('foo', '1.0', now=NOW))
+        self.assertTrue(self.quarantine.check('bar', '1.0', now=NOW))
+
+    def test_unwritable(self):
+        q = Quarantine('/nonexistent/q.json')
+        q.record('foo', '1.0', 'boom')
+        self.assertIsNone(q.check('foo', '1.0'))
+
+
+class TestCommandTimeout(unittest.TestCase):
+
+    def _assert_gone(self, pid_file):
+        with open(pid_file) as f:
+            pid = int(f.read())
+        for _ in range(50):
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                return
+            time.sleep(0.1)
+        self.fail("child {} still running".format(pid))
+
+    @unittest.skipUnless(hasattr(os, 'killpg'), "needs process groups")
+    def test_process_tree_killed(self):
+        pid_file = tempfile.mktemp()
+        start = time.time()
+        with self.assertRaises(CommandTimeout):
+            run_in_subprocess(
+                "sh -c 'sleep 30 & echo $! > {}; wait'".format(pid_file),
+                timeout=0.5)
+        self.assertLess(time.time() - start, 10)
+        self._assert_gone(pid_file)
+        os.remove(pid_file)
+
+    def test_within_deadline(self):
+        self.assertEqual(run_in_subprocess("sh -c 'exit 3'", timeout=10), 3)
+
+    def test_json_killed(self):
+        start = time.time()
+        with self.assertRaises(CommandTimeout):
+            run_in_subp_ret_json(
+                '{} -c "import time; time.sleep(30)"'.format(sys.executable),
+                timeout=0.5)
+        self.assertLess(time.time() - start, 10)
+
+
+class TestDepToolsQuarantine(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(MagellanConfig, 'cache_dir', self.cache_dir),
+            patch.object(MagellanConfig, 'wheel_store_size', 0),
+            patch.object(DepTools, 'get_static_deps', return_value={}),
+            patch.object(Environment, 'backend')]
+        for p in self.patches:
+            p.start()
+        backend = Environment.backend.return_value
+        backend.python_cmd.return_value = shlex.quote(sys.executable)
+        backend.base_python_cmd.return_value = shlex.quote(sys.executable)
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_failed_install_recorded_then_cleared(self):
+        with patch.object(Environment, 'vex_install_requirement',
+                          return_value=1):
+            self.assertEqual(
+                DepTools._install_and_interrogate('foo', '1.0', 'env', ''),
+                {})
+        entry = Quarantine().check('foo', '1.0')
+        self.assertIn('exited with 1', entry['error'])
+
+        with patch.object(Environment, 'vex_install_requirement',
+                          return_value=0), \
+                patch.object(MagellanConfig, 'retry_quarantined', True), \
+                patch('magellan.deps_utils.run_in_subp_ret_json',
+                      return_value={'requires': {}}):
+            self.assertEqual(
+                DepTools._install_and_interrogate('foo', '1.0', 'env', ''),
+                {'requires': {}})
+        self.assertIsNone(Quarantine().check('foo', '1.0'))
+
+    def test_timeout_recorded(self):
+        with patch.object(Environment, 'vex_install_requirement',
+                          side_effect=CommandTimeout('killed after 1s')):
+            DepTools._install_and_interrogate('foo', '1.0', 'env', '')
+        self.assertEqual(Quarantine().check('foo', '1.0')['error'],
+                         'killed after 1s')
+
+    def test_quarantined_skipped(self):
+        """before any env is borrowed or made for the install"""
+        Quarantine().record('foo', '1.0', 'boom')
+        with patch('magellan.deps_utils.TempEnvPool') as pool, \
+                patch.object(Environment,
+                             'create_vex_new_virtual_env') as create:
+            self.assertEqual(DepTools.get_deps_for_package_version(
+                'foo', '1.0'), {})
+            with patch.object(MagellanConfig, 'env_pool_size', 0):
+                self.assertEqual(DepTools.get_deps_for_package_version(
+                    'foo', '1.0'), {})
+        self.assertFalse(pool.shared.called)
+        self.assertFalse(create.called)
+
+        with patch('magellan.deps_utils.TempEnvPool') as pool, \
+                patch.object(DepTools, '_install_and_interrogate',
+                             return_value={}) as install, \
+                patch.object(MagellanConfig, 'retry_quarantined', True):
+            DepTools.get_deps_for_package_version('foo', '1.0')
+        self.assertTrue(install.called)
+
+    def test_keyed_on_base_interpreter(self):
+        """a failure with another python doesn't skip this one"""
+        Quarantine().record('foo', '1.0', 'boom', interpreter='other_python')
+        with patch('magellan.deps_utils.TempEnvPool'), \
+                patch.object(DepTools, '_install_and_interrogate',
+                             return_value={}) as install:
+            DepTools.get_deps_for_package_version('foo', '1.0')
+        self.assertTrue(install.called)
+        self.assertEqual(install.call_args[0][4],
+                         Quarantine.interpreter(shlex.quote(sys.executable)))
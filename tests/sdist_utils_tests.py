@@ -0,0 +1,197 @@
+"""
+Test suite for the sdist_utils module.
+
+Tests are for reading requirements from sdists built in memory, and the
+SdistHelper class with the download replaced.
+"""
+
+import hashlib
+import io
+import tarfile
+import unittest
+import zipfile
+from mock import MagicMock, patch
+
+from magellan.deps_utils import DepTools, PyPIHelper
+from magellan.sdist_utils import (SdistHelper, read_sdist_files,
+                                  requirements_from_sdist_files, sdist_file,
+                                  tomllib)
+from magellan.utils import MagellanConfig
+
+OLD_PKG_INFO = """Metadata-Version: 1.1
+Name: foo
+Version: 1.0
+"""
+
+NEW_PKG_INFO = """Metadata-Version: 2.2
+Name: foo
+Version: 1.0
+"""
+
+
+def _tar_gz(files, top='foo-1.0'):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tf:
+        for name, text in sorted(files.items()):
+            data = text.encode('utf-8')
+            info = tarfile.TarInfo("{}/{}".format(top, name))
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def _zip(files, top='foo-1.0'):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        for name, text in files.items():
+            zf.writestr("{}/{}".format(top, name), text)
+    return buf.getvalue()
+
+
+class TestReadSdistFiles(unittest.TestCase):
+
+    files = {'PKG-INFO': OLD_PKG_INFO,
+             'setup.py': 'setup()',
+             'foo/__init__.py': '',
+             'foo/PKG-INFO': 'not this one',
+             'src/foo.egg-info/requires.txt': 'six'}
+
+    def test_tar(self):
+        found = read_sdist_files(io.BytesIO(_tar_gz(self.files)),
+                                 'foo-1.0.tar.gz')
+        self.assertEqual(sorted(found),
+                         ['PKG-INFO', 'src/foo.egg-info/requires.txt'])
+
+    def test_zip_unseekable(self):
+        stream = MagicMock()
+        stream.read.return_value = _zip(self.files)
+        stream.seekable.return_value = False
+        found = read_sdist_files(stream, 'foo-1.0.zip')
+        self.assertEqual(found['src/foo.egg-info/requires.txt'], 'six')
+
+    def test_sdist_file(self):
+        files = [{'filename': 'foo-1.0-py3-none-any.whl'},
+                 {'filename': 'foo-1.0.zip'}, {'filename': 'foo-1.0.tar.gz'}]
+        self.assertEqual(sdist_file(files)['filename'], 'foo-1.0.tar.gz')
+        self.assertIsNone(sdist_file(files[:1]))
+
+
+class TestRequirementsFromSdistFiles(unittest.TestCase):
+
+    def _requires(self, files):
+        result, source = requirements_from_sdist_files(files)
+        return sorted(result.get('requires', {})), source
+
+    def test_pkg_info_requires_dist(self):
+        files = {'PKG-INFO': OLD_PKG_INFO + 'Requires-Dist: six\n',
+                 'foo.egg-info/requires.txt': 'ignored'}
+        self.assertEqual(self._requires(files), (['six'], 'PKG-INFO'))
+
+    def test_pkg_info_2_2_empty(self):
+        """metadata 2.2 without Requires-Dist has none, unless Dynamic"""
+        self.assertEqual(self._requires({'PKG-INFO': NEW_PKG_INFO}),
+                         ([], 'PKG-INFO'))
+        self.assertEqual(self._requires(
+            {'PKG-INFO': NEW_PKG_INFO + 'Dynamic: Requires-Dist\n'}),
+            ([], None))
+
+    def test_egg_info(self):
+        files = {'PKG-INFO': OLD_PKG_INFO,
+                 'foo.egg-info/PKG-INFO': OLD_PKG_INFO,
+                 'foo.egg-info/requires.txt':
+                     'six>=1.0\n\n[:python_version < "3"]\nenum34\n'
+                     '[test]\npytest\n'}
+        result, source = requirements_from_sdist_files(files)
+        self.assertEqual(source, 'foo.egg-info/requires.txt')
+        self.assertEqual(result['requires'],
+                         {'six': {'project_name': 'six', 'key': 'six',
+                                  'specs': [('>=', '1.0')]}})
+        self.assertEqual(result['project_name'], 'foo')
+        self.assertEqual(result['version'], '1.0')
+
+    def test_egg_info_without_requires(self):
+        files = {'PKG-INFO': OLD_PKG_INFO,
+                 'foo.egg-info/PKG-INFO': OLD_PKG_INFO}
+        self.assertEqual(self._requires(files),
+                         ([], 'foo.egg-info/requires.txt'))
+
+    @unittest.skipIf(tomllib is None, "needs tomllib or tomli")
+    def test_pyproject(self):
+        files = {'PKG-INFO': OLD_PKG_INFO,
+                 'pyproject.toml': '[project]\nname = "foo"\n'
+                                   'dependencies = ["six", "requests>=2"]\n',
+                 'setup.cfg': '[options]\ninstall_requires = ignored\n'}
+        self.assertEqual(self._requires(files),
+                         (['requests', 'six'], 'pyproject.toml'))
+
+        files['pyproject.toml'] = '[project]\ndynamic = ["dependencies"]\n'
+        self.assertEqual(self._requires(files), (['ignored'], 'setup.cfg'))
+
+    def test_setup_cfg(self):
+        files = {'PKG-INFO': OLD_PKG_INFO,
+                 'setup.cfg': '[options]\ninstall_requires =\n    six\n'
+                              '    enum34; python_version < "3"\n'}
+        self.assertEqual(self._requires(files), (['six'], 'setup.cfg'))
+
+        files['setup.cfg'] = '[options]\ninstall_requires = six; requests\n'
+        self.assertEqual(self._requires(files),
+                         (['requests', 'six'], 'setup.cfg'))
+
+        files['setup.cfg'] = '[options]\ninstall_requires = file: reqs.txt\n'
+        self.assertEqual(self._requires(files), ([], None))
+
+    def test_only_setup_py(self):
+        self.assertEqual(self._requires({'PKG-INFO': OLD_PKG_INFO}),
+                         ([], None))
+
+
+class TestSdistHelper(unittest.TestCase):
+
+    def setUp(self):
+        self.data = _tar_gz({'PKG-INFO': OLD_PKG_INFO,
+                             'foo.egg-info/requires.txt': 'six\n'})
+        self.info = {'filename': 'foo-1.0.tar.gz',
+                     'url': 'https://example.invalid/foo-1.0.tar.gz',
+                     'digests': {'sha256':
+                                 hashlib.sha256(self.data).hexdigest()}}
+
+    def _response(self):
+        return MagicMock(status_code=200, raw=io.BytesIO(self.data))
+
+    def test_streamed_and_checked(self):
+        with patch('requests.get', return_value=self._response()):
+            result = SdistHelper.get_deps_from_sdist('foo', '1.0',
+                                                     [self.info])
+        self.assertEqual(sorted(result['requires']), ['six'])
+
+        self.info['digests']['sha256'] = 'bad'
+        with patch('requests.get', return_value=self._response()):
+            self.assertEqual(
+                SdistHelper.get_deps_from_sdist('foo', '1.0', [self.info]),
+                {})
+
+    def test_content_encoding_not_undone(self):
+        """a .tar.gz served with Content-Encoding: gzip is hashed as is"""
+        raw = MagicMock()
+        raw.read.side_effect = io.BytesIO(self.data).read
+        raw.decode_content = False
+        with patch('requests.get', return_value=MagicMock(
+                status_code=200, raw=raw)) as get:
+            result = SdistHelper.get_deps_from_sdist('foo', '1.0',
+                                                     [self.info])
+        self.assertEqual(sorted(result['requires']), ['six'])
+        self.assertFalse(raw.decode_content)
+        self.assertEqual(get.call_args[1]['headers'],
+                         {'Accept-Encoding': 'identity'})
+
+    def test_used_before_install(self):
+        with patch.object(MagellanConfig, 'cache_dir', '/nonexistent'), \
+                patch.object(MagellanConfig, 'json_metadata', False), \
+                patch.object(PyPIHelper, 'acquire_package_json_info',
+                             return_value={'releases': {'1.0': [self.info]}}), \
+                patch('requests.get', return_value=self._response()), \
+                patch.object(DepTools, '_install_and_interrogate') as install:
+            result = DepTools.get_deps_for_package_version('foo', '1.0')
+        self.assertFalse(install.called)
+        self.assertEqual(sorted(result['requires']), ['six'])
+        self.assertEqual(result['source'], 'sdist')
@@ -0,0 +1,169 @@
+"""
+Test suite for the wheel_store module.
+
+Tests are for WheelStore class and its use when installing sdist-only
+releases (DepTools._built_wheel) and reading their metadata, with pip's
+build replaced.
+"""
+
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import zipfile
+from mock import MagicMock, patch
+
+from magellan.deps_utils import DepTools, PyPIHelper
+from magellan.env_utils import Environment
+from magellan.quarantine import Quarantine
+from magellan.utils import MagellanConfig
+from magellan.wheel_store import WheelStore
+from magellan.wheel_utils import WheelHelper
+
+SHA = 'ab' * 32
+RELEASE = {'releases': {'1.0': [{'filename': 'foo-1.0.tar.gz',
+                                 'digests': {'sha256': SHA}}]}}
+
+
+def _make_wheel(directory, name='foo-1.0-py3-none-any.whl', padding=0):
+    path = os.path.join(directory, name)
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('foo-1.0.dist-info/METADATA',
+                    'Metadata-Version: 2.1\nName: foo\nVersion: 1.0\n'
+                    'Requires-Dist: six\n')
+        zf.writestr('foo/data.bin', b'x' * padding)
+    return path
+
+
+class TestWheelStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = WheelStore(os.path.join(self.tmp, 'store'),
+                                max_size=10 ** 9)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_interpreter_tag(self):
+        tag = WheelStore.interpreter_tag(shlex.quote(sys.executable))
+        self.assertTrue(tag.startswith(sys.implementation.cache_tag.replace(
+            '-', '_')))
+        self.assertRegex(tag, r'^[A-Za-z0-9_]+$')
+
+    def test_add_get_find(self):
+        stored = self.store.add(SHA, 'tag_a', _make_wheel(self.tmp))
+        self.assertEqual(self.store.get(SHA, 'tag_a'), stored)
+        self.assertTrue(stored.startswith(
+            os.path.join(self.store.root, 'tag_a', 'ab', SHA)))
+        self.assertIsNone(self.store.get(SHA, 'tag_b'))
+        self.assertEqual(self.store.find(SHA), stored)
+        self.assertIsNone(self.store.find('cd' * 32))
+
+    def test_evict_least_recently_used(self):
+        paths = []
+        for i, sha in enumerate(['aa' * 32, 'bb' * 32, 'cc' * 32]):
+            paths.append(self.store.add(
+                sha, 'tag', _make_wheel(self.tmp, padding=10000)))
+            os.utime(paths[-1], (time.time() - 100 + i,) * 2)
+        self.store.get('aa' * 32, 'tag')  # used: now most recent
+
+        size = os.path.getsize(paths[0])
+        self.assertEqual(self.store.evict(max_size=2 * size), 1)
+        self.assertIsNone(self.store.get('bb' * 32, 'tag'))
+        self.assertTrue(self.store.get('aa' * 32, 'tag'))
+        self.assertTrue(self.store.get('cc' * 32, 'tag'))
+
+    def test_added_wheel_kept(self):
+        self.store.max_size = 1
+        stored = self.store.add(SHA, 'tag', _make_wheel(self.tmp))
+        self.assertEqual(self.store.get(SHA, 'tag'), stored)
+
+
+class TestBuiltWheelReuse(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        backend = MagicMock()
+        backend.python_cmd.return_value = shlex.quote(sys.executable)
+        backend.base_python_cmd.return_value = shlex.quote(sys.executable)
+        backend.pip_cmd.return_value = 'pip'
+        self.builds = []
+        self.build_fails = False
+        self.patches = [
+            patch.object(MagellanConfig, 'cache_dir', self.cache_dir),
+            patch.object(MagellanConfig, 'wheel_store_size', 10 ** 9),
+            patch.object(PyPIHelper, 'acquire_package_json_info',
+                         return_value=RELEASE),
+            patch.object(Environment, 'backend', return_value=backend),
+            patch('magellan.deps_utils.run_in_subprocess',
+                  side_effect=self._pip_wheel)]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def _pip_wheel(self, cmd, timeout=None):
+        self.builds.append(cmd)
+        if self.build_fails:
+            return 1
+        args = shlex.split(cmd)
+        _make_wheel(args[args.index('-w') + 1])
+        return 0
+
+    def test_built_once_then_installed_from_store(self):
+        with patch.object(Environment, 'vex_install_requirement',
+                          return_value=0) as install, \
+                patch('magellan.deps_utils.run_in_subp_ret_json',
+                      return_value={}):
+            DepTools._install_and_interrogate('foo', '1.0', 'env1', '')
+            DepTools._install_and_interrogate('foo', '1.0', 'env2', '')
+
+        self.assertEqual(len(self.builds), 1)
+        self.assertIn('wheel --no-deps --no-binary foo', self.builds[0])
+        stored = WheelStore().find(SHA)
+        self.assertEqual([c[0][1] for c in install.call_args_list],
+                         [stored, stored])
+
+    def test_failed_build_not_retried_by_install(self):
+        self.build_fails = True
+        with patch.object(Environment, 'vex_install_requirement') as install:
+            self.assertEqual(
+                DepTools._install_and_interrogate('foo', '1.0', 'env', ''),
+                {})
+        self.assertEqual(len(self.builds), 1)
+        self.assertFalse(install.called)
+        self.assertIn('pip wheel foo==1.0 exited with 1',
+                      Quarantine().check('foo', '1.0')['error'])
+
+    def test_metadata_read_from_store(self):
+        WheelStore().add(SHA, 'some_tag', _make_wheel(self.cache_dir))
+        result = WheelHelper.get_deps_from_wheel(
+            'foo', '1.0', RELEASE['releases']['1.0'])
+        self.assertEqual(sorted(result['requires']), ['six'])
+
+    def test_index_wheel_installed_instead(self):
+        """only sdist-only releases (for the env's python) are built"""
+        files = RELEASE['releases']['1.0'] + [
+            {'filename': 'foo-1.0-py3-none-any.whl'}]
+        with patch.object(PyPIHelper, 'acquire_package_json_info',
+                          return_value={'releases': {'1.0': files}}):
+            self.assertIsNone(DepTools._built_wheel('foo', '1.0', 'env', ''))
+        self.assertEqual(self.builds, [])
+
+        files[-1] = {'filename': 'foo-1.0-cp27-cp27m-win32.whl'}
+        with patch.object(PyPIHelper, 'acquire_package_json_info',
+                          return_value={'releases': {'1.0': files}}):
+            self.assertTrue(DepTools._built_wheel('foo', '1.0', 'env', ''))
+        self.assertEqual(len(self.builds), 1)
+
+    def test_disabled(self):
+        with patch.object(MagellanConfig, 'wheel_store_size', 0):
+            self.assertIsNone(DepTools._built_wheel('foo', '1.0', 'env', ''))
+        self.assertEqual(self.builds, [])
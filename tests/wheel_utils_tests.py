@@ -0,0 +1,295 @@
+"""
+Test suite for the wheel_utils module.
+
+Tests are for best_wheel, the WheelHelper class and its use by
+DepTools.get_deps_for_package_version, on wheels built in a temp dir, some
+served by a local stand-in index.
+"""
+
+import functools
+import hashlib
+import http.server
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+from mock import MagicMock, patch
+
+from magellan.deps_utils import DepTools, PyPIHelper
+from magellan.env_utils import Environment
+from magellan.utils import MagellanConfig
+from magellan.wheel_utils import WheelHelper, best_wheel
+
+METADATA = """Metadata-Version: 2.1
+Name: Foo_Bar
+Version: 1.2.0
+Requires-Dist: six (>=1.9)
+Requires-Dist: enum34 ; python_version < "3.4"
+Requires-Dist: pytest ; extra == 'test'
+"""
+
+
+def _make_wheel(path, metadata=METADATA):
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('foo_bar/__init__.py', '')
+        zf.writestr('foo_bar-1.2.0.dist-info/METADATA', metadata)
+        zf.writestr('foo_bar-1.2.0.dist-info/RECORD', '')
+
+
+class TestBestWheel(unittest.TestCase):
+
+    files = [{'filename': 'foo-1.0.tar.gz'},
+             {'filename': 'foo-1.0-cp37-cp37m-manylinux1_x86_64.whl'},
+             {'filename': 'foo-1.0-cp37-cp37m-win_amd64.whl'},
+             {'filename': 'foo-1.0-py2.py3-none-any.whl'}]
+
+    def test_pure_preferred(self):
+        self.assertEqual(best_wheel(self.files, '3.7')['filename'],
+                         'foo-1.0-py2.py3-none-any.whl')
+
+    def test_platform_wheel(self):
+        self.assertEqual(
+            best_wheel(self.files[:3], '3.7', 'linux')['filename'],
+            'foo-1.0-cp37-cp37m-manylinux1_x86_64.whl')
+
+    def test_abi3_wheel(self):
+        files = [{'filename': 'foo-1.0-cp38-abi3-manylinux1_x86_64.whl'}]
+        self.assertTrue(best_wheel(files, '3.11', 'linux', any_wheel=False))
+        self.assertIsNone(best_wheel(files, '3.7', 'linux', any_wheel=False))
+
+    def test_only_installable(self):
+        self.assertIsNone(best_wheel(self.files[:3], '3.9', 'linux',
+                                     any_wheel=False))
+        self.assertTrue(best_wheel(self.files[:3], '3.9', 'linux'))
+
+    def test_sdist_only(self):
+        self.assertIsNone(best_wheel(self.files[:1]))
+        self.assertIsNone(best_wheel(None))
+
+
+class TestWheelHelper(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.patch = patch.object(MagellanConfig, 'cache_dir', self.cache_dir)
+        self.patch.start()
+        os.makedirs(WheelHelper.wheel_dir())
+        self.wheel = os.path.join(WheelHelper.wheel_dir(),
+                                  'Foo_Bar-1.2-py3-none-any.whl')
+        _make_wheel(self.wheel)
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_find_local_wheel(self):
+        """name normalised, version compared as a version"""
+        self.assertEqual(WheelHelper.find_local_wheel('foo-bar', '1.2.0'),
+                         self.wheel)
+        self.assertIsNone(WheelHelper.find_local_wheel('foo-bar', '1.3'))
+
+    def test_deps_from_local_wheel(self):
+        with patch('requests.get') as get:
+            result = WheelHelper.get_deps_from_wheel('foo-bar', '1.2.0')
+        self.assertFalse(get.called)
+        self.assertEqual(result['project_name'], 'Foo-Bar')
+        self.assertEqual(result['version'], '1.2.0')
+        self.assertEqual(sorted(result['requires']), ['six'])
+        self.assertEqual(result['requires']['six'],
+                         {'project_name': 'six', 'key': 'six',
+                          'specs': [('>=', '1.9')]})
+
+    def test_download_checks_sha256(self):
+        with open(self.wheel, 'rb') as f:
+            content = f.read()
+        response = MagicMock(status_code=200)
+        response.iter_content.return_value = [content]
+        info = {'filename': 'foo_bar-1.2.0-py3-none-any.whl',
+                'url': 'https://example.invalid/foo_bar.whl',
+                'digests': {'sha256': 'bad'}}
+
+        with patch('requests.get', return_value=response):
+            self.assertIsNone(WheelHelper.download_wheel(info))
+            info['digests']['sha256'] = hashlib.sha256(content).hexdigest()
+            path = WheelHelper.download_wheel(info)
+
+        self.assertEqual(WheelHelper.read_metadata(path), METADATA)
+        self.assertEqual(sorted(os.listdir(WheelHelper.wheel_dir())),
+                         ['Foo_Bar-1.2-py3-none-any.whl',
+                          'foo_bar-1.2.0-py3-none-any.whl'])  # no tmp files
+
+
+class TestGetDepsFastPath(unittest.TestCase):
+    """DepTools.get_deps_for_package_version only installs sdist-only
+    releases."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(MagellanConfig, 'cache_dir', self.cache_dir),
+            patch.object(MagellanConfig, 'json_metadata', False)]
+        for p in self.patches:
+            p.start()
+        os.makedirs(WheelHelper.wheel_dir())
+        _make_wheel(os.path.join(WheelHelper.wheel_dir(),
+                                 'foo_bar-1.2.0-py3-none-any.whl'))
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.cache_dir)
+
+    @patch.object(PyPIHelper, 'acquire_package_json_info', return_value={})
+    def test_wheel_no_install_and_cached(self, _):
+        with patch.object(Environment, 'create_vex_new_virtual_env') as c:
+            result = DepTools.get_deps_for_package_version('foo-bar', '1.2.0')
+        self.assertFalse(c.called)
+        self.assertEqual(sorted(result['requires']), ['six'])
+        self.assertEqual(result['source'], 'wheel')
+        self.assertTrue(os.path.exists(os.path.join(
+            self.cache_dir, 'foo-bar_1_2_0_req.json')))
+
+    @patch.object(PyPIHelper, 'acquire_package_json_info', return_value={
+        'releases': {'0.1': [{'filename': 'baz-0.1.tar.gz'}]}})
+    def test_sdist_only_installed(self, _):
+        with patch.object(MagellanConfig, 'env_pool_size', 0), \
+                patch.object(MagellanConfig, 'pip_update', False), \
+                patch.object(Environment, 'create_vex_new_virtual_env'), \
+                patch.object(DepTools, '_install_and_interrogate',
+                             return_value={}) as install:
+            DepTools.get_deps_for_package_version('baz', '0.1')
+        self.assertEqual(install.call_args[0][:2], ('baz', '0.1'))
+
+
+class _RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Static files with Range support (which SimpleHTTPRequestHandler
+    lacks), recording the requests made."""
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        self.server.seen.append((self.command, self.path,
+                                 self.headers.get('Range')))
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        ranged = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+        if ranged and self.server.ranges:
+            start, end = int(ranged.group(1)), int(ranged.group(2))
+            data_out = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, start + len(data_out) - 1, len(data)))
+        else:
+            data_out = data
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data_out)))
+        self.end_headers()
+        self.server.sent += len(data_out) if self.command == 'GET' else 0
+        return io.BytesIO(data_out)
+
+
+class TestRemoteMetadata(unittest.TestCase):
+    """Fetching only a wheel's METADATA from a local stand-in index."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), functools.partial(_RangeHandler,
+                                                directory=cls.root))
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+        # a wheel laid out as bdist_wheel does, dist-info last:
+        cls.wheel = os.path.join(cls.root, 'foo_bar-1.2.0-py3-none-any.whl')
+        with zipfile.ZipFile(cls.wheel, 'w') as zf:
+            zf.writestr('foo_bar/__init__.py', 'import six\n')
+            zf.writestr('foo_bar/_blob.bin', os.urandom(1024 * 1024))
+            for i in range(200):
+                zf.writestr('foo_bar/mod{}.py'.format(i), '# {}\n'.format(i))
+            zf.writestr('foo_bar-1.2.0.dist-info/METADATA', METADATA)
+            zf.writestr('foo_bar-1.2.0.dist-info/WHEEL',
+                        'Wheel-Version: 1.0\nRoot-Is-Purelib: true\n')
+            zf.writestr('foo_bar-1.2.0.dist-info/RECORD', '')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.root)
+
+    def setUp(self):
+        self.server.seen = []
+        self.server.sent = 0
+        self.server.ranges = True
+        self.cache_dir = tempfile.mkdtemp()
+        self.patch = patch.object(MagellanConfig, 'cache_dir', self.cache_dir)
+        self.patch.start()
+        self.info = {
+            'filename': 'foo_bar-1.2.0-py3-none-any.whl',
+            'url': 'http://127.0.0.1:{}/foo_bar-1.2.0-py3-none-any.whl'
+                   .format(self.server.server_address[1]),
+            'size': os.path.getsize(self.wheel)}
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.cache_dir)
+        metadata_file = self.wheel + '.metadata'
+        if os.path.exists(metadata_file):
+            os.remove(metadata_file)
+
+    def _deps(self):
+        return WheelHelper.get_deps_from_wheel('foo-bar', '1.2.0', [self.info])
+
+    def test_core_metadata_file(self):
+        with open(self.wheel + '.metadata', 'w') as f:
+            f.write(METADATA)
+        self.info['core-metadata'] = {
+            'sha256': hashlib.sha256(METADATA.encode()).hexdigest()}
+
+        self.assertEqual(sorted(self._deps()['requires']), ['six'])
+        self.assertEqual([s[1] for s in self.server.seen],
+                         ['/foo_bar-1.2.0-py3-none-any.whl.metadata'])
+
+    def test_core_metadata_bad_hash(self):
+        """falls back to range requests"""
+        with open(self.wheel + '.metadata', 'w') as f:
+            f.write("Name: tampered\n")
+        self.info['core-metadata'] = {'sha256': hashlib.sha256(
+            METADATA.encode()).hexdigest()}
+        self.assertEqual(self._deps()['project_name'], 'Foo-Bar')
+        self.assertTrue(self.server.seen[1][2])
+
+    def test_range_requests(self):
+        """no .metadata: central directory and METADATA only"""
+        result = self._deps()
+        self.assertEqual(sorted(result['requires']), ['six'])
+        self.assertEqual(self.server.seen[0][1],
+                         '/foo_bar-1.2.0-py3-none-any.whl.metadata')
+        self.assertTrue(all(s[2] for s in self.server.seen[1:]))
+        self.assertLess(self.server.sent, self.info['size'] / 10)
+        self.assertFalse(os.listdir(WheelHelper.wheel_dir())
+                         if os.path.isdir(WheelHelper.wheel_dir()) else [])
+
+    def test_size_from_head(self):
+        del self.info['size']
+        self.info['core-metadata'] = False  # not tried
+        self.assertEqual(sorted(self._deps()['requires']), ['six'])
+        self.assertEqual(self.server.seen[0][0], 'HEAD')
+
+    def test_no_range_support(self):
+        """last resort: the whole wheel is downloaded"""
+        self.server.ranges = False
+        self.assertEqual(sorted(self._deps()['requires']), ['six'])
+        self.assertTrue(os.path.exists(os.path.join(
+            WheelHelper.wheel_dir(), self.info['filename'])))